@@ -8,6 +8,8 @@ from .core.BoundingBox import *
 from .core.Layer import *
 from .core.Subdomain import *
 from .core.Scheduler import *
+from .core.WorkerPool import *
+from .core.Distributed import *
 from .lib.LocalOperationExecutors import *
 from .lib.LocalOperationPrimitives import *
 from .lib.FocalOperationExecutors import *
@@ -16,4 +18,9 @@ from .lib.ZonalOperationPrimitives import *
 from .lib.ZonalOperationExecutors import *
 from .lib.GlobalOperationPrimitives import *
 from .lib.OperationIO import *
+from .lib.PipelineOperations import *
 
+# Imported last, PCMLConfig settings are star-imported with the operations and include a lazy flag
+from .core.Lazy import LazyLayer, lazy, materialize
+from .core.Cache import clearcache, resultcache
+from . import aio
@@ -0,0 +1,95 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+
+asyncio front-end for PCML. Raster input/output runs in a pool of I/O threads and operations run
+(one at a time) in a compute thread that hands the work to the configured executor (e.g., the
+persistent pool), so a batch job can read the next input and write the previous output while
+the current operation runs:
+
+    nextlayer = pcml.aio.read_geotiff(filenames[0])
+    for i in range(len(filenames)):
+        layer = await nextlayer
+        if i + 1 < len(filenames):
+            nextlayer = pcml.aio.read_geotiff(filenames[i + 1])  # Prefetch the next input
+        result = await pcml.aio.run(FocalMean_np_exec, layer, buffersize=2)
+        writes.append(pcml.aio.write_geotiff(outnames[i], result))  # Flushed in the background
+    await asyncio.gather(*writes)
+
+Every function returns an awaitable asyncio future.
+"""
+from .core.Scheduler import *
+from .lib.OperationIO import *
+import pcml.core.PCMLConfig as PCMLConfig
+import functools
+
+try:
+    PCMLConfig.asyncioenabled = 1
+    import asyncio
+except ImportError as e:
+    try:
+        import trollius as asyncio  # asyncio backport for Python 2
+    except ImportError as e:
+        PCMLConfig.asyncioenabled = 0
+
+# Threads used for raster input/output
+io_threads = 2
+
+_ioexecutor = None
+_computeexecutor = None
+
+
+def _executors():
+    global _ioexecutor, _computeexecutor
+    if PCMLConfig.asyncioenabled == 0 or PCMLConfig.futuresenabled == 0:
+        PCMLNotSupported("asyncio (trollius in Python 2) and concurrent.futures are required for pcml.aio")
+    if _ioexecutor is None:
+        _ioexecutor = ThreadPoolExecutor(max_workers=io_threads)
+        # A single compute thread keeps operations in order, the executor type provides the parallelism
+        _computeexecutor = ThreadPoolExecutor(max_workers=1)
+    return _ioexecutor, _computeexecutor
+
+
+def _submit(executor, loop, function, *args, **kwargs):
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    return loop.run_in_executor(executor, functools.partial(function, *args, **kwargs))
+
+
+def read_asciigrid(filename, loop=None):
+    """ Read an ASCII grid in an I/O thread, returns a future for the layer """
+    return _submit(_executors()[0], loop, ReadASCIIGrid, filename)
+
+
+def read_geotiff(filename, bandnumber=1, loop=None):
+    """ Read a GeoTIFF band in an I/O thread, returns a future for the layer """
+    return _submit(_executors()[0], loop, ReadGeoTIFF, filename, bandnumber)
+
+
+def write_asciigrid(filename, layer, loop=None):
+    """ Write a layer as an ASCII grid in an I/O thread """
+    return _submit(_executors()[0], loop, WriteASCIIGrid, filename, layer)
+
+
+def write_geotiff(filename, layer, loop=None):
+    """ Write a layer as a GeoTIFF in an I/O thread """
+    return _submit(_executors()[0], loop, WriteGeoTIFF, filename, layer)
+
+
+def run(op, *layers, **kwargs):
+    """ Run the operation op (e.g., LocalSum) on layers in the compute thread, returns a future for the output layer.
+    kwargs are passed to the operation, except loop which selects the event loop.
+    """
+    loop = kwargs.pop('loop', None)
+    return _submit(_executors()[1], loop, op, *layers, **kwargs)
+
+
+def shutdown():
+    """ Stop the I/O and compute threads (they are started again when needed) """
+    global _ioexecutor, _computeexecutor
+    if _ioexecutor is not None:
+        _ioexecutor.shutdown()
+        _computeexecutor.shutdown()
+    _ioexecutor = None
+    _computeexecutor = None
@@ -8,6 +8,8 @@ from ..util.Messaging import *
 from .PCMLPrims import *
 import PCMLConfig as PCMLConfig
 import copy
+import os
+import tempfile
 import multiprocessing as mp
 try:
    PCMLConfig.scipyenabled = 1
@@ -17,6 +19,26 @@ except ImportError as e:
 
 
 
+# Data types layers are stored in, arrays of other types (e.g., int64 or bool) are stored as float64
+layerdtypes = (np.dtype(np.uint8), np.dtype(np.int16), np.dtype(np.int32), np.dtype(np.float32), np.dtype(np.float64))
+
+
+def layerdtype(dtype):
+    """ Return the data type a layer uses to store an array of dtype """
+    dtype = np.dtype(dtype)
+    if dtype in layerdtypes:
+        return dtype
+    return np.dtype(np.float64)
+
+
+def scratchdirectory():
+    """ Directory for memory mapped layers and temporary files (PCMLConfig.scratch_dir) """
+    directory = PCMLConfig.scratch_dir or tempfile.gettempdir()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return directory
+
+
 class BoundingBox(object):
     """
     BoundingBox defines a rectangular location (y,x) + (h,w) and may contain data describing something within its boundaries.
@@ -49,6 +71,13 @@ class BoundingBox(object):
         # Data is held within the internal structure _data
         # and the data structure (e.g., array, list) and type (e.g., location, float, int) must also be described
         self._data = None
+        # When _data is an array in a SharedSegment, other processes can map it using the segment
+        self._segment = None
+        self._segmentshape = None
+        # Backing store of the data, 'shm' or 'memmap' (see allocate_nparray)
+        self._store = None
+        # Content hashes of tiles of rows, (first row, number of rows): hash (see pcml.core.Cache)
+        self._tilehashes = {}
         self.data_structure = Datastructure.array  # FIXME: For now we assume the data_structure is an array
         self.data_type = None
         self.tree = None
@@ -63,21 +92,84 @@ class BoundingBox(object):
     def __repr__(self):
         return "<BoundingBox: (%f,%f) [%f,%f]>" % (self.y, self.x, self.h, self.w)
 
-    def set_nparray(self, nparr, cellsize, nodata_value):
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._segment is not None:
+            # Send a lightweight descriptor instead of the array, the receiving process maps it from the segment
+            elemoffset = (self._data.ctypes.data - self._segment.address) // self._data.itemsize
+            r, c = divmod(elemoffset, self._segmentshape[1])
+            state['_data'] = None
+            state['_segmentview'] = (self._data.dtype.str, r, c, self._data.shape[0], self._data.shape[1])
+        return state
+
+    def __setstate__(self, state):
+        segmentview = state.pop('_segmentview', None)
+        self.__dict__.update(state)
+        if segmentview is not None:
+            dtype, r, c, nrows, ncols = segmentview
+            arr = self._segment.asarray(dtype, self._segmentshape)
+            self._data = arr[r:r + nrows, c:c + ncols]
+
+    def set_nparray(self, nparr, cellsize, nodata_value, store=None):
+        """ Set the data to a copy of nparr, which keeps its data type if it is one of layerdtypes """
         if nparr is None:
             raise PCMLInvalidInput("BoundingBox.set_nparray does not support a nparr of None", nparr)
+        self.allocate_nparray(nparr.shape, cellsize, nodata_value, store=store, dtype=layerdtype(nparr.dtype))
+        self._data[:, :] = nparr
+
+    def allocate_nparray(self, shape, cellsize, nodata_value, store=None, dtype=np.float64):
+        """ Set a zero filled array of the given shape and data type without writing to it.
+        Memory pages are placed when they are first written, by the worker computing them.
+        store selects where the data is held, PCMLConfig.backing_store by default: 'shm' (shared memory) or
+        'memmap' (a file in PCMLConfig.scratch_dir that the operating system pages in and out).
+        Worker processes map the data without copying it in both cases.
+        """
+        self._checkcellsize(cellsize)
+        store = store or PCMLConfig.backing_store
+        dtype = layerdtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        # Data is held in a named shared segment so worker processes can map it without copying
+        if store == 'shm':
+            segment = SharedSegment(nbytes)
+        elif store == 'memmap':
+            segment = SharedSegment(nbytes, directory=scratchdirectory())
+        else:
+            raise PCMLInvalidInput("Unknown backing store (use 'shm' or 'memmap')", store)
+        self._setsegment(segment, shape, dtype, cellsize, nodata_value)
+        self._store = store
+
+    def map_nparray(self, filename, cellsize, nodata_value, shape=None, dtype=np.float64):
+        """ Use the array in a .npy file as the data without reading it, the file is created if shape is given.
+        Operations writing to this layer write directly into the file, a file that cannot be written is mapped read-only.
+        """
+        self._checkcellsize(cellsize)
+        if shape is not None:
+            arr = np.lib.format.open_memmap(filename, mode='w+', dtype=layerdtype(dtype), shape=tuple(shape))
+        else:
+            arr = np.load(filename, mmap_mode='r')  # Only the header is needed
+            if arr.dtype not in layerdtypes or arr.ndim != 2:
+                raise PCMLInvalidInput("Only 2 dimensional arrays of %s can be mapped" % ", ".join(np.dtype(t).name for t in layerdtypes), filename)
+        shape, offset, dtype = arr.shape, arr.offset, arr.dtype
+        del arr
+        directory, name = os.path.split(os.path.abspath(filename))
+        segment = SharedSegment(int(np.prod(shape)) * dtype.itemsize, name=name,
+                                directory=directory, offset=offset, keep=True)
+        self._setsegment(segment, shape, dtype, cellsize, nodata_value)
+        self._store = 'memmap'
+
+    def _checkcellsize(self, cellsize):
         if cellsize is None:
             raise PCMLInvalidInput("BoundingBox.set_nparray does not support a cellsize of None", cellsize)
         if cellsize <= 0:
             raise PCMLInvalidInput("BoundingBox.set_nparray does not support cellsize<=0", cellsize)
 
+    def _setsegment(self, segment, shape, dtype, cellsize, nodata_value):
         self.data_structure = Datastructure.array
-        PCMLNotImplemented("self.data_type is not set")
-        # Unfortunately you cannot hide shared memory in another module as rawarray will return the same reference
-        # It may have to do with saving the __shmem_data variable, could explore this later
-        self.__shmem_data = mp.RawArray(ctypes.c_double, nparr.size)
-        self._data = shmem_as_ndarray(self.__shmem_data).reshape(nparr.shape)
-        self._data[:, :] = nparr
+        self.data_type = dtype
+        self._segment = segment
+        self._segmentshape = tuple(shape)
+        self._data = self._segment.asarray(dtype, shape)
+        self._tilehashes = {}
         self.cellsize = cellsize
         self.nodata_value = nodata_value
         self._reset_dim()
@@ -87,6 +179,8 @@ class BoundingBox(object):
 
     def set_pointlist(self, pointlist, ref=False):
         self.data_structure = Datastructure.pointlist
+        self._segment = None
+        self._segmentshape = None
         # FIXME: Should check if pointlist is a list datastructure
         if not ref:
             self._data = pointlist
@@ -133,13 +227,30 @@ class BoundingBox(object):
             PCMLUserInformation("Updating width from " + str(self.w) + " to " + str(w))
             self.w = w
 
-    def set_data_ref(self, ref):
+    def set_data_ref(self, ref, source=None):
         """
         Set the _data variable to a reference (used for shared memory accesses - particularly subdomains)
+        If source (the object ref was sliced from) holds its data in a shared segment, ref is
+        described by the same segment so that it can be sent to other processes without copying.
         """
         self._data = ref
+        self._segment = None
+        self._segmentshape = None
+        self._tilehashes = {}  # The contents changed, the result cache hashes them again
+        if source is not None and source._segment is not None:
+            self._segment = source._segment
+            self._segmentshape = source._segmentshape
         self._reset_dim()
 
+    def setreadonly(self):
+        """ Make the data read-only, also in other processes mapping its shared segment """
+        self._data.flags.writeable = False
+        if self._segment is not None:
+            self._segment.readonly = True
+
+    def isreadonly(self):
+        return not self._data.flags.writeable or (self._segment is not None and self._segment.readonly)
+
     def get_locval(self, loc):
         newloc = copy.copy(loc)
         newloc['v'] = self._data[loc['r'] - self.r][loc['c'] - self.c]
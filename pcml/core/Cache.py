@@ -0,0 +1,198 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+
+Cache of operation results (enable with PCMLConfig.cache = True).
+Results are found by a key made of the operation, its arguments, the decomposition, the settings that change
+results (see _resultsettings), and a content hash of each input layer. Layers are hashed in tiles of rows and the hash of each tile is kept, so only tiles changed with
+layer.modified() are hashed again. Recently used results are kept in memory (up to PCMLConfig.cache_bytes)
+and also on disk when PCMLConfig.cache_dir is set. Cached layers are shared and therefore read-only, also in
+worker processes, and cannot be the output layer of an operation.
+"""
+from ..util.Messaging import *
+from .PCMLPrims import *
+from .BoundingBox import BoundingBox
+import pcml.core.PCMLConfig as PCMLConfig
+
+import collections
+import cPickle as pickle
+import hashlib
+import os
+import sys
+import tempfile
+import types
+import numpy as np
+
+# xxhash is much faster than sha1 for hashing layer contents
+try:
+    PCMLConfig.xxhashenabled = 1
+    import xxhash
+except ImportError as e:
+    PCMLConfig.xxhashenabled = 0
+
+
+# PCMLConfig settings that change the data type, the values, or the decomposition of operation results
+_resultsettings = ('compute_dtype', 'decomposition_granularity', 'tile_shape')
+
+
+class _Uncacheable(Exception):
+    """ Raised for operation arguments that cannot be described by their content """
+
+
+def _digest(arr):
+    # Hash of the contents of an array
+    arr = np.ascontiguousarray(arr)
+    if PCMLConfig.xxhashenabled:
+        return xxhash.xxh64(arr).hexdigest()
+    return hashlib.sha1(arr).hexdigest()
+
+
+def layerdigest(layer):
+    """ Content hash of an array layer, the hash of each tile of rows is computed once and kept with the layer """
+    if layer.data_structure != Datastructure.array or getattr(layer, 'streamed', False):
+        raise _Uncacheable()
+    arr = layer.get_nparray()
+    rows = max(1, PCMLConfig.cache_tile_rows)
+    tiles = []
+    for r in xrange(0, arr.shape[0], rows):
+        tile = (r, min(rows, arr.shape[0] - r))
+        if tile not in layer._tilehashes:
+            layer._tilehashes[tile] = _digest(arr[r:r + tile[1]])
+        tiles.append(layer._tilehashes[tile])
+    header = (arr.dtype.str, arr.shape, layer.y, layer.x, layer.cellsize, layer.nodata_value)
+    return hashlib.sha1(repr((header, tiles))).hexdigest()
+
+
+def _encode(value):
+    # Stable description of an operation argument (the same in every process and run)
+    if value is None or isinstance(value, (bool, int, long, float, complex, str, unicode)):
+        return repr(value)
+    if isinstance(value, np.dtype) or (isinstance(value, type) and issubclass(value, np.generic)):
+        return "dtype(%s)" % np.dtype(value).str
+    if isinstance(value, np.generic):
+        return "%s(%r)" % (value.dtype.str, value.item())
+    if isinstance(value, (list, tuple)):
+        return "%s(%s)" % (type(value).__name__, ",".join(_encode(v) for v in value))
+    if isinstance(value, dict):
+        return "dict(%s)" % ",".join("%s:%s" % (_encode(k), _encode(v)) for k, v in sorted(value.items()))
+    if isinstance(value, np.ndarray):
+        return "ndarray(%s,%s,%s)" % (value.dtype.str, value.shape, _digest(value))
+    if isinstance(value, BoundingBox):
+        return "layer(%s)" % layerdigest(value)
+    if isinstance(value, types.FunctionType):
+        # Functions such as decompositions are described by name if they can be found by name
+        module = sys.modules.get(value.__module__)
+        if module is not None and getattr(module, value.__name__, None) is value:
+            return "function(%s.%s)" % (value.__module__, value.__name__)
+    raise _Uncacheable()
+
+
+def operationkey(ref, layers, kwargs):
+    """ Return the cache key of operation ref=(module, name) applied to layers with kwargs,
+    None if the result cannot be cached (e.g., an output layer is given or an argument has no stable description)
+    """
+    if kwargs.get('outputlayer') is not None:
+        return None
+    kwargs = dict((key, val) for key, val in kwargs.items() if key != 'layers')
+    decomposition = kwargs.pop('decomposition', None)
+    try:
+        description = (_encode(ref), _encode(kwargs), _encode(decomposition),
+                       [_encode(getattr(PCMLConfig, name)) for name in _resultsettings], [layerdigest(layer) for layer in layers])
+    except _Uncacheable:
+        return None
+    return hashlib.sha1(repr(description)).hexdigest()
+
+
+class ResultCache(object):
+    """ Output layers indexed by operation key, least recently used layers are evicted first """
+
+    def __init__(self):
+        self.layers = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key, extension):
+        return os.path.join(PCMLConfig.cache_dir, key + extension)
+
+    def _keep(self, key, layer):
+        self.layers[key] = layer
+        self.nbytes += layer.get_nparray().nbytes
+        while self.nbytes > PCMLConfig.cache_bytes and self.layers:
+            evicted = self.layers.popitem(last=False)[1]
+            self.nbytes -= evicted.get_nparray().nbytes
+
+    def lookup(self, key):
+        """ Return the layer stored for key or None """
+        layer = self.layers.pop(key, None)
+        if layer is not None:
+            self.layers[key] = layer  # Most recently used
+        elif PCMLConfig.cache_dir is not None:
+            layer = self._read(key)
+            if layer is not None:
+                self._keep(key, layer)
+        if layer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return layer
+
+    def store(self, key, layer):
+        """ Keep layer as the result for key, the layer becomes read-only """
+        if layer.data_structure != Datastructure.array:
+            return
+        layer.setreadonly()
+        if layer.get_nparray().nbytes <= PCMLConfig.cache_bytes:
+            self._keep(key, layer)
+        if PCMLConfig.cache_dir is not None:
+            self._write(key, layer)
+
+    def _write(self, key, layer):
+        # Write to temporary files that are renamed, so a partially written result is never read
+        if not os.path.isdir(PCMLConfig.cache_dir):
+            os.makedirs(PCMLConfig.cache_dir)
+        header = dict(y=layer.y, x=layer.x, h=layer.h, w=layer.w, title=layer.title,
+                      cellsize=layer.cellsize, nodata_value=layer.nodata_value)
+        for extension, write in (('.npy', lambda f: np.save(f, layer.get_nparray())),
+                                 ('.pkl', lambda f: pickle.dump(header, f, pickle.HIGHEST_PROTOCOL))):
+            fd, temp = tempfile.mkstemp(dir=PCMLConfig.cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.rename(temp, self._path(key, extension))
+
+    def _read(self, key):
+        try:
+            with open(self._path(key, '.pkl'), 'rb') as f:
+                header = pickle.load(f)
+            arr = np.load(self._path(key, '.npy'), mmap_mode='r')
+        except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+        from .Layer import Layer  # Layer imports the operations, which import this module
+        layer = Layer(header['y'], header['x'], header['h'], header['w'], header['title'])
+        layer.set_nparray(arr, header['cellsize'], header['nodata_value'])
+        layer.setreadonly()
+        return layer
+
+    def clear(self):
+        self.layers.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+_cache = ResultCache()
+
+
+def resultcache():
+    """ Return the result cache of this process """
+    return _cache
+
+
+def clearcache(disk=False):
+    """ Remove the results in memory, and on disk in PCMLConfig.cache_dir if disk is True """
+    _cache.clear()
+    if disk and PCMLConfig.cache_dir is not None and os.path.isdir(PCMLConfig.cache_dir):
+        for name in os.listdir(PCMLConfig.cache_dir):
+            if name.endswith(('.npy', '.pkl')):
+                os.remove(os.path.join(PCMLConfig.cache_dir, name))
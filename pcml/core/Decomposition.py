@@ -104,7 +104,7 @@ def rowdecomposition(layer, buffersize):
         # Extract an array slice (reference to data in a layer for lower memory overhead)
         # from the layer and set the data reference for the subdomain to use
         arrslice = layer.slice_nparray(r, 0, nrows, ncols)
-        subdomain.set_data_ref(arrslice)
+        subdomain.set_data_ref(arrslice, source=layer)
 
         # Add the subdomain to the list
         subdomainlist.append(subdomain)
@@ -187,7 +187,7 @@ def columndecomposition(layer, buffersize):
         # Extract an array slice (reference to data in a layer for lower memory overhead)
         # from the layer and set the data reference for the subdomain to use
         arrslice = layer.slice_nparray(0, c, nrows, ncols)
-        subdomain.set_data_ref(arrslice)
+        subdomain.set_data_ref(arrslice, source=layer)
 
         # Add the subdomain to the list
         subdomainlist.append(subdomain)
@@ -195,6 +195,65 @@ def columndecomposition(layer, buffersize):
     return subdomainlist
 
 
+# Take a layer and return a list of rectangular tiles (row major), each with a halo of buffersize cells on all four sides
+def tiledecomposition(layer, buffersize):
+
+    # Tile decomposition supports pointlist only for globalclass operations
+    if layer.data_structure == Datastructure.pointlist:
+        globalpointlistdecomposition(layer, buffersize)
+
+    assert(layer.data_structure == Datastructure.array), "Data structure is not an array"
+
+    # If global then buffer size is infinite as all subdomains will have all data
+    if buffersize < 0:  # This indicates the buffer should be infinite sized (global/zonal operation)
+        buffersize = 9999999999999
+
+    assert(layer.nrows is not None), "Layer number of rows (nrows) is None"
+    assert(layer.ncols is not None), "Layer number of columns (ncols) is None"
+
+    # Rows and columns of each tile, square tiles of decomposition_granularity by default
+    tilerows, tilecols = PCMLConfig.tile_shape or (PCMLConfig.decomposition_granularity, PCMLConfig.decomposition_granularity)
+    numtilerows = int(math.ceil(float(layer.nrows) / float(tilerows)))
+    numtilecols = int(math.ceil(float(layer.ncols) / float(tilecols)))
+
+    subdomainlist = []
+    for sdind in xrange(numtilerows * numtilecols):
+        # First row and column of the tile
+        r = tilerows * (sdind // numtilecols)
+        c = tilecols * (sdind % numtilecols)
+
+        # Grow the tile by the buffer on every side, clipped at the edges of the layer
+        new_r = max(0, r - buffersize)
+        new_c = max(0, c - buffersize)
+        nrows = min(layer.nrows, r + tilerows + buffersize) - new_r
+        ncols = min(layer.ncols, c + tilecols + buffersize) - new_c
+        r = new_r
+        c = new_c
+
+        # Sanity check
+        assert(r + nrows <= layer.nrows), "Number of rows for layer is less than total for subdomains"
+        assert(c + ncols <= layer.ncols), "Number of columns in layer is less than total for subdomains"
+
+        # Create a subdomain and populate it with the correct attribute values
+        subdomain = Subdomain(layer.y + r * layer.cellsize, layer.x + c * layer.cellsize,
+                              nrows * layer.cellsize, ncols * layer.cellsize, layer.title + " subdomain " + str(sdind))
+        subdomain.cellsize = layer.cellsize
+        subdomain.nodata_value = layer.nodata_value
+        subdomain.r = r
+        subdomain.c = c
+        subdomain.nrows = nrows
+        subdomain.ncols = ncols
+
+        # Extract an array slice (reference to data in a layer for lower memory overhead)
+        # from the layer and set the data reference for the subdomain to use
+        arrslice = layer.slice_nparray(r, c, nrows, ncols)
+        subdomain.set_data_ref(arrslice, source=layer)
+
+        subdomainlist.append(subdomain)
+
+    return subdomainlist
+
+
 # point decomposition using row strategy
 def pointrowdecomposition(layer, buffersize):
     subdomainlist = []
@@ -219,8 +278,8 @@ def pointrowdecomposition(layer, buffersize):
         for point in layer.get_pointlist():
             if subdomain.isinsidebounds(point, usehalo=True):
                 pointlist.append(point.copy())
-        # if serial execution then subdomains will need only ordinary list or else a multiprocessing list implementation
-        if PCMLConfig.exectype == ExecutorType.serialpython:
+        # if serial, threaded, or distributed execution then subdomains will need only ordinary list or else a multiprocessing list implementation
+        if PCMLConfig.exectype in (ExecutorType.serialpython, ExecutorType.threadpool, ExecutorType.distributed):
             subdomain.set_pointlist(pointlist)
         else:
             subdomain.set_pointlist(pointlist, ref=True)
@@ -270,3 +329,28 @@ def pointrasterrowdecomposition(layer, buffersize, layerlist=None):
         return rowdecomposition(layer, buffersize)
     elif layer.data_structure == Datastructure.pointlist and layerlist is not None:
         return pointsubdomainsfromrastersubdomains(layer, layerlist[1], buffersize)
+
+
+# Estimate the relative cost of processing one group of subdomains (output subdomain first)
+# The estimate counts output cells, input cells (which include the halo) and points near the subdomain
+def subdomaincost(subdomains):
+    outsubdomain = subdomains[0]
+    if outsubdomain.data_structure == Datastructure.array:
+        outcells = outsubdomain.nrows * outsubdomain.ncols
+    else:
+        outcells = len(outsubdomain.get_pointlist())
+    incells = 0
+    points = 0
+    for subdomain in subdomains[1:]:
+        if subdomain.data_structure == Datastructure.array:
+            incells += subdomain.nrows * subdomain.ncols
+        else:
+            points += len(subdomain.get_pointlist())
+    # Point operations (e.g., KernelDensityEstimation) do work for each point near each output cell
+    return outcells * (1 + points) + incells
+
+
+# Return the indices of subdomainlists ordered longest (most expensive) first
+def costorder(subdomainlists):
+    costs = [subdomaincost(subdomains) for subdomains in subdomainlists]
+    return sorted(xrange(len(subdomainlists)), key=lambda i: costs[i], reverse=True)
@@ -0,0 +1,206 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+"""
+from ..util.Messaging import *
+from .PCMLPrims import *
+from .Decomposition import costorder
+from .TaskMonitor import TaskMonitor
+from .WorkerPool import _applyresult
+import pcml.core.PCMLConfig as PCMLConfig
+
+from multiprocessing.connection import Client
+import binascii
+import copy
+import os
+import socket
+import subprocess
+import sys
+import threading
+import numpy as np
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+def parseaddress(address):
+    """ Convert 'host:port' into a (host, port) tuple, tuples are returned unchanged """
+    if isinstance(address, tuple):
+        return address
+    host, port = address.rsplit(':', 1)
+    return (host, int(port))
+
+
+def detachsubdomain(subdomain, copydata=True):
+    """ Return a copy of subdomain that holds its own data so it can be sent to another machine.
+    Only the subdomain (core plus halo) is copied, never the whole layer.
+    Output subdomains are sent without data (copydata=False) and allocated by the worker.
+    """
+    detached = copy.copy(subdomain)
+    detached._segment = None
+    detached._segmentshape = None
+    if subdomain.data_structure == Datastructure.array:
+        detached._data = np.ascontiguousarray(subdomain.get_nparray()) if copydata else None
+    else:
+        detached._data = list(subdomain.get_pointlist())  # Manager lists cannot be reached from other machines
+    return detached
+
+
+def attachoutputsubdomain(subdomain, dtype):
+    """ Allocate the data of an output subdomain received without data, with the data type of the output layer """
+    if subdomain.data_structure == Datastructure.array and subdomain._data is None:
+        subdomain._data = np.zeros((subdomain.nrows, subdomain.ncols), dtype=dtype)
+    return subdomain
+
+
+# Open connections to worker daemons indexed by (host, port), reused across operations
+_connections = {}
+
+
+def _connect(address):
+    connection = _connections.get(address)
+    if connection is None:
+        # Client retries refused connections for a long time, so check the worker is listening first
+        if not PCMLConfig.distributed_authkey:
+            raise PCMLOperationError("ExecutorType.distributed requires PCMLConfig.distributed_authkey (or PCML_AUTHKEY) to be set")
+        socket.create_connection(address, PCMLConfig.distributed_connect_timeout).close()
+        connection = Client(address, authkey=PCMLConfig.distributed_authkey)
+        _connections[address] = connection
+    return connection
+
+
+def _disconnect(address):
+    connection = _connections.pop(address, None)
+    if connection is not None:
+        try:
+            connection.close()
+        except (IOError, OSError):
+            pass
+
+
+def rundistributed(op, subdomainlists):
+    """ Send each group of subdomains to a worker daemon (see pcml.worker) and copy the output tiles back """
+    addresses = [parseaddress(address) for address in PCMLConfig.distributed_workers]
+    if not addresses:
+        raise PCMLOperationError("ExecutorType.distributed requires PCMLConfig.distributed_workers (e.g., ['node1:6000'])")
+
+    tasks = queue.Queue()
+    for taskid in costorder(subdomainlists):
+        tasks.put(taskid)
+    monitor = TaskMonitor(xrange(len(subdomainlists)))
+    lost = []
+    lock = threading.Lock()
+
+    def serve(address):
+        taskid = None
+        try:
+            connection = _connect(address)
+            connection.send(('op', op))
+            while True:
+                try:
+                    taskid = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                subdomains = subdomainlists[taskid]
+                message = [detachsubdomain(subdomains[0], copydata=False)]
+                message.extend(detachsubdomain(subdomain) for subdomain in subdomains[1:])
+                outarr = subdomains[0].get_nparray() if subdomains[0].data_structure == Datastructure.array else None
+                connection.send(('task', taskid, message, None if outarr is None else outarr.dtype))
+                kind, resultid, payload = connection.recv()
+                if kind == 'done':
+                    _applyresult(subdomains[0], payload)
+                    with lock:
+                        monitor.finish(taskid, address)
+                else:
+                    with lock:
+                        retry = monitor.fail(taskid, address, payload)
+                    if retry:
+                        tasks.put(taskid)
+                taskid = None
+        except (IOError, OSError, EOFError) as e:
+            # The worker is unreachable, give its task to the remaining workers
+            _disconnect(address)
+            PCMLUserInformation("Lost distributed worker %s:%i (%s)" % (address[0], address[1], e))
+            with lock:
+                lost.append(address)
+            if taskid is not None:
+                tasks.put(taskid)
+
+    # One dispatcher thread per worker, repeated while tasks given back by lost workers remain
+    while not tasks.empty():
+        if not addresses:
+            raise PCMLOperationError("No distributed workers are reachable to run %s" % op.name)
+        threads = [threading.Thread(target=serve, args=(address,)) for address in addresses]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        addresses = [address for address in addresses if address not in lost]
+
+    monitor.check(op.name)
+
+
+class LocalWorkers(object):
+    """ Start worker daemons on this machine as a stand-in for a cluster.
+    Used as a context manager, PCMLConfig.distributed_workers points to the local daemons inside the with block.
+    The daemons share a random key that is set as PCMLConfig.distributed_authkey inside the with block.
+    """
+
+    def __init__(self, num_workers=None, host='localhost'):
+        if num_workers is None:
+            num_workers = PCMLConfig.num_procs
+        self.num_workers = num_workers
+        self.host = host
+        self.addresses = []
+        self._processes = []
+        self._previous = None
+        self.authkey = binascii.hexlify(os.urandom(16))
+
+    def __repr__(self):
+        return "<LocalWorkers: %s>" % ", ".join("%s:%i" % address for address in self.addresses)
+
+    def __enter__(self):
+        self.start()
+        self._previous = (PCMLConfig.distributed_workers, PCMLConfig.distributed_authkey)
+        PCMLConfig.distributed_workers = list(self.addresses)
+        PCMLConfig.distributed_authkey = self.authkey
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        PCMLConfig.distributed_workers, PCMLConfig.distributed_authkey = self._previous
+        self.shutdown()
+        return False
+
+    def start(self):
+        """ Launch the worker daemons and wait until each one is listening """
+        env = dict(os.environ)
+        packagedir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env['PYTHONPATH'] = os.pathsep.join([packagedir] + [p for p in [env.get('PYTHONPATH')] if p])
+        env['PCML_AUTHKEY'] = self.authkey  # Not on the command line, where other users could read it
+        for i in xrange(self.num_workers):
+            process = subprocess.Popen([sys.executable, '-m', 'pcml.worker', '--listen', '%s:0' % self.host,
+                                        '--parent', str(os.getpid())],
+                                       stdout=subprocess.PIPE, env=env)
+            # The daemon announces the port it is listening on in its first line of output
+            line = process.stdout.readline().decode()
+            if not line:
+                raise PCMLException("Local worker %i did not start" % i)
+            self.addresses.append(parseaddress(line.split()[-1]))
+            self._processes.append(process)
+            # Keep reading the daemon output so it never blocks on a full pipe
+            drain = threading.Thread(target=process.stdout.read)
+            drain.daemon = True
+            drain.start()
+
+    def shutdown(self):
+        """ Stop the worker daemons """
+        for address in self.addresses:
+            _disconnect(address)
+        for process in self._processes:
+            if process.poll() is None:
+                process.terminate()
+                process.wait()
+        self.addresses = []
+        self._processes = []
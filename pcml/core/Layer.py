@@ -26,20 +26,41 @@ class Layer(BoundingBox):
     def __repr__(self):
         return "<Layer: (%f,%f) [%f,%f] : %s>" % (self.y, self.x, self.h, self.w, self.title)
 
-    def duplicate(self):
+    def duplicate(self, dtype=None):
         """
         Create a new layer, based on this layer
+        :param dtype: data type of the new layer, the data type of this layer by default
         :returns: a new layer
         """
         # FIXME: A function such as setfromlayer() should be defined that will do this automatically
         newlayer = Layer(self.y, self.x, self.h, self.w, self.title + " (duplicate)")
         if self.data_structure == Datastructure.array:
-            newlayer.set_nparray(np.zeros((self.nrows, self.ncols)), self.cellsize, self.nodata_value)
+            newlayer.allocate_nparray((self.nrows, self.ncols), self.cellsize, self.nodata_value, store=self._store,
+                                      dtype=dtype or self.data_type or np.float64)
         elif self.data_structure == Datastructure.pointlist:
             newlayer.set_pointlist(self.get_pointlist())
         # TODO: PCMLTODO("Double check that all of the values are copied over")
         return newlayer
 
+    def modified(self, r=0, nrows=None):
+        """ Record that rows r to r+nrows (all rows by default) were changed in place, e.g. layer._data[r] = 0.
+        Only the content hashes of those rows are computed again by the result cache.
+        """
+        if nrows is None:
+            nrows = self.nrows - r
+        for tile in self._tilehashes.keys():
+            if tile[0] < r + nrows and r < tile[0] + tile[1]:
+                del self._tilehashes[tile]
+
+    def release(self):
+        """ Release the data of this layer, its shared memory is reused by new layers (see SegmentPool).
+        The memory is reused once no other array refers to it, e.g. a subdomain or layer._data kept elsewhere.
+        """
+        self._data = None
+        self._segment = None
+        self._segmentshape = None
+        self._tilehashes = {}
+
     '''
     def decomposition(self, method, buffersize):
         """Return a list of subdomains based on decomposition method.
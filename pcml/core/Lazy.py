@@ -0,0 +1,134 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+"""
+from ..util.Messaging import *
+import pcml.core.PCMLConfig as PCMLConfig
+
+import contextlib
+import weakref
+import numpy as np
+
+
+# Nodes that have not been garbage collected indexed by their key, used to find identical sub-expressions
+_nodes = weakref.WeakValueDictionary()
+
+
+def _hashable(value):
+    # Convert an operation argument into a hashable value, objects such as layers and arrays are compared by identity
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple(_hashable(v) for v in value)
+    if isinstance(value, dict):
+        return ('dict',) + tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    if isinstance(value, np.ndarray):
+        return ('ndarray', id(value))
+    try:
+        hash(value)
+    except TypeError:
+        return ('id', id(value))
+    if isinstance(value, (int, long, float, complex, str, unicode, bool, type(None))):
+        return value
+    return ('id', id(value))
+
+
+class LazyLayer(object):
+    """ A layer that is not computed yet, the output of an operation called in lazy mode.
+    The graph of operations behind a lazy layer runs when compute() is called, when the layer
+    is written, or when it is used by an operation outside of lazy mode. Attributes of the computed
+    layer (e.g., _data, nrows) can be used directly and compute the layer on first use.
+    """
+
+    def __new__(cls, operation, layers, kwargs):
+        # Identical sub-expressions (same operation, inputs, and arguments) share a single node
+        key = (operation, tuple(('node', id(layer)) for layer in layers), _hashable(kwargs))
+        node = _nodes.get(key)
+        if node is None:
+            node = object.__new__(cls)
+            node.operation = operation
+            node.layers = tuple(layers)  # Holding the inputs keeps their ids (part of the key) unique
+            node.kwargs = dict(kwargs)
+            node.key = key
+            node._result = None
+            node._dependents = weakref.WeakSet()  # Live nodes reading this node
+            for layer in layers:
+                if isinstance(layer, LazyLayer):
+                    layer._dependents.add(node)
+            _nodes[key] = node
+        return node
+
+    def __init__(self, operation, layers, kwargs):
+        pass  # Initialized in __new__ so identical sub-expressions are not reset
+
+    def __repr__(self):
+        state = "computed" if self._result is not None else "deferred"
+        return "<LazyLayer: %s of %i layers (%s)>" % (self.operation.__name__, len(self.layers), state)
+
+    def __getattr__(self, name):
+        # Called for attributes a lazy layer does not have, they belong to the computed layer
+        if name.startswith('__') or name in ('operation', 'layers', 'kwargs', 'key', '_result', '_dependents'):
+            raise AttributeError(name)
+        return getattr(self.compute(), name)
+
+    def iscomputed(self):
+        return self._result is not None
+
+    def isneeded(self):
+        """ Return True if a node that is not computed yet reads this node """
+        return any(dependent._result is None for dependent in self._dependents)
+
+    def plan(self):
+        """ Return the nodes that must run to compute this layer, each node after the nodes it reads """
+        order = []
+        visited = set()
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                order.append(node)
+                continue
+            if id(node) in visited or node._result is not None:
+                continue
+            visited.add(id(node))
+            stack.append((node, True))
+            for layer in reversed(node.layers):
+                if isinstance(layer, LazyLayer):
+                    stack.append((layer, False))
+        return order
+
+    def compute(self):
+        """ Run the operations this layer depends on and return the computed layer.
+        Intermediate layers are freed as soon as every live node reading them has been computed,
+        including nodes outside this plan (they are computed again if they are used later).
+        """
+        if self._result is not None:
+            return self._result
+        for node in self.plan():
+            layers = [layer._result if isinstance(layer, LazyLayer) else layer for layer in node.layers]
+            node._result = node.operation._PCML_run(layers, node.kwargs)
+            for layer in set(node.layers):
+                if isinstance(layer, LazyLayer) and not layer.isneeded():
+                    layer._result = None  # Dead intermediate, release its memory
+        return self._result
+
+
+def materialize(layer):
+    """ Return layer, computing it first if it is a lazy layer """
+    if isinstance(layer, LazyLayer):
+        return layer.compute()
+    return layer
+
+
+@contextlib.contextmanager
+def lazy(enabled=True):
+    """ Within the with block, operations return lazy layers instead of running immediately
+    >>> with pcml.lazy():
+    ...     suitability = LocalSum(FocalMean(slope, buffersize=1), landcover)
+    >>> suitability.compute()
+    """
+    previous = PCMLConfig.lazy
+    PCMLConfig.lazy = enabled
+    try:
+        yield
+    finally:
+        PCMLConfig.lazy = previous
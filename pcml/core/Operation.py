@@ -10,6 +10,27 @@ from .Iteration import *
 from .PCMLPrims import *
 from .PCMLConfig import *
 from abc import ABCMeta, abstractmethod
+import copy
+import sys
+import types
+import numpy as np
+
+
+def _resolveoperation(ref):
+    """ Look up the exported operation function named by ref=(module name, function name) """
+    modname, name = ref
+    __import__(modname)
+    return getattr(sys.modules[modname], name, None)
+
+
+def _rebuildoperation(ref, state):
+    """ Recreate an operation inside a worker process from its reference and lightweight state """
+    exported = _resolveoperation(ref)
+    op = Operation.__new__(Operation)
+    op.__dict__.update(state)
+    op._layers = []
+    exported._PCML_bind(op)
+    return op
 
 
 class Operation(object):
@@ -38,6 +59,8 @@ class Operation(object):
         # adding this to get the operation specified parameter
         self.kwargs = kwargs
         self.outputlayer = kwargs.get('outputlayer', None)
+        # Operations marked native (see OperationBuilder.nativedtype) receive integer layers without conversion
+        self.native = False
         if self.opclass == OpClass.localclass and self.buffersize != 0:
             raise PCMLOperationError("Buffersize should be 0 for localclass currently %s" % self.buffersize)
         # If zonal operation we want the entire layer data
@@ -47,6 +70,68 @@ class Operation(object):
     def __repr__(self):
         return "<Operation: %s : %i layers>" % (self.name, len(self._layers))
 
+    def __reduce__(self):
+        """ Operations are sent to worker processes by reference to their exported function.
+        Layers are not included, workers only receive the subdomains they process.
+        """
+        if not self.isportable():
+            raise PCMLOperationError("Operation %s is not defined at module level and cannot be sent to workers" % self.name)
+        state = {}
+        for key, val in self.__dict__.items():
+            # Skip layers and the methods bound by OperationDecorator (they are bound again by _rebuildoperation)
+            if key in ('_layers', 'outputlayer') or isinstance(val, types.MethodType):
+                continue
+            state[key] = val
+        state['kwargs'] = dict((key, val) for key, val in self.kwargs.items() if key not in ('layers', 'outputlayer'))
+        return (_rebuildoperation, (self._PCML_ref, state))
+
+    def isportable(self):
+        """ Return True if the operation can be rebuilt by reference in another process """
+        ref = getattr(self, '_PCML_ref', None)
+        if ref is None:
+            return False
+        try:
+            exported = _resolveoperation(ref)
+        except ImportError:
+            return False
+        return getattr(exported, '_PCML_ref', None) == ref
+
+    def explain(self):
+        """ Print and return the plan ExecutorType.auto would choose for this operation (see pcml.core.Planner) """
+        from .Planner import planoperation  # The planner imports the scheduling modules, which import this module
+        plan = planoperation(self)
+        print(plan)
+        return plan
+
+    def outputdtype(self):
+        """ Data type of the output layer, the dtype argument of the operation or PCMLConfig.compute_dtype.
+        Native operations only select or compare values, their output has a data type that holds the values
+        of every layer (e.g., uint8 for uint8 layers, float64 for a uint8 and a float64 layer).
+        """
+        if self.kwargs.get('dtype') is not None:
+            return np.dtype(self.kwargs['dtype'])
+        dtypes = [layer.data_type for layer in self._layers if getattr(layer, 'data_type', None) is not None]
+        if self.native and dtypes:
+            return np.result_type(*dtypes)
+        return np.dtype(PCMLConfig.compute_dtype)
+
+    def promote(self, subdomains):
+        """ Return subdomains where input arrays of integer layers are converted to PCMLConfig.compute_dtype.
+        Layers keep their own data type in memory, each subdomain is converted when it is processed so
+        arithmetic in executors does not overflow or truncate (e.g., the sum of two uint8 layers).
+        """
+        if self.native:
+            return subdomains
+        computedtype = np.dtype(PCMLConfig.compute_dtype)
+        promoted = [subdomains[0]]
+        for subdomain in subdomains[1:]:
+            if subdomain.data_structure == Datastructure.array and subdomain.get_nparray().dtype.kind in 'biu':
+                converted = copy.copy(subdomain)
+                converted.set_data_ref(subdomain.get_nparray().astype(computedtype))
+                subdomain = converted
+            promoted.append(subdomain)
+        return promoted
+
     def getOutputLayers(self):
         PCMLTODO("Need to support more than one output layer")
         return self._layers[0]
@@ -58,9 +143,12 @@ class Operation(object):
 
         # if outputlayer is passed as an argument, use it, else create an outputlayer from the first layer
         if self.outputlayer is None:
-            outputlayer = firstlayer.duplicate()
+            outputlayer = firstlayer.duplicate(dtype=self.outputdtype())
         else:
             outputlayer = self.outputlayer
+            if outputlayer.data_structure == Datastructure.array and outputlayer.isreadonly():
+                raise PCMLOperationError("Output layer %s of operation %s is read-only (e.g., a cached result)" % (outputlayer.title, self.name))
+            outputlayer.modified()  # Its contents are overwritten, the result cache must hash them again
         outputlayer.title = "Output for operation %s" % self.name
 
         self._layers.insert(0, outputlayer)  # Add the output layer to the front of the layers list
@@ -113,6 +201,7 @@ class Operation(object):
         :return: #TODO: Undefined return value.
         """
         PCMLTODO("executor assumes single subdomain as output, which is not universal for all operations")
+        subdomains = self.promote(subdomains)
         outsubdomain = subdomains.pop(0)
         if outsubdomain.data_structure == Datastructure.pointlist:
             pointlist = outsubdomain.get_pointlist()
@@ -38,6 +38,124 @@ else:
 
 # exectype=ExecutorType.serialpython
 # exectype=ExecutorType.parallelpythonqueue
+# exectype=ExecutorType.persistentpool
+# exectype=ExecutorType.workstealing
+# exectype=ExecutorType.threadpool
+# exectype=ExecutorType.distributed
+
+# Number of tasks the persistent pool queues ahead for each worker process
+pool_prefetch = 2
+
+# Send each subdomain to the persistent pool worker that produced its input in an earlier operation
+pool_locality = True
+
+# Number of recent output layers whose producing workers are remembered by the persistent pool
+pool_locality_layers = 8
+
+# Seconds the persistent pool waits for a result before checking its workers are alive
+pool_poll_interval = 1.0
+
+# Worker daemons used by ExecutorType.distributed as 'host:port' strings
+# Start one on each node with: PCML_AUTHKEY=secret python -m pcml.worker --listen host:port
+distributed_workers = []
+
+# Shared secret used to authenticate connections to the worker daemons, read from the PCML_AUTHKEY environment
+# variable unless set here. Daemons run what authenticated schedulers send them, so there is no default key.
+distributed_authkey = os.environ.get('PCML_AUTHKEY')
+
+# Seconds to wait when connecting to a worker daemon before it is considered lost
+distributed_connect_timeout = 5.0
+
+# Number of times a failed subdomain is run again before the operation fails
+task_retries = 2
+
+# A subdomain running longer than speculation_factor times the median subdomain time
+# (and at least speculation_min_time seconds) is duplicated on an idle process, 0 disables duplication
+speculation_factor = 4.0
+speculation_min_time = 0.5
+
+# Seconds between checks for straggling subdomains in the parallel python (Queue) executor
+speculation_interval = 0.1
+
+# Pin each worker process to a set of cores: None (do not pin), 'compact' (fill the cores of
+# one NUMA node before the next) or 'scatter' (spread consecutive ranks across NUMA nodes)
+affinity = None
+
+# Pinned workers allocate the memory they write first on their own NUMA node (requires libnuma)
+numa_local = True
+
+# Threads per worker for BLAS, OpenMP, and numba thread pools: 'auto' caps them so that
+# processes x threads equals the available cores, a number sets them, None leaves them unchanged
+worker_threads = 'auto'
+
+# In lazy mode operations return lazy layers that are computed on demand (see pcml.lazy())
+lazy = False
+
+# Number of cells in each block of rows evaluated at a time by LocalExpression (256KB of float64 values)
+expression_block_cells = 32768
+
+# Where the data of layers is held: 'shm' (shared memory) or 'memmap' (a memory mapped file in scratch_dir
+# that the operating system pages in and out, for layers larger than memory). Both are files named pcml-<pid>-*
+# in /dev/shm or scratch_dir, files of a killed process are removed by the next process using the directory
+backing_store = 'shm'
+
+# Directory for memory mapped layers and temporary files (e.g., a tmpfs or local SSD), None uses the system default
+scratch_dir = None
+
+# Bytes of memory from released layers kept for reuse by new layers (see pcml.util.SharedMemory.SegmentPool), 0 frees it at once
+segment_pool_bytes = 512 * 1024 * 1024
+
+# Ask Linux to back shared memory segments with transparent huge pages (needs shmem_enabled=advise)
+hugepages = False
+
+# Data type of operation outputs and of the values executors compute with. Layers keep the data type they
+# are read with (uint8, int16, int32, float32, or float64), integer inputs are converted to this type subdomain
+# by subdomain. 'float32' halves the memory of float-heavy workflows. An operation's dtype argument sets its output type.
+compute_dtype = 'float64'
+
+# (rows, columns) of the tiles made by tiledecomposition, None makes square tiles of decomposition_granularity cells
+tile_shape = None
+
+# Bytes of the window histograms kept at once by focal majority, minority, median, and percentile executors,
+# and of the window codes kept at once by focal percentage and variety on layers with many classes
+focal_histogram_bytes = 64 * 1024 * 1024
+
+# Cost model of the execution planner used with ExecutorType.auto (see pcml.core.Planner)
+# Seconds to start a worker process and to hand one subdomain to a worker
+planner_process_seconds = 0.01
+planner_task_seconds = 0.001
+# Seconds for a work stealing process to take a subdomain from its range (no queue round trip)
+planner_steal_seconds = 0.0001
+# Seconds to start a thread and to hand one subdomain to a thread of ExecutorType.threadpool
+planner_thread_seconds = 0.0001
+# Fraction of an executor's time spent holding the GIL, threads run this part one at a time.
+# Lower it for operations whose executors spend their time in numpy calls that release the GIL
+planner_gil_fraction = 1.0
+# Seconds per cell for operations that cannot be timed on a sample (zonal, global, and point operations)
+planner_cell_seconds = 1e-6
+# Rows of the sample each operation is timed on to calibrate its cost per cell
+planner_sample_rows = 8
+
+# Processes decoding row blocks of a GeoTIFF band into the layer at the same time in ReadGeoTIFF
+read_procs = 1
+
+# Bytes of a GeoTIFF band decoded by each read (rounded to whole blocks of the file)
+read_block_bytes = 16 * 1024 * 1024
+
+# Bytes of layer data held in memory at once when operations are streamed from raster files (see OpenRaster)
+stream_memory = 1024 * 1024 * 1024
+
+# Reuse the output layer of an operation called again with the same inputs and arguments (see pcml.core.Cache)
+cache = False
+
+# Bytes of output layers the cache keeps in memory, the least recently used layers are evicted first
+cache_bytes = 256 * 1024 * 1024
+
+# Directory where the cache also keeps output layers between runs, None keeps them in memory only
+cache_dir = None
+
+# Number of rows in each tile of a layer that is hashed separately by the cache
+cache_tile_rows = 256
 
 # The precision used in formatting floating values into strings
 value_precision = "%f"
@@ -19,6 +19,11 @@ class ExecutorType():
     """
     serialpython = 1
     parallelpythonqueue = 2
+    persistentpool = 3
+    workstealing = 4
+    threadpool = 5
+    distributed = 6
+    auto = 7  # Chosen for each operation by the execution planner (see pcml.core.Planner)
 
 
 class OpClass():
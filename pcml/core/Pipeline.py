@@ -0,0 +1,101 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+
+Chains of local and focal operations that run subdomain by subdomain (see pcml.lib.PipelineOperations.pipeline).
+Each subdomain is read once with the halo the whole chain needs, and every stage except the last
+writes into a scratch array the size of the subdomain instead of a layer.
+"""
+from ..util.Messaging import *
+from .Operation import _resolveoperation
+from .Subdomain import *
+from .PCMLPrims import *
+
+import numpy as np
+
+
+class PipelineStage(object):
+    """ An operation waiting to be placed in a pipeline, created by calling an operation without layers.
+    Ellipsis in layers marks the input from the previous stage, other layers are read directly, e.g.
+    FocalMean(buffersize=1) or LocalSum(Ellipsis, elevation).
+    """
+
+    def __init__(self, operation, layers, kwargs):
+        if not getattr(operation, '_PCML_exported', False):
+            raise PCMLInvalidInput("Pipeline stages must be operations", operation)
+        self.operation = operation
+        self.layers = tuple(layers) if layers else (Ellipsis,)
+        self.kwargs = dict(kwargs)
+        op = operation._PCML_build([], self.kwargs)
+        if op.opclass not in (OpClass.localclass, OpClass.focalclass) or op.buffersize < 0:
+            raise PCMLInvalidInput("Only local and focal operations can be pipelined", operation.__name__)
+        self.buffersize = op.buffersize
+
+    def __repr__(self):
+        return "<PipelineStage: %s buffersize %i>" % (self.operation.__name__, self.buffersize)
+
+
+def pipelinehalo(stages):
+    """ Halo (in cells) the input of a pipeline needs, the sum of the buffersize of each stage """
+    return sum(stage.buffersize for stage in stages)
+
+
+def _region(subdomain, halo, extent):
+    # (r, c, nrows, ncols) of subdomain grown by halo on every side, limited to extent
+    r = max(extent.r, subdomain.r - halo)
+    c = max(extent.c, subdomain.c - halo)
+    rend = min(extent.r + extent.nrows, subdomain.r + subdomain.nrows + halo)
+    cend = min(extent.c + extent.ncols, subdomain.c + subdomain.ncols + halo)
+    return r, c, rend - r, cend - c
+
+
+def scratchsubdomain(template, region, data):
+    """ Create a subdomain of the layer of template covering region=(r, c, nrows, ncols) that holds data """
+    r, c, nrows, ncols = region
+    subdomain = Subdomain(template.y + (r - template.r) * template.cellsize,
+                          template.x + (c - template.c) * template.cellsize,
+                          nrows * template.cellsize, ncols * template.cellsize, template.title)
+    subdomain.cellsize = template.cellsize
+    subdomain.nodata_value = template.nodata_value
+    subdomain.r = r
+    subdomain.c = c
+    subdomain.set_data_ref(data)
+    return subdomain
+
+
+def _view(subdomain, region):
+    # A subdomain sharing the data of subdomain within region
+    r, c, nrows, ncols = region
+    return scratchsubdomain(subdomain, region, subdomain.slice_nparray(r - subdomain.r, c - subdomain.c, nrows, ncols))
+
+
+def runstages(stages, subdomains):
+    """ Run the stages of a pipeline on one group of subdomains (output subdomain first).
+    stages is a sequence of (operation reference, kwargs, slots) where slots lists the inputs of the stage,
+    -1 for the output of the previous stage or the index of an input subdomain.
+    """
+    outsubdomain = subdomains[0]
+    insubdomains = subdomains[1:]
+    extent = insubdomains[0]  # Input subdomains carry the full halo, limited to the layer
+    ops = [_resolveoperation(ref)._PCML_build([], kwargs) for ref, kwargs, slots in stages]
+    # Halo still needed by the stages after each stage
+    remaining = [sum(op.buffersize for op in ops[i + 1:]) for i in xrange(len(ops))]
+
+    previous = None
+    for i, (op, (ref, kwargs, slots)) in enumerate(zip(ops, stages)):
+        inregion = _region(outsubdomain, remaining[i] + op.buffersize, extent)
+        stagesubdomains = []
+        for slot in slots:
+            if slot < 0:
+                stagesubdomains.append(previous)
+            else:
+                stagesubdomains.append(_view(insubdomains[slot], inregion))
+        if i == len(ops) - 1:
+            stageout = outsubdomain
+        else:
+            # Intermediate results only live in a scratch array covering this subdomain and the halo still needed
+            region = _region(outsubdomain, remaining[i], extent)
+            stageout = scratchsubdomain(outsubdomain, region, np.zeros(region[2:], dtype=op.outputdtype()))
+        op.executor([stageout] + stagesubdomains)
+        previous = stageout
@@ -0,0 +1,183 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+
+Execution planner for PCMLConfig.exectype = ExecutorType.auto.
+For each operation the planner predicts the time of serial execution and of the parallel executors
+(parallelpythonqueue, workstealing, persistentpool, threadpool) with 2 to PCMLConfig.num_procs
+processes at several decomposition granularities, and picks the fastest.
+The cost per cell of an operation is calibrated once by timing its executor on a sample of rows,
+the halo of focal operations adds the input cells each subdomain reads. The executors differ in
+their overheads:
+  parallelpythonqueue  planner_process_seconds per process, planner_task_seconds per subdomain
+  workstealing         planner_process_seconds per process, planner_steal_seconds per subdomain
+  persistentpool       planner_task_seconds per subdomain, planner_process_seconds per process only
+                       when the pool is not already running with that many processes
+  threadpool           planner_thread_seconds per thread and per subdomain, the planner_gil_fraction
+                       of the work runs one thread at a time
+so small layers run serially. ExecutorType.distributed is never planned, its cost depends on the
+network and machines of the worker daemons which are not modeled.
+"""
+from ..util.Messaging import *
+from .PCMLPrims import *
+from .Streaming import rowsubdomain
+from .WorkerPool import activepool, runningpoolsize
+import pcml.core.PCMLConfig as PCMLConfig
+
+import math
+import time
+import numpy as np
+
+# Seconds per cell calibrated for each operation, indexed by (operation reference, buffersize)
+_cellseconds = {}
+
+_exectypenames = dict((value, name) for name, value in vars(ExecutorType).items() if isinstance(value, int))
+
+
+class Plan(object):
+    """ Execution settings chosen for an operation with the predicted time (seconds) and memory (bytes) """
+
+    def __init__(self, op, exectype, num_procs, granularity, subdomains, seconds, nbytes):
+        self.name = op.name
+        self.exectype = exectype
+        self.num_procs = num_procs
+        self.granularity = granularity
+        self.subdomains = subdomains
+        self.seconds = seconds
+        self.nbytes = nbytes
+
+    def __repr__(self):
+        return "<Plan: %s %s %i processes, granularity %i (%i subdomains), predicted %.3g s, %.1f MB>" % (
+            self.name, _exectypenames.get(self.exectype), self.num_procs, self.granularity, self.subdomains,
+            self.seconds, self.nbytes / 1048576.0)
+
+    def apply(self):
+        """ Set PCMLConfig to this plan and return the previous settings (see restore) """
+        previous = (PCMLConfig.exectype, PCMLConfig.num_procs, PCMLConfig.decomposition_granularity)
+        PCMLConfig.exectype = self.exectype
+        PCMLConfig.num_procs = self.num_procs
+        PCMLConfig.decomposition_granularity = self.granularity
+        return previous
+
+    @staticmethod
+    def restore(previous):
+        PCMLConfig.exectype, PCMLConfig.num_procs, PCMLConfig.decomposition_granularity = previous
+
+
+def _arraylayers(op):
+    return all(getattr(layer, 'data_structure', None) == Datastructure.array for layer in op._layers)
+
+
+def _calibrate(op):
+    # Time the executor on a sample of rows in the middle of the layers, return seconds per cell read or written
+    key = (getattr(op, '_PCML_ref', op.name), op.buffersize)
+    if key in _cellseconds:
+        return _cellseconds[key]
+    seconds = PCMLConfig.planner_cell_seconds
+    if op.opclass in (OpClass.localclass, OpClass.focalclass) and op.buffersize >= 0 and _arraylayers(op):
+        first = op._layers[0]
+        nrows = min(first.nrows, max(1, PCMLConfig.planner_sample_rows))
+        r = (first.nrows - nrows) // 2
+        out = rowsubdomain(first, r, np.zeros((nrows, first.ncols), dtype=op.outputdtype()))
+        subdomains = [out]
+        for layer in op._layers:
+            top = max(0, r - op.buffersize)
+            bottom = min(layer.nrows, r + nrows + op.buffersize)
+            subdomains.append(rowsubdomain(layer, top, layer.get_nparray()[top:bottom]))
+        cells = sum(subdomain.nrows * subdomain.ncols for subdomain in subdomains)
+        try:
+            start = time.time()
+            op.executor(list(subdomains))
+            seconds = max(time.time() - start, 1e-9) / cells
+        except Exception as e:
+            PCMLUserInformation("Operation %s could not be timed on a sample (%s), using planner_cell_seconds" % (op.name, e))
+    _cellseconds[key] = seconds
+    return seconds
+
+
+def _subdomains(op, nrows, ncols, granularity):
+    # Number of subdomains and cells (output, each input with halo) of the largest one for a granularity
+    halo = max(0, op.buffersize)
+    decomposition = getattr(op.decomposition, '__name__', '')
+    if decomposition == 'columndecomposition':
+        return int(math.ceil(ncols / float(granularity))), granularity * nrows, min(ncols, granularity + 2 * halo) * nrows
+    if decomposition == 'tiledecomposition':
+        tilerows, tilecols = PCMLConfig.tile_shape or (granularity, granularity)
+        count = int(math.ceil(nrows / float(tilerows))) * int(math.ceil(ncols / float(tilecols)))
+        return count, tilerows * tilecols, min(nrows, tilerows + 2 * halo) * min(ncols, tilecols + 2 * halo)
+    return int(math.ceil(nrows / float(granularity))), granularity * ncols, min(nrows, granularity + 2 * halo) * ncols
+
+
+def _executors(op):
+    # Parallel executors that can run op, ties are won by the first
+    executors = [ExecutorType.parallelpythonqueue, ExecutorType.workstealing]
+    if op.isportable():
+        executors.append(ExecutorType.persistentpool)
+    if getattr(PCMLConfig, 'futuresenabled', 0):
+        executors.append(ExecutorType.threadpool)
+    return executors
+
+
+def _processes(exectype, maxprocs):
+    # Numbers of processes (threads) worth predicting for an executor
+    if exectype == ExecutorType.persistentpool and activepool() is not None:
+        return [activepool().num_procs]  # A pool used as a context manager keeps its size
+    return xrange(2, maxprocs + 1)
+
+
+def _candidates(op, nrows, ncols, maxprocs):
+    # (exectype, processes, granularity) worth predicting
+    yield ExecutorType.serialpython, 1, max(nrows, ncols)
+    for exectype in _executors(op):
+        for procs in _processes(exectype, maxprocs):
+            for perprocess in (1, 2, 4, 8):
+                granularity = int(math.ceil(nrows / float(procs * perprocess)))
+                if granularity >= 1:
+                    yield exectype, procs, granularity
+
+
+def _seconds(exectype, procs, count, tasks):
+    # Predicted time of count subdomains taking tasks seconds each on procs processes (threads)
+    # The busiest process handles ceil(count/procs) of the largest subdomains
+    rounds = int(math.ceil(count / float(procs)))
+    if exectype == ExecutorType.threadpool:
+        gil = PCMLConfig.planner_gil_fraction
+        return (procs + count) * PCMLConfig.planner_thread_seconds + max(count * tasks * gil, rounds * tasks)
+    if exectype == ExecutorType.workstealing:
+        return procs * PCMLConfig.planner_process_seconds + rounds * (PCMLConfig.planner_steal_seconds + tasks)
+    start = procs * PCMLConfig.planner_process_seconds
+    if exectype == ExecutorType.persistentpool and runningpoolsize() == procs:
+        start = 0  # The warm pool is reused
+    return start + rounds * (PCMLConfig.planner_task_seconds + tasks)
+
+
+def planoperation(op):
+    """ Return the fastest predicted Plan for op (its layers are the inputs, the output layer is not made yet) """
+    first = op._layers[0]
+    outbytes = np.dtype(op.outputdtype()).itemsize
+    if not _arraylayers(op) or op.opclass in (OpClass.zonalclass, OpClass.globalclass) or op.buffersize < 0:
+        # Only local and focal operations on arrays can be decomposed freely, keep the configured granularity
+        nrows, ncols = first.nrows or 1, first.ncols or 1
+        candidates = [(ExecutorType.serialpython, 1, PCMLConfig.decomposition_granularity)] + \
+            [(exectype, procs, PCMLConfig.decomposition_granularity) for exectype in _executors(op)
+             for procs in _processes(exectype, PCMLConfig.num_procs)]
+    else:
+        nrows, ncols = first.nrows, first.ncols
+        candidates = list(_candidates(op, nrows, ncols, PCMLConfig.num_procs))
+    cellseconds = _calibrate(op)
+    numinputs = len(op._layers)
+
+    best = None
+    for exectype, procs, granularity in candidates:
+        count, outcells, incells = _subdomains(op, nrows, ncols, granularity)
+        if exectype == ExecutorType.serialpython:
+            count, outcells, incells = 1, nrows * ncols, nrows * ncols
+            seconds = cellseconds * (outcells + numinputs * incells)
+        else:
+            seconds = _seconds(exectype, procs, count, cellseconds * (outcells + numinputs * incells))
+        # The output layer and, for each running subdomain, its inputs converted to the compute data type
+        nbytes = nrows * ncols * outbytes + min(procs, count) * numinputs * incells * np.dtype(PCMLConfig.compute_dtype).itemsize
+        if best is None or seconds < best.seconds:
+            best = Plan(op, exectype, procs, granularity, count, seconds, nbytes)
+    return best
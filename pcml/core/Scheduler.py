@@ -5,16 +5,39 @@ Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfan
 """
 from ..util.Messaging import *
 from .PCMLPrims import *
+from .WorkerPool import *
+from .Distributed import rundistributed
+from .Streaming import isstreamed, runstreaming
+from .Planner import planoperation
+from .Decomposition import subdomaincost, costorder
+from .TaskMonitor import TaskMonitor
+from ..util.Affinity import configureworker
 import pcml.core.PCMLConfig as PCMLConfig
 
 
 import multiprocessing as mp
-import sys
+import ctypes
 import time
+import traceback
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+# concurrent.futures is part of Python 3 (and the futures package for Python 2)
+try:
+    PCMLConfig.futuresenabled = 1
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+except ImportError as e:
+    PCMLConfig.futuresenabled = 0
 
 
 class PoolProcess(mp.Process):
-    def __init__(self, rank, numproc, lock, queue, subdomainlists, operation):
+    """ Process subdomains from a shared queue and report when each one starts, finishes, or fails.
+    done holds a flag per subdomain group, duplicates of groups that are already done are skipped.
+    """
+
+    def __init__(self, rank, numproc, lock, queue, subdomainlists, operation, results, done):
         mp.Process.__init__(self)
         self.rank = rank
         self.numproc = numproc
@@ -22,23 +45,217 @@ class PoolProcess(mp.Process):
         self.queue = queue
         self.subdomainlists = subdomainlists
         self.operation = operation
+        self.results = results
+        self.done = done
 
     def run(self):
-        loop = True
-        while loop:
-            if self.queue.empty():
-                loop = False
+        configureworker(self.rank, self.numproc)
+        while True:
+            subdomainsindex = self.queue.get()
+            if subdomainsindex is None:  # Sentinel, no more subdomains to process
+                break
+            if self.done[subdomainsindex]:
+                self.results.put(('skip', self.rank, subdomainsindex, None))
                 continue
+            self.results.put(('start', self.rank, subdomainsindex, None))
             try:
-                subdomainsindex = self.queue.get(block=True, timeout=1)
-            except:
-                loop = False
+                subdomains = self.subdomainlists[subdomainsindex]
+                self.operation.executor(subdomains)
+                self.results.put(('done', self.rank, subdomainsindex, None))
+            except Exception:
+                self.results.put(('error', self.rank, subdomainsindex, traceback.format_exc()))
+
+
+class WorkStealingProcess(mp.Process):
+    """ Process subdomains from a contiguous range of tasks and steal half of the remaining
+    tasks from the busiest process when the range is exhausted.
+    order holds the subdomain indices, bounds holds [head, tail) of the range of each process.
+    Like PoolProcess, each subdomain is reported on results when it starts, finishes, or fails.
+    """
+
+    def __init__(self, rank, numproc, locks, order, bounds, subdomainlists, operation, results):
+        mp.Process.__init__(self)
+        self.rank = rank
+        self.numproc = numproc
+        self.locks = locks
+        self.order = order
+        self.bounds = bounds
+        self.subdomainlists = subdomainlists
+        self.operation = operation
+        self.results = results
+
+    def take(self):
+        # Take the next task from the front of this process' range
+        with self.locks[self.rank]:
+            head, tail = self.bounds[2 * self.rank], self.bounds[2 * self.rank + 1]
+            if head >= tail:
+                return None
+            self.bounds[2 * self.rank] = head + 1
+            return self.order[head]
+
+    def steal(self):
+        # Steal the back half of the range with the most remaining tasks, returns False if all ranges are empty
+        while True:
+            remaining = [self.bounds[2 * rank + 1] - self.bounds[2 * rank] for rank in xrange(self.numproc)]
+            victim = max(xrange(self.numproc), key=lambda rank: remaining[rank])
+            if remaining[victim] <= 0:
+                return False
+            with self.locks[victim]:
+                head, tail = self.bounds[2 * victim], self.bounds[2 * victim + 1]
+                if head >= tail:
+                    continue  # The victim finished its range while we looked, try again
+                newtail = tail - (tail - head + 1) // 2
+                self.bounds[2 * victim + 1] = newtail
+            # The stolen range is not visible to other processes until it is published here
+            with self.locks[self.rank]:
+                self.bounds[2 * self.rank] = newtail
+                self.bounds[2 * self.rank + 1] = tail
+            return True
+
+    def run(self):
+        configureworker(self.rank, self.numproc)
+        while True:
+            subdomainsindex = self.take()
+            if subdomainsindex is None:
+                if not self.steal():
+                    break  # Every range is empty, all subdomains are taken
                 continue
+            self.results.put(('start', self.rank, subdomainsindex, None))
             try:
                 subdomains = self.subdomainlists[subdomainsindex]
                 self.operation.executor(subdomains)
-            except:
-                PCMLException("Exception in process %i message %s " % (self.rank, sys.exc_info()[0]))
+                self.results.put(('done', self.rank, subdomainsindex, None))
+            except Exception:
+                self.results.put(('error', self.rank, subdomainsindex, traceback.format_exc()))
+        self.results.put(('exit', self.rank, None, None))
+
+
+# Follow the progress of the pool processes until every subdomain is done or has failed,
+# failed subdomains are queued again and stragglers are duplicated when a process is idle
+def monitorpool(pool, queue, results, done, monitor):
+    while not monitor.complete():
+        try:
+            kind, rank, taskid, message = results.get(timeout=PCMLConfig.speculation_interval)
+        except Empty:
+            kind = None
+        if kind == 'start':
+            monitor.start(taskid, rank)
+        elif kind == 'skip':
+            monitor.skip(taskid, rank)
+        elif kind == 'done':
+            if monitor.finish(taskid, rank):
+                done[taskid] = 1
+        elif kind == 'error':
+            if monitor.fail(taskid, rank, message):
+                queue.put(taskid)
+                monitor.queue(taskid)
+
+        # Replace processes that died (e.g., killed by the system), their subdomain is retried
+        for i, p in enumerate(pool):
+            if p.is_alive() or monitor.complete():
+                continue
+            for taskid in [taskid for taskid, copies in monitor.starts.items() if p.rank in [c[0] for c in copies]]:
+                if monitor.fail(taskid, p.rank, "Process %i exited with code %s" % (p.rank, p.exitcode)):
+                    queue.put(taskid)
+                    monitor.queue(taskid)
+            pool[i] = PoolProcess(p.rank, p.numproc, p.lock, queue, p.subdomainlists, p.operation, results, done)
+            pool[i].start()
+
+        # Duplicate the longest running stragglers on idle processes
+        idle = len(pool) - len(monitor.busy()) - monitor.queued
+        for taskid in monitor.stragglers()[:max(idle, 0)]:
+            print("Subdomain %i is straggling, running a duplicate" % taskid)
+            queue.put(taskid)
+            monitor.speculate(taskid)
+
+
+# Run the subdomains with work stealing processes until every subdomain is done or has failed.
+# Subdomains that failed (or whose process died) are run again by a new round of processes.
+def runworkstealing(op, subdomainlists):
+    num_procs = PCMLConfig.num_procs
+    monitor = TaskMonitor(xrange(len(subdomainlists)))
+    remaining = costorder(subdomainlists)
+    while remaining:
+        bounds = mp.RawArray(ctypes.c_long, costbalancedranges(subdomainlists, remaining, num_procs))
+        order = mp.RawArray(ctypes.c_long, remaining)
+        locks = [mp.Lock() for rank in xrange(num_procs)]
+        results = mp.Queue()
+
+        print("Starting", num_procs, "processes to apply", op, "to", len(remaining), "subdomains")
+        pool = [WorkStealingProcess(rank, num_procs, locks, order, bounds, subdomainlists, op, results) for rank in range(num_procs)]
+        for p in pool:
+            p.start()
+        exited = set()
+        while len(exited) < len(pool):
+            try:
+                kind, rank, taskid, message = results.get(timeout=PCMLConfig.speculation_interval)
+            except Empty:
+                # A process that died (e.g., killed by the system) fails the subdomain it was running
+                for p in pool:
+                    if p.rank not in exited and not p.is_alive():
+                        exited.add(p.rank)
+                        for taskid in [taskid for taskid, copies in monitor.starts.items() if p.rank in [c[0] for c in copies]]:
+                            monitor.fail(taskid, p.rank, "Process %i exited with code %s" % (p.rank, p.exitcode))
+                continue
+            if kind == 'start':
+                monitor.start(taskid, rank)
+            elif kind == 'done':
+                monitor.finish(taskid, rank)
+            elif kind == 'error':
+                monitor.fail(taskid, rank, message)
+            elif kind == 'exit':
+                exited.add(rank)
+        for p in pool:
+            p.join()
+        # Subdomains that failed and may be retried, and those left behind by processes that died
+        remaining = [taskid for taskid in remaining if not monitor.isdone(taskid)]
+    monitor.check(op.name)
+
+
+# Run the subdomains on threads of this process, failed subdomains are submitted again
+def runthreadpool(op, subdomainlists):
+    monitor = TaskMonitor(xrange(len(subdomainlists)))
+
+    def attempt(taskid):
+        # Return None if the subdomain is done, the traceback if it failed
+        try:
+            op.executor(list(subdomainlists[taskid]))  # Executors may pop the output subdomain, so give each one its own list
+            return None
+        except Exception:
+            return traceback.format_exc()
+
+    with ThreadPoolExecutor(max_workers=PCMLConfig.num_procs) as threads:
+        futures = dict((threads.submit(attempt, taskid), taskid) for taskid in costorder(subdomainlists))
+        while futures:
+            finished, running = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                taskid = futures.pop(future)
+                message = future.result()
+                if message is None:
+                    monitor.finish(taskid, 0)
+                elif monitor.fail(taskid, 0, message):
+                    futures[threads.submit(attempt, taskid)] = taskid
+    monitor.check(op.name)
+
+
+# Split tasks (ordered longest first) into num_procs contiguous ranges of about the same total cost
+def costbalancedranges(subdomainlists, order, num_procs):
+    costs = [subdomaincost(subdomainlists[i]) for i in order]
+    total = float(sum(costs))
+    bounds = []
+    head = 0
+    accumulated = 0.0
+    for rank in xrange(num_procs):
+        tail = head
+        # Extend the range until it reaches this process' share of the total cost
+        while tail < len(order) and accumulated < total * (rank + 1) / num_procs:
+            accumulated += costs[tail]
+            tail += 1
+        if rank == num_procs - 1:
+            tail = len(order)
+        bounds.extend([head, tail])
+        head = tail
+    return bounds
 
 
 # This is a work-in-progress that will handle applying a function to a layer
@@ -48,11 +265,30 @@ class PoolProcess(mp.Process):
 def scheduler(op):
     print("scheduling operation for execution %s" % op)
 
+    if isstreamed(op):
+        # Layers that are files are read and written block by block instead of being decomposed in memory
+        return runstreaming(op)
+
+    if PCMLConfig.exectype == ExecutorType.auto:
+        # Run with the executor, number of processes, and granularity predicted to be fastest for this operation
+        plan = planoperation(op)
+        print("Planned", plan)
+        previous = plan.apply()
+        try:
+            return scheduler(op)
+        finally:
+            plan.restore(previous)
+
     # First decompose layers into multiple subdomains based on operation
     subdomainlists = op._decompositionrun()
 
     exectype = PCMLConfig.exectype
 
+    if exectype in (ExecutorType.persistentpool, ExecutorType.distributed) and not op.isportable():
+        # Operations defined inside functions cannot be found by reference in worker processes
+        PCMLUserInformation("Operation %s is not defined at module level, executing in parallel python (Queue)" % op.name)
+        exectype = ExecutorType.parallelpythonqueue
+
     if exectype == ExecutorType.serialpython:
         print("Executing in serial python")
 
@@ -63,23 +299,59 @@ def scheduler(op):
     elif exectype == ExecutorType.parallelpythonqueue:  # Parallel python version
         print("Executing in parallel python (Queue)")
 
+        num_procs = PCMLConfig.num_procs
+
+        # Queue subdomains longest first, the sentinels (None) are queued once every subdomain is done
         queue = mp.Queue()
-        for i in xrange(len(subdomainlists)):
+        results = mp.Queue()
+        done = mp.RawArray(ctypes.c_byte, len(subdomainlists))
+        monitor = TaskMonitor(xrange(len(subdomainlists)))
+        for i in costorder(subdomainlists):
             queue.put(i)
-            # time.sleep(0.05) # Inserted to solve a bug in Python that is acknowledged online
-            # https://pythonadventures.wordpress.com/tag/processes/
-            # http://stackoverflow.com/questions/10607553/python-multiprocessing-queue-what-to-do-when-the-receiving-process-quits
+            monitor.queue(i)
 
         lock = mp.Lock()
 
-        num_procs = PCMLConfig.num_procs
-
         print("Starting", num_procs, "processes to apply", op, "to", len(subdomainlists), "subdomains")
-        pool = [PoolProcess(rank, num_procs, lock, queue, subdomainlists, op) for rank in range(num_procs)]
+        pool = [PoolProcess(rank, num_procs, lock, queue, subdomainlists, op, results, done) for rank in range(num_procs)]
         for p in pool:
             p.start()
+        monitorpool(pool, queue, results, done, monitor)
+        for p in pool:
+            queue.put(None)
+        busy = monitor.busy()
         for p in pool:
+            if p.rank in busy:
+                p.terminate()  # Still running a duplicate of a subdomain that is done, the first result was kept
             p.join()
+        monitor.check(op.name)
+        if subdomainlists[0][0].data_structure == Datastructure.pointlist:
+            op.writepointdatatooutputlayer(subdomainlists)
+
+    elif exectype == ExecutorType.workstealing:  # Parallel python version with work stealing
+        print("Executing in parallel python (Work stealing)")
+        runworkstealing(op, subdomainlists)
+        if subdomainlists[0][0].data_structure == Datastructure.pointlist:
+            op.writepointdatatooutputlayer(subdomainlists)
+
+    elif exectype == ExecutorType.threadpool:  # Threads in this process, for executors that release the GIL
+        if PCMLConfig.futuresenabled == 0:
+            PCMLNotSupported("concurrent.futures (futures package in Python 2) required for ExecutorType.threadpool")
+        print("Executing in python threads (ThreadPoolExecutor)")
+        runthreadpool(op, subdomainlists)
+        if subdomainlists[0][0].data_structure == Datastructure.pointlist:
+            op.writepointdatatooutputlayer(subdomainlists)
+
+    elif exectype == ExecutorType.persistentpool:  # Long-lived worker processes reused across operations
+        pool = getpool()
+        print("Executing in persistent python pool (%i processes) for %i subdomains" % (pool.num_procs, len(subdomainlists)))
+        pool.run(op, subdomainlists)
+        if subdomainlists[0][0].data_structure == Datastructure.pointlist:
+            op.writepointdatatooutputlayer(subdomainlists)
+
+    elif exectype == ExecutorType.distributed:  # Worker daemons on other machines (see pcml.worker)
+        print("Executing on %i distributed workers for %i subdomains" % (len(PCMLConfig.distributed_workers), len(subdomainlists)))
+        rundistributed(op, subdomainlists)
         if subdomainlists[0][0].data_structure == Datastructure.pointlist:
             op.writepointdatatooutputlayer(subdomainlists)
     else:
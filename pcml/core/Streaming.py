@@ -0,0 +1,128 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+
+Streaming execution of operations on layers that are handles on files (see pcml.lib.OperationIO.RasterFile).
+Blocks of rows are read with their halo when they are processed and the output rows are written
+to the output file as soon as they are computed, with at most PCMLConfig.stream_memory bytes in memory.
+"""
+from ..util.Messaging import *
+from .Subdomain import *
+from .PCMLPrims import *
+import pcml.core.PCMLConfig as PCMLConfig
+
+import collections
+import math
+import multiprocessing as mp
+import numpy as np
+
+
+def isstreamed(op):
+    """ Return True if an input or the output layer of op is a file that must be streamed """
+    return any(getattr(layer, 'streamed', False) for layer in list(op._layers) + [op.outputlayer])
+
+
+def _readrows(layer, r, nrows):
+    if getattr(layer, 'streamed', False):
+        return layer.readrows(r, nrows)
+    return layer.get_nparray()[r:r + nrows]
+
+
+def _writerows(layer, r, arr):
+    if getattr(layer, 'streamed', False):
+        layer.writerows(r, arr)
+    else:
+        layer.get_nparray()[r:r + len(arr)] = arr
+
+
+def rowsubdomain(layer, r, data):
+    """ Create a subdomain of layer (all columns) starting at row r that holds data """
+    nrows = len(data)
+    subdomain = Subdomain(layer.y + r * layer.cellsize, layer.x, nrows * layer.cellsize, layer.w, layer.title + " rows " + str(r))
+    subdomain.cellsize = layer.cellsize
+    subdomain.nodata_value = layer.nodata_value
+    subdomain.r = r
+    subdomain.c = 0
+    subdomain.set_data_ref(data)
+    return subdomain
+
+
+def blockrows(nrows, ncols, numinputs, halo, inflight):
+    """ Rows in each streamed block so that inflight blocks (inputs with their halo and the output) fit in
+    PCMLConfig.stream_memory. Blocks are counted twice, when they are sent to a worker both processes hold them.
+    """
+    rowbytes = ncols * np.dtype(np.float64).itemsize  # Inputs are converted to the compute data type at most
+    budget = PCMLConfig.stream_memory // (2 * inflight * rowbytes)
+    rows = (budget - 2 * halo * numinputs) // (numinputs + 1)
+    if rows < 1:
+        raise PCMLOperationError("stream_memory of %i bytes cannot hold %i blocks of rows with %i cells and a halo of %i rows"
+                                 % (PCMLConfig.stream_memory, inflight, ncols, halo))
+    return int(min(rows, int(math.ceil(nrows / float(inflight)))))
+
+
+def _block(op, inputs, r, nrows):
+    # Output subdomain followed by input subdomains (with the halo) for rows r to r+nrows
+    out = rowsubdomain(op.outputlayer, r, np.zeros((nrows, op.outputlayer.ncols), dtype=op.outputdtype()))
+    subdomains = [out]
+    for layer in inputs:
+        first = max(0, r - op.buffersize)
+        last = min(layer.nrows, r + nrows + op.buffersize)
+        subdomains.append(rowsubdomain(layer, first, _readrows(layer, first, last - first)))
+    return subdomains
+
+
+def _streamtask(op, subdomains):
+    outsubdomain = subdomains[0]  # Executors may remove the output subdomain from the list
+    op.executor(subdomains)
+    return outsubdomain.get_nparray()
+
+
+def runstreaming(op):
+    """ Apply op block by block from its input files to its output (a temporary file if no outputlayer is given) """
+    inputs = list(op._layers)
+    if op.opclass in (OpClass.zonalclass, OpClass.globalclass) or op.buffersize < 0:
+        raise PCMLOperationError("Operation %s needs entire layers and cannot be streamed from files" % op.name)
+    for layer in inputs:
+        if layer.data_structure != Datastructure.array:
+            raise PCMLOperationError("Only array layers can be streamed, %s is not an array" % layer.title)
+    if op.outputlayer is None:
+        op.outputlayer = [layer for layer in inputs if getattr(layer, 'streamed', False)][0].temporarylike(op.outputdtype())
+    output = op.outputlayer
+    if getattr(output, 'streamed', False):
+        if output in inputs and output.format == '.asc':
+            raise PCMLOperationError("ASCII grid %s is rewritten from its first row and cannot be an input of the operation writing it" % output.filename)
+        output.beginwrite()
+
+    parallel = PCMLConfig.exectype != ExecutorType.serialpython and PCMLConfig.num_procs > 1
+    if parallel and not op.isportable():
+        PCMLUserInformation("Operation %s is not defined at module level, streaming in serial" % op.name)
+        parallel = False
+    inflight = PCMLConfig.num_procs if parallel else 1
+    rows = blockrows(output.nrows, output.ncols, len(inputs), op.buffersize, inflight)
+    print("Streaming", op, "in blocks of", rows, "rows")
+
+    if not parallel:
+        for r in xrange(0, output.nrows, rows):
+            subdomains = _block(op, inputs, r, min(rows, output.nrows - r))
+            _writerows(output, r, _streamtask(op, subdomains))
+    else:
+        # Blocks are read while the workers compute, results are written in order
+        pool = mp.Pool(inflight)
+        try:
+            pending = collections.deque()
+            for r in xrange(0, output.nrows, rows):
+                if len(pending) == inflight:
+                    first, result = pending.popleft()
+                    _writerows(output, first, result.get())
+                subdomains = _block(op, inputs, r, min(rows, output.nrows - r))
+                pending.append((r, pool.apply_async(_streamtask, (op, subdomains))))
+            while pending:
+                first, result = pending.popleft()
+                _writerows(output, first, result.get())
+        finally:
+            pool.terminate()
+            pool.join()
+    if getattr(output, 'streamed', False):
+        output.flush()
+    return output
@@ -0,0 +1,128 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+"""
+from ..util.Messaging import *
+import pcml.core.PCMLConfig as PCMLConfig
+
+import time
+
+
+class TaskMonitor(object):
+    """ Track the start and finish times of the tasks (groups of subdomains) of an operation.
+    Used by the parallel executors to retry failed tasks and to duplicate stragglers,
+    a task running well past the median task time is run again on an idle worker and the first result is kept.
+    """
+
+    def __init__(self, taskids):
+        self.taskids = list(taskids)
+        self.starts = {}       # taskid -> list of (rank, start time) of the running copies
+        self.durations = []    # Times of the finished tasks
+        self.done = set()
+        self.failed = {}       # taskid -> message of the last failure, once retries are exhausted
+        self.attempts = dict((taskid, 0) for taskid in self.taskids)
+        self.speculated = set()
+        self.queued = 0        # Tasks sent to the workers that have not started yet
+
+    def __repr__(self):
+        return "<TaskMonitor: %i of %i done, %i failed>" % (len(self.done), len(self.taskids), len(self.failed))
+
+    def complete(self):
+        """ True once every task has finished or failed """
+        return len(self.done) + len(self.failed) == len(self.taskids)
+
+    def isdone(self, taskid):
+        return taskid in self.done or taskid in self.failed
+
+    def queue(self, taskid):
+        """ Record that taskid was sent to the workers """
+        self.queued += 1
+
+    def start(self, taskid, rank):
+        self.queued = max(self.queued - 1, 0)
+        self.starts.setdefault(taskid, []).append((rank, time.time()))
+
+    def skip(self, taskid, rank):
+        """ A queued copy of taskid was not run because the task was already done """
+        self.queued = max(self.queued - 1, 0)
+
+    def _stop(self, taskid, rank):
+        copies = self.starts.get(taskid, [])
+        for copy in copies:
+            if copy[0] == rank:
+                copies.remove(copy)
+                return copy[1]
+        return None
+
+    def finish(self, taskid, rank):
+        """ Record that rank finished taskid, returns True if this is the first result for the task """
+        started = self._stop(taskid, rank)
+        if self.isdone(taskid):
+            return False
+        if started is not None:
+            self.durations.append(time.time() - started)
+        self.done.add(taskid)
+        return True
+
+    def fail(self, taskid, rank, message):
+        """ Record that taskid failed on rank, returns True if the task should be run again """
+        self._stop(taskid, rank)
+        if self.isdone(taskid):
+            return False
+        if self.starts.get(taskid):
+            return False  # A duplicate is still running and may succeed
+        self.attempts[taskid] += 1
+        if self.attempts[taskid] <= PCMLConfig.task_retries:
+            return True
+        self.failed[taskid] = message
+        return False
+
+    def cancel(self, taskid, rank):
+        """ Record that the copy of taskid on rank was stopped """
+        self._stop(taskid, rank)
+
+    def busy(self):
+        """ Return the ranks that are running any task, including duplicates of tasks that are done """
+        return [rank for copies in self.starts.values() for rank, started in copies]
+
+    def _threshold(self):
+        # Seconds after which a task is a straggler, None if duplication is disabled or no task finished yet
+        if PCMLConfig.speculation_factor <= 0 or not self.durations:
+            return None
+        durations = sorted(self.durations)
+        return max(durations[len(durations) // 2] * PCMLConfig.speculation_factor, PCMLConfig.speculation_min_time)
+
+    def stragglers(self):
+        """ Return the tasks that should be duplicated, the longest running first """
+        threshold = self._threshold()
+        if threshold is None:
+            return []
+        now = time.time()
+        stragglers = []
+        for taskid, copies in self.starts.items():
+            if len(copies) != 1 or taskid in self.speculated or self.isdone(taskid):
+                continue
+            elapsed = now - copies[0][1]
+            if elapsed > threshold:
+                stragglers.append((elapsed, taskid))
+        return [taskid for elapsed, taskid in sorted(stragglers, reverse=True)]
+
+    def stalled(self):
+        """ Return the ranks that have been running the same task (even a finished one) past the straggler threshold """
+        threshold = self._threshold()
+        if threshold is None:
+            return []
+        now = time.time()
+        return [rank for copies in self.starts.values() for rank, started in copies if now - started > threshold]
+
+    def check(self, name):
+        """ Raise PCMLOperationError reporting the first failed task of operation name, if any task failed """
+        if self.failed:
+            taskid = min(self.failed)
+            raise PCMLOperationError("%i subdomains failed in %s, first failure (subdomain %i):\n%s" % (len(self.failed), name, taskid, self.failed[taskid]))
+
+    def speculate(self, taskid):
+        """ Record that a duplicate of taskid was sent to the workers """
+        self.speculated.add(taskid)
+        self.queue(taskid)
@@ -0,0 +1,430 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+"""
+from ..util.Messaging import *
+from ..util.SharedMemory import releaseattachedsegments
+from .PCMLPrims import *
+from .Decomposition import costorder
+from .TaskMonitor import TaskMonitor
+from ..util.Affinity import configureworker
+import pcml.core.PCMLConfig as PCMLConfig
+
+import multiprocessing as mp
+import atexit
+import collections
+import copy
+import select
+import traceback
+import numpy as np
+
+
+def _subdomainresult(outsubdomain):
+    """ Return the data a worker must send back for an output subdomain.
+    Data that is not shared with the parent process (a private copy) is returned, data in a shared segment returns None.
+    """
+    if outsubdomain.data_structure == Datastructure.array:
+        if outsubdomain._segment is not None:
+            return None  # Written directly into the shared segment of the output layer
+        return outsubdomain.get_nparray()
+    pointlist = outsubdomain.get_pointlist()
+    if isinstance(pointlist, list):
+        return pointlist
+    return None  # Manager lists are already shared with the parent
+
+
+def _privateoutput(subdomain):
+    """ Return a copy of an output subdomain with its own data, not shared with the output layer """
+    private = copy.copy(subdomain)
+    private._segment = None
+    private._segmentshape = None
+    if subdomain.data_structure == Datastructure.array:
+        private._data = np.zeros_like(subdomain.get_nparray())
+    else:
+        private._data = []
+    return private
+
+
+def _applyresult(outsubdomain, result):
+    """ Copy a result returned by a worker into the output subdomain held by the parent process """
+    if result is None:
+        return
+    if outsubdomain.data_structure == Datastructure.array:
+        outsubdomain.get_nparray()[:, :] = result
+    else:
+        outsubdomain.set_pointlist(result)
+
+
+class PersistentPoolProcess(mp.Process):
+    """ A worker process that stays alive across operations and executes tasks from its inbox.
+    Messages are sent back on a pipe of its own, so the worker can be terminated without
+    breaking a channel other workers write to.
+    """
+
+    def __init__(self, rank, numproc):
+        mp.Process.__init__(self)
+        self.daemon = True
+        self.rank = rank
+        self.numproc = numproc
+        self.inbox = mp.Queue()
+        self.reader, self.results = mp.Pipe(duplex=False)
+
+    def start(self):
+        mp.Process.start(self)
+        self.results.close()  # Only the worker writes, the pipe reports the end of file once it exits
+
+    def run(self):
+        configureworker(self.rank, self.numproc)
+        operation = None
+        while True:
+            try:
+                message = self.inbox.get()
+            except Exception:
+                # A message that cannot be received (e.g., unpicklable) is reported, the worker keeps going
+                self.results.send(('fatal', self.rank, None, None, traceback.format_exc()))
+                continue
+            if message is None:  # Sentinel, shutdown the worker
+                break
+            if message[0] == 'op':
+                operation = message[2]
+                # Segments mapped for the previous operation are no longer needed
+                releaseattachedsegments()
+                continue
+            _, opid, taskid, subdomains = message
+            self.results.send(('start', self.rank, opid, taskid, None))
+            try:
+                outsubdomain = subdomains[0]
+                operation.executor(subdomains)
+                self.results.send(('done', self.rank, opid, taskid, _subdomainresult(outsubdomain)))
+            except Exception:
+                self.results.send(('error', self.rank, opid, taskid, traceback.format_exc()))
+
+
+class LocalityQueue(object):
+    """ Tasks waiting to be sent to the workers of a persistent pool.
+    A task may be queued for a preferred worker (the one that produced its input), other tasks are shared.
+    A worker takes its own tasks first, then shared tasks, and then steals from the worker with the most tasks.
+    """
+
+    def __init__(self, ranks):
+        self.preferred = dict((rank, collections.deque()) for rank in ranks)
+        self.shared = collections.deque()
+
+    def __len__(self):
+        return len(self.shared) + sum(len(tasks) for tasks in self.preferred.values())
+
+    def put(self, taskid, rank=None, front=False):
+        tasks = self.shared if rank is None or rank not in self.preferred else self.preferred[rank]
+        if front:
+            tasks.appendleft(taskid)
+        else:
+            tasks.append(taskid)
+
+    def get(self, rank, steal=True):
+        """ Return the next task for rank, None if no task is waiting (or only other workers' tasks if steal is False) """
+        if self.preferred.get(rank):
+            return self.preferred[rank].popleft()
+        if self.shared:
+            return self.shared.popleft()
+        if not steal:
+            return None
+        victim = max(self.preferred, key=lambda r: len(self.preferred[r]))
+        if self.preferred[victim]:
+            return self.preferred[victim].pop()  # Steal the cheapest task of the busiest worker
+        return None
+
+
+def _overlap(a, b):
+    # Number of cells shared by two (r, c, nrows, ncols) rectangles
+    rows = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    cols = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    return max(rows, 0) * max(cols, 0)
+
+
+def _rectangle(subdomain):
+    return (subdomain.r, subdomain.c, subdomain.nrows, subdomain.ncols)
+
+
+class PersistentPool(object):
+    """ A pool of worker processes that is started once and reused by every operation.
+    Operations and their subdomains are sent to the workers over a task channel.
+    The pool can be used as a context manager, in which case operations scheduled
+    inside the with block use this pool and it is shutdown on exit.
+    """
+
+    def __init__(self, num_procs=None):
+        """ Create a persistent pool
+        :param num_procs (int): Number of worker processes (default PCMLConfig.num_procs)
+        """
+        if num_procs is None:
+            num_procs = PCMLConfig.num_procs
+        if num_procs < 1:
+            raise PCMLInvalidInput("PersistentPool requires at least one process", num_procs)
+        self.num_procs = num_procs
+        self._workers = []
+        self._opid = 0
+        # Output rectangles written by each worker, (r, c, nrows, ncols, rank) indexed by segment path, most recent last
+        self._produced = collections.OrderedDict()
+        # Rank that ran each task of the last operation
+        self.assignments = {}
+
+    def __repr__(self):
+        return "<PersistentPool: %i processes (%s)>" % (self.num_procs, "running" if self.isrunning() else "stopped")
+
+    def __enter__(self):
+        self.start()
+        _activepools.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _activepools.remove(self)
+        self.shutdown()
+        return False
+
+    def isrunning(self):
+        return len(self._workers) > 0
+
+    def start(self):
+        """ Start the worker processes (does nothing if the pool is already running) """
+        if self.isrunning():
+            return
+        for rank in xrange(self.num_procs):
+            worker = PersistentPoolProcess(rank, self.num_procs)
+            worker.start()
+            self._workers.append(worker)
+
+    def shutdown(self):
+        """ Stop all worker processes, the pool can be started again afterwards """
+        for worker in self._workers:
+            if worker.is_alive():
+                worker.inbox.put(None)
+        for worker in self._workers:
+            worker.join(PCMLConfig.pool_poll_interval * 5)
+            if worker.is_alive():
+                worker.terminate()
+            worker.inbox.close()
+            worker.reader.close()
+        self._workers = []
+
+    def _respawn(self, worker):
+        """ Replace a worker process that died or was terminated """
+        worker.join()
+        worker.inbox.close()
+        worker.reader.close()
+        replacement = PersistentPoolProcess(worker.rank, self.num_procs)
+        replacement.start()
+        self._workers[self._workers.index(worker)] = replacement
+        return replacement
+
+    def _receive(self, timeout):
+        """ Return the next message of any worker, None if no message arrives within timeout.
+        A worker that exited is reported as ('died', rank, None, None, None).
+        """
+        readers = dict((worker.reader.fileno(), worker) for worker in self._workers)
+        poller = select.poll()  # Unlike select.select, poll accepts descriptors above FD_SETSIZE
+        for fd in readers:
+            poller.register(fd, select.POLLIN)
+        ready = poller.poll(timeout * 1000)
+        if not ready:
+            return None
+        worker = readers[ready[0][0]]
+        try:
+            return worker.reader.recv()
+        except (EOFError, IOError):
+            return ('died', worker.rank, None, None, None)
+
+    def _record(self, outsubdomain, rank):
+        # Remember which worker wrote the output subdomain so the next operation reading it can go to that worker
+        segment = outsubdomain._segment
+        if segment is None or outsubdomain.data_structure != Datastructure.array:
+            return
+        if segment.path not in self._produced:
+            self._produced[segment.path] = []
+            while len(self._produced) > PCMLConfig.pool_locality_layers:
+                self._produced.popitem(last=False)
+        self._produced[segment.path].append(_rectangle(outsubdomain) + (rank,))
+
+    def preferredrank(self, subdomains):
+        """ Return the rank that produced more than half of the input subdomains, None if no worker did """
+        overlaps = collections.defaultdict(int)
+        cells = 0
+        for subdomain in subdomains[1:]:
+            if subdomain._segment is None or subdomain.data_structure != Datastructure.array:
+                continue
+            rectangle = _rectangle(subdomain)
+            cells += subdomain.nrows * subdomain.ncols
+            for produced in self._produced.get(subdomain._segment.path, ()):
+                overlaps[produced[4]] += _overlap(rectangle, produced)
+        if not overlaps:
+            return None
+        rank = max(overlaps, key=lambda r: overlaps[r])
+        if overlaps[rank] * 2 <= cells:
+            return None  # For example zonal operations that read the whole layer
+        return rank
+
+    def run(self, op, subdomainlists):
+        """ Apply op.executor to every group of subdomains in subdomainlists using the workers.
+        Failed tasks are retried and stragglers are duplicated on idle workers (see TaskMonitor).
+        Duplicates write to a private copy of their output subdomain that is copied to the output layer
+        if they finish first, the worker still running (or holding) the original task is then replaced,
+        so no worker writes to the output layer once run returns.
+        """
+        self.start()
+        self._opid += 1
+        opid = self._opid
+        for worker in self._workers:
+            worker.inbox.put(('op', opid, op))
+
+        # Dispatch the most expensive subdomains first so they do not become stragglers,
+        # preferably to the worker that produced their input so it is still in its cache and on its NUMA node
+        pending = LocalityQueue(worker.rank for worker in self._workers)
+        outsegment = subdomainlists[0][0]._segment if subdomainlists else None
+        if outsegment is not None:
+            self._produced.pop(outsegment.path, None)  # The output layer is written again
+        for taskid in costorder(subdomainlists):
+            pending.put(taskid, self.preferredrank(subdomainlists[taskid]) if PCMLConfig.pool_locality else None)
+        outstanding = dict((worker.rank, set()) for worker in self._workers)
+        speculative = set()  # (rank, taskid) of the duplicates sent to the workers
+        monitor = TaskMonitor(xrange(len(subdomainlists)))
+        self.assignments = {}
+
+        def send(worker, taskid, duplicate=False):
+            outstanding[worker.rank].add(taskid)
+            subdomains = subdomainlists[taskid]
+            if duplicate:
+                speculative.add((worker.rank, taskid))
+                subdomains = [_privateoutput(subdomains[0])] + list(subdomains[1:])
+            worker.inbox.put(('task', opid, taskid, subdomains))
+
+        def dispatch():
+            # Keep up to pool_prefetch tasks queued for each worker, only idle workers steal tasks of other workers
+            for steal in (False, True):
+                for worker in self._workers:
+                    if steal and outstanding[worker.rank]:
+                        continue
+                    while len(outstanding[worker.rank]) < PCMLConfig.pool_prefetch:
+                        taskid = pending.get(worker.rank, steal)
+                        if taskid is None:
+                            break
+                        if not monitor.isdone(taskid):
+                            monitor.queue(taskid)
+                            send(worker, taskid)
+
+        def retry(rank, taskid, message):
+            outstanding[rank].discard(taskid)
+            speculative.discard((rank, taskid))
+            if monitor.fail(taskid, rank, message):
+                pending.put(taskid, front=True)
+
+        def replace(worker):
+            # Terminate a worker whose task is no longer wanted, its other tasks are queued again
+            worker.terminate()
+            for taskid in outstanding[worker.rank]:
+                monitor.cancel(taskid, worker.rank)
+                if (worker.rank, taskid) not in speculative and not monitor.isdone(taskid):
+                    pending.put(taskid, front=True)
+                speculative.discard((worker.rank, taskid))
+            outstanding[worker.rank] = set()
+            self._respawn(worker).inbox.put(('op', opid, op))
+
+        def originals(taskid):
+            # Workers running or holding the copy of taskid that writes to the output layer
+            return [worker for worker in self._workers if taskid in outstanding[worker.rank] and (worker.rank, taskid) not in speculative]
+
+        dispatch()
+        while not monitor.complete():
+            message = self._receive(PCMLConfig.pool_poll_interval)
+            kind, rank, msgopid, taskid, payload = message if message is not None else (None,) * 5
+            if kind == 'died' or (kind is None and any(not worker.is_alive() for worker in self._workers)):
+                # The worker died, its tasks are retried on a new worker
+                for worker in [worker for worker in self._workers if not worker.is_alive() or worker.rank == rank]:
+                    for lost in list(outstanding[worker.rank]):
+                        retry(worker.rank, lost, "Persistent pool process %i died while running %s" % (worker.rank, op.name))
+                    self._respawn(worker).inbox.put(('op', opid, op))
+            elif kind == 'fatal':
+                self.shutdown()
+                raise PCMLOperationError("Persistent pool process %i could not receive a task:\n%s" % (rank, payload))
+            elif kind is not None and msgopid == opid:  # Otherwise a late message from an earlier operation
+                if kind == 'start':
+                    monitor.start(taskid, rank)
+                elif kind == 'done':
+                    outstanding[rank].discard(taskid)
+                    duplicate = (rank, taskid) in speculative
+                    speculative.discard((rank, taskid))
+                    if monitor.finish(taskid, rank):
+                        if duplicate:
+                            # The original must not write to the output layer after the result of the duplicate
+                            for worker in originals(taskid):
+                                replace(worker)
+                        else:
+                            self._record(subdomainlists[taskid][0], rank)
+                        _applyresult(subdomainlists[taskid][0], payload)
+                        self.assignments[taskid] = rank
+                else:
+                    retry(rank, taskid, payload)
+
+            # Duplicate the longest running stragglers on idle workers, the first result is kept
+            idle = [worker for worker in self._workers if not outstanding[worker.rank]]
+            if idle and not pending:
+                duplicates = monitor.stragglers()
+                # Tasks queued behind a straggler on a stalled worker have not started yet
+                for rank in monitor.stalled():
+                    duplicates.extend(taskid for taskid in outstanding[rank] if not monitor.starts.get(taskid) and not monitor.isdone(taskid) and taskid not in monitor.speculated)
+                for worker, taskid in zip(idle, duplicates):
+                    monitor.speculate(taskid)
+                    send(worker, taskid, duplicate=True)
+            dispatch()
+
+        # Tasks whose original copy still writes to the output layer (e.g., one that failed for good while
+        # its duplicate runs) are stopped, duplicates still running only write to their private copies
+        for worker in list(self._workers):
+            if any((worker.rank, taskid) not in speculative for taskid in outstanding[worker.rank]):
+                replace(worker)
+
+        monitor.check(op.name)
+
+
+# Pools entered using a with statement, the most recent one is used by the scheduler
+_activepools = []
+
+# The default pool created on demand when exectype is ExecutorType.persistentpool
+_defaultpool = None
+
+
+def getpool():
+    """ Return the pool used by the scheduler, starting the default pool if necessary """
+    global _defaultpool
+    if _activepools:
+        return _activepools[-1]
+    if _defaultpool is not None and _defaultpool.num_procs != PCMLConfig.num_procs:
+        _defaultpool.shutdown()  # num_procs changed since the default pool was started
+        _defaultpool = None
+    if _defaultpool is None:
+        _defaultpool = PersistentPool(PCMLConfig.num_procs)
+    _defaultpool.start()
+    return _defaultpool
+
+
+def activepool():
+    """ Return the pool of the innermost with block that uses one, None outside of such blocks """
+    return _activepools[-1] if _activepools else None
+
+
+def runningpoolsize():
+    """ Return the number of processes of the pool getpool returns if it is already running, otherwise 0 """
+    if _activepools:
+        return _activepools[-1].num_procs
+    if _defaultpool is not None and _defaultpool.isrunning():
+        return _defaultpool.num_procs
+    return 0
+
+
+def shutdownpool():
+    """ Shutdown the default persistent pool (it is restarted by the next operation that needs it) """
+    global _defaultpool
+    if _defaultpool is not None:
+        _defaultpool.shutdown()
+        _defaultpool = None
+
+atexit.register(shutdownpool)
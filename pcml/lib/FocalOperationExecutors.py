@@ -5,6 +5,7 @@ Authors and contributors: Eric Shook (eshook@kent.edu); Jayakrishnan Ajayakumar
 from ..core.Operation import *
 from ..core.Scheduler import *
 from ..util.OperationBuilder import *
+from .FocalOperationKernels import *
 import pcml.core.PCMLConfig as PCMLConfig
 import numpy as np
 import types
@@ -30,49 +31,14 @@ except ImportError as e:
 def FocalMean_np_exec(self, subdomains):
     # Get the array from the output subdomain as well as the output subdomain
     outsubdomain = subdomains[0]
-    outarr = outsubdomain.get_nparray() 
+    outarr = outsubdomain.get_nparray()
     # Get the input subdomain
     insubdomain = subdomains[1]
-    inarr = insubdomain.get_nparray() 
-
-    # Get the buffersize for the focal operation
-    buffersize=self.buffersize
-
-    locind={}
-
-    for roworig in xrange(outsubdomain.nrows):
-        for colorig in xrange(outsubdomain.ncols):
-            # Calculate the row and column positions (global for the study area)
-            # which is why we add outsubdomain.{r,c}
-            locind['r']=roworig+outsubdomain.r
-            locind['c']=colorig+outsubdomain.c
-
-            # The following 2 lines of code are the easy-to-read version of the code below
-            # Essentially we get the location for the input array and then average it
-            # Get the array from the location
-            #arr=insubdomain.bufferedlocgetarr(locind,buffersize)
-            # Calculate the mean and set it
-            #outarr[roworig][colorig]=np.average(arr)
-
-            # Add the offsets for the subdomains (difference etween out/input subdomains) 
-            row=locind['r']-insubdomain.r
-            col=locind['c']-insubdomain.c
-            # Calculate the starting row and column accounting for buffersize and the edge of layer
-            r=max(0,row-buffersize)
-            c=max(0,col-buffersize)
 
-            # Calculate the h accounting for buffersize and edge of layer
-            h=buffersize+(row-r)+1
-            if (r+h > insubdomain.nrows):
-                h=insubdomain.nrows-r
-
-            # Same for width 
-            w=buffersize+(col-c)+1
-            if (c+w > insubdomain.ncols):
-                w=insubdomain.ncols-c
-
-            # Take a slice of the array (inarr) based on those calculations, average the results
-            outarr[roworig][colorig]=np.average(inarr[r:r + h, c:c + w])
+    # Sum and count the cells of every window (clipped at the edge of the layer) with four lookups
+    # in the summed-area table of the input subdomain, the buffersize does not change the cost per cell
+    sums, counts = focalsums(outsubdomain, insubdomain, self.buffersize)
+    outarr[:, :] = sums / counts
 
 if PCMLConfig.numbaenabled == 1:
 
@@ -200,45 +166,30 @@ def Contour_Lines_Numba(self,subdomains): # Experimental
     datarrdim=np.array([subdomains[1].nrows,subdomains[1].ncols,subdomains[1].r,subdomains[1].c])
     countour_line_calc(outarray,outarrdim,dataarray,datarrdim,self.buffersize,subdomains[1].nodata_value)
 
-# Makes a footprint array for ndimage filters (can be used by Buffer for example)
-def _makefp(dist,cellsize):
-    # Calculate the array size for footprint
-    fpsize=int(math.ceil(dist/cellsize)*2)+1
-    # Calculate the "raster distance" in number of cells from center
-    rdist=math.ceil(dist/cellsize)
-    # Create footprint array
-    fp=np.zeros((fpsize,fpsize))
-    for i in xrange(fpsize):
-        for j in xrange(fpsize):
-            xd=(rdist-i)*cellsize
-            yd=(rdist-j)*cellsize
-            d=math.sqrt(xd*xd + yd*yd) # Calculate distance
-            if(d<=dist):               # if less than dist, 1 else 0
-                fp[i][j]=1
-            else:
-                fp[i][j]=0
-    return fp
-
-# Function for nearby classify used in scipy.ndimage.generic_filter
-def _nearbyclassifyfunct(values,classifyval):
-    if classifyval in values: # If we find classifyval in the search space
-        return 1              # Return true (1)
-    else:
-        return 0
-
-# Function for buffer to be used in scipy.ndimage.generic_filter
-def _bufferfunct(values,classifyval):
-    if classifyval in values: # If we find classifyval in the search space
-        return classifyval    # Return it (which acts as a buffer)
-    else:
-        return values[len(values)/2]  # Otherwise return the original value (in the middle of values array)
-
+# Cells of the output subdomain within dist (map units) of a cell of the input subdomain holding classifyval
+def _withinbuffer(outsubdomain,insubdomain,classifyval,dist):
+    if PCMLConfig.scipyenabled == 0:
+        PCMLNotSupported("SciPy module required for FocalBuffer and BufferedClassify")
+    roffset=outsubdomain.r-insubdomain.r
+    coffset=outsubdomain.c-insubdomain.c
+    classcells=insubdomain.get_nparray()==classifyval
+    if not classcells.any():
+        return np.zeros((outsubdomain.nrows,outsubdomain.ncols),dtype=bool)
+    # The Euclidean distance transform finds the nearest class cell of every cell in one pass over the subdomain
+    # (instead of testing a circular footprint around each cell), only the output part is needed
+    nearest=ndimage.distance_transform_edt(~classcells,return_distances=False,return_indices=True)
+    nearest=nearest[:,roffset:roffset+outsubdomain.nrows,coffset:coffset+outsubdomain.ncols]
+    rows=np.arange(roffset,roffset+outsubdomain.nrows).reshape(-1,1)
+    cols=np.arange(coffset,coffset+outsubdomain.ncols).reshape(1,-1)
+    # Same distance test between cell centers as the footprint the buffers used before
+    xd=(nearest[0]-rows)*outsubdomain.cellsize
+    yd=(nearest[1]-cols)*outsubdomain.cellsize
+    return np.sqrt(xd*xd+yd*yd)<=dist
+
+@nativedtype
 @executor
 @focaloperation
 def FocalBuffer(self,subdomains):
-    if PCMLConfig.scipyenabled == 0:
-        PCMLNotSupported("SciPy module required for getneighbors()")
- 
     # Get the array from the output subdomain as well as the output subdomain
     outsubdomain = subdomains[0]
     outarr = outsubdomain.get_nparray()
@@ -248,17 +199,14 @@ def FocalBuffer(self,subdomains):
 
     classifyval = self.kwargs.get('classtype',0)
 
-    # Create the footprint array for ndimage filter
-    fp = _makefp(self.buffersize,outsubdomain.cellsize)
-
-    arr=ndimage.generic_filter(inarr,function=_bufferfunct,footprint=fp,extra_arguments=(classifyval,))
-
-    # Copy values to outarr (outsubdomain)
+    # Cells within buffersize of classifyval become classifyval, the others keep their value
+    within = _withinbuffer(outsubdomain,insubdomain,classifyval,self.buffersize)
     roffset=outsubdomain.r-insubdomain.r
     coffset=outsubdomain.c-insubdomain.c
-    outarr[:,:]=arr[roffset:outsubdomain.nrows+roffset,coffset:outsubdomain.ncols+coffset]
+    outarr[:,:]=np.where(within,classifyval,inarr[roffset:outsubdomain.nrows+roffset,coffset:outsubdomain.ncols+coffset])
     
 
+@nativedtype
 @executor
 @focaloperation
 def BufferedClassify(self,subdomains):
@@ -267,20 +215,11 @@ def BufferedClassify(self,subdomains):
     outarr = outsubdomain.get_nparray()
     # Get the input subdomain
     insubdomain = subdomains[1]
-    inarr = insubdomain.get_nparray()
 
     classifyval = self.kwargs.get('classtype',0)
 
-    # Create the footprint array for ndimage filter
-    fp = _makefp(self.buffersize,outsubdomain.cellsize)
-
-    arr=ndimage.generic_filter(inarr,function=_nearbyclassifyfunct,footprint=fp,extra_arguments=(classifyval,))
-
-    # Only get the inside portion of the insubdomain array (this complex thing trims out ghost zones)
-    roffset=outsubdomain.r-insubdomain.r
-    coffset=outsubdomain.c-insubdomain.c
-    outarr[:,:]=arr[roffset:outsubdomain.nrows+roffset,coffset:outsubdomain.ncols+coffset]
-    #outarr[:,:]=arr[outsubdomain.r-insubdomain.r:outsubdomain.nrows,outsubdomain.c-insubdomain.c:outsubdomain.ncols]
+    # 1 for cells within buffersize of classifyval, otherwise 0
+    outarr[:,:]=_withinbuffer(outsubdomain,insubdomain,classifyval,self.buffersize)
     
 
 
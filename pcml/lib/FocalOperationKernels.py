@@ -0,0 +1,315 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+
+Vectorized kernels used by focal executors. They compute every window of an output subdomain at once
+from the input subdomain (which holds the halo), with the same clipped windows at the edges of the layer
+as BoundingBox.bufferedlocgetarr, so each output cell costs the same whatever the buffersize.
+"""
+import pcml.core.PCMLConfig as PCMLConfig
+import numpy as np
+
+
+def windowbounds(outsubdomain, insubdomain, buffersize):
+    """ Return (first rows, end rows), (first columns, end columns) in the array of insubdomain
+    of the window around each row and column of outsubdomain, clipped to insubdomain
+    """
+    rows = np.arange(outsubdomain.nrows) + (outsubdomain.r - insubdomain.r)
+    cols = np.arange(outsubdomain.ncols) + (outsubdomain.c - insubdomain.c)
+    return ((np.maximum(rows - buffersize, 0), np.minimum(rows + buffersize + 1, insubdomain.nrows)),
+            (np.maximum(cols - buffersize, 0), np.minimum(cols + buffersize + 1, insubdomain.ncols)))
+
+
+def integralimage(arr):
+    """ Summed-area table of arr with a leading row and column of zeros, entry [i, j] is the sum of arr[:i, :j] """
+    table = np.zeros((arr.shape[0] + 1, arr.shape[1] + 1), dtype=np.float64)
+    np.cumsum(arr, axis=0, dtype=np.float64, out=table[1:, 1:])
+    np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+    return table
+
+
+def windowsums(arr, rows, cols):
+    """ Sum of the values and number of cells in every window given by rows and cols (see windowbounds),
+    four lookups in the summed-area table of arr per window
+    """
+    (r0, r1), (c0, c1) = rows, cols
+
+    def lookup(table):
+        return table[np.ix_(r1, c1)] - table[np.ix_(r0, c1)] - table[np.ix_(r1, c0)] + table[np.ix_(r0, c0)]
+
+    # A NaN or infinity would spread to every later entry of the table (inf - inf is NaN), so non-finite cells
+    # are summed as 0 and only the windows containing one get NaN, inf, or -inf
+    nonfinite = ~np.isfinite(arr) if arr.dtype.kind == 'f' else None
+    if nonfinite is not None and nonfinite.any():
+        nans, positive, negative = np.isnan(arr), arr == np.inf, arr == -np.inf
+        finite = arr[~nonfinite]
+        arr = np.where(nonfinite, 0, arr)
+    else:
+        nonfinite = None
+        finite = arr
+    # Values are summed relative to the (rounded) mean of the finite values, so the table stays small and loses
+    # less precision on large subdomains, integer values remain exact
+    offset = np.round(np.mean(finite, dtype=np.float64)) if finite.size else 0.0
+    sums = lookup(integralimage(arr - offset if offset else arr))
+    counts = np.outer(r1 - r0, c1 - c0)
+    if offset:
+        sums += offset * counts
+    if nonfinite is not None:
+        positive, negative = lookup(integralimage(positive)) > 0, lookup(integralimage(negative)) > 0
+        sums[positive] = np.inf
+        sums[negative] = -np.inf
+        sums[(lookup(integralimage(nans)) > 0) | (positive & negative)] = np.nan  # inf - inf is NaN as well
+    return sums, counts
+
+
+def focalsums(outsubdomain, insubdomain, buffersize):
+    """ Window sums and cell counts around each cell of outsubdomain """
+    rows, cols = windowbounds(outsubdomain, insubdomain, buffersize)
+    return windowsums(insubdomain.get_nparray(), rows, cols)
+
+
+def _identity(dtype, ufunc):
+    # Value that never wins a comparison of ufunc (np.maximum or np.minimum) for dtype
+    if dtype.kind == 'f':
+        return -np.inf if ufunc is np.maximum else np.inf
+    info = np.iinfo(dtype)
+    return info.min if ufunc is np.maximum else info.max
+
+
+def slidingextremes(arr, buffersize, axis, ufunc):
+    """ Maximum (ufunc=np.maximum) or minimum (np.minimum) of arr over windows of buffersize cells
+    on both sides of each cell along axis, windows are clipped at the ends.
+    Van Herk/Gil-Werman: the axis is split in blocks of the window size, prefix and suffix extremes
+    of each block are accumulated, and each window is the extreme of one suffix and one prefix
+    (three comparisons per cell whatever the window size).
+    """
+    if buffersize <= 0:
+        return arr
+    arr = np.swapaxes(arr, 0, axis)
+    n = arr.shape[0]
+    size = 2 * buffersize + 1
+    total = -(-(n + 2 * buffersize) // size) * size
+    padded = np.empty((total,) + arr.shape[1:], dtype=arr.dtype)
+    padded.fill(_identity(arr.dtype, ufunc))
+    padded[buffersize:buffersize + n] = arr
+    blocks = padded.reshape((total // size, size) + arr.shape[1:])
+    prefix = ufunc.accumulate(blocks, axis=1).reshape(padded.shape)
+    suffix = ufunc.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(padded.shape)
+    # The window of cell i covers padded cells i to i+size-1, the suffix of one block and the prefix of the next
+    return np.swapaxes(ufunc(suffix[:n], prefix[size - 1:size - 1 + n]), 0, axis)
+
+
+def focalextremes(outsubdomain, insubdomains, buffersize, ufunc):
+    """ Maximum (ufunc=np.maximum) or minimum (np.minimum) of the windows around each cell of outsubdomain
+    over all insubdomains, separably along columns then rows
+    """
+    result = None
+    for insubdomain in insubdomains:
+        r = outsubdomain.r - insubdomain.r
+        c = outsubdomain.c - insubdomain.c
+        # Only the rows of the output are needed from the first pass
+        columns = slidingextremes(insubdomain.get_nparray(), buffersize, 0, ufunc)[r:r + outsubdomain.nrows]
+        extremes = slidingextremes(columns, buffersize, 1, ufunc)[:, c:c + outsubdomain.ncols]
+        result = extremes if result is None else ufunc(result, extremes)
+    return result
+
+
+def classcounts(outsubdomain, insubdomain, buffersize):
+    """ Yield (value, cells, counts, sizes) for each class (distinct value) of insubdomain, where cells marks
+    the cells of outsubdomain holding the class, counts is the number of cells of the class in the window
+    around each cell, and sizes the number of cells in each window. Each class is one-hot encoded and summed
+    over the windows with a summed-area table, one class at a time so memory does not grow with the number
+    of classes. Meant for categorical layers (e.g., landcover), the cost grows with the number of classes,
+    layers with more classes than cells in a window are cheaper to read with windowcodes (see manyclasses).
+    """
+    values, (codes,) = encode([insubdomain.get_nparray()])
+    rows, cols = windowbounds(outsubdomain, insubdomain, buffersize)
+    r = outsubdomain.r - insubdomain.r
+    c = outsubdomain.c - insubdomain.c
+    centres = codes[r:r + outsubdomain.nrows, c:c + outsubdomain.ncols]
+    for code, value in enumerate(values):
+        counts, sizes = windowsums((codes == code).view(np.uint8), rows, cols)
+        yield value, centres == code, counts, sizes
+
+
+def manyclasses(insubdomain, buffersize):
+    """ Return whether insubdomain has more classes (distinct values) than cells in a window, e.g. continuous layers """
+    return np.unique(insubdomain.get_nparray()).size > (2 * buffersize + 1) ** 2
+
+
+def windowcodes(outsubdomain, insubdomain, buffersize):
+    """ Yield (rows, cols, centres, windows) for blocks of outsubdomain (rows and cols are slices), where centres are
+    the codes (see encode) of the cells in the block and windows[k] the codes of the k-th cell of the window around
+    each of them, -1 outside insubdomain. The cost grows with the window area instead of the number of classes.
+    Blocks hold whole rows, or part of a row for large windows, so windows take at most
+    PCMLConfig.focal_histogram_bytes (or the window of a single cell if it is larger).
+    """
+    values, (codes,) = encode([insubdomain.get_nparray()])
+    padded = np.full((insubdomain.nrows + 2 * buffersize, insubdomain.ncols + 2 * buffersize), -1, dtype=np.intp)
+    padded[buffersize:buffersize + insubdomain.nrows, buffersize:buffersize + insubdomain.ncols] = codes
+    r = outsubdomain.r - insubdomain.r
+    c = outsubdomain.c - insubdomain.c
+    width = 2 * buffersize + 1
+    blockcells = max(1, PCMLConfig.focal_histogram_bytes // (padded.itemsize * width * width))
+    blockrows = max(1, blockcells // max(1, outsubdomain.ncols))
+    blockcols = min(outsubdomain.ncols, blockcells)
+    for first in xrange(0, outsubdomain.nrows, blockrows):
+        end = min(outsubdomain.nrows, first + blockrows)
+        for left in xrange(0, outsubdomain.ncols, blockcols):
+            right = min(outsubdomain.ncols, left + blockcols)
+            windows = np.empty((width * width, end - first, right - left), dtype=np.intp)
+            for k in xrange(width * width):
+                dr, dc = divmod(k, width)
+                windows[k] = padded[r + first + dr:r + end + dr, c + left + dc:c + right + dc]
+            yield slice(first, end), slice(left, right), codes[r + first:r + end, c + left:c + right], windows
+
+
+def encode(arrays):
+    """ Return the sorted distinct values of arrays and each array as indices (codes) into those values """
+    values, inverse = np.unique(np.concatenate([arr.ravel() for arr in arrays]), return_inverse=True)
+    codes = []
+    start = 0
+    for arr in arrays:
+        codes.append(inverse[start:start + arr.size].reshape(arr.shape))
+        start += arr.size
+    return values, codes
+
+
+def _windowrows(r0, r1):
+    # (window index, input row) of every row of every window, windows cover input rows r0 to r1
+    heights = r1 - r0
+    windows = np.repeat(np.arange(len(r0)), heights)
+    starts = np.repeat(np.cumsum(heights) - heights, heights)
+    return windows, np.arange(heights.sum()) - starts + np.repeat(r0, heights)
+
+
+def windowhistograms(inputs, first, end, numvalues):
+    """ Yield (column, counts) for each output column, counts[i, v] is the number of cells holding code v
+    in the windows of output rows first+i (up to end). inputs holds (codes, rows, cols) of each layer
+    (see encode and windowbounds). The histograms slide along the columns (Huang's algorithm for all rows at once),
+    moving one column adds the cells entering the windows and removes the cells leaving them,
+    about the window height per cell instead of its area.
+    """
+    counts = np.zeros((end - first, numvalues), dtype=np.int32)
+    layers = []
+    for codes, (r0, r1), (c0, c1) in inputs:
+        windows, inrows = _windowrows(r0[first:end], r1[first:end])
+        layers.append([codes, windows, inrows, c0, c1, c0[0], c0[0]])
+    for j in xrange(len(inputs[0][2][0])):
+        for layer in layers:
+            codes, windows, inrows, c0, c1, left, right = layer
+            for c in xrange(right, c1[j]):
+                np.add.at(counts, (windows, codes[inrows, c]), 1)
+            for c in xrange(left, c0[j]):
+                np.add.at(counts, (windows, codes[inrows, c]), -1)
+            layer[5], layer[6] = c0[j], c1[j]
+        yield j, counts
+
+
+def _histograminputs(outsubdomain, insubdomains, buffersize):
+    # Distinct values, (codes, rows, cols) of each input, and the output rows per block of histograms
+    values, codes = encode([insubdomain.get_nparray() for insubdomain in insubdomains])
+    inputs = [(code,) + windowbounds(outsubdomain, insubdomain, buffersize) for code, insubdomain in zip(codes, insubdomains)]
+    blockrows = max(1, PCMLConfig.focal_histogram_bytes // (4 * len(values) * max(1, outsubdomain.ncols)))
+    return values, inputs, blockrows
+
+
+def _manyvalues(values, insubdomains, buffersize):
+    # More distinct values than cells in a window (e.g., continuous layers), each histogram would cost more
+    # than reading the window itself
+    return len(values) > (2 * buffersize + 1) ** 2 * len(insubdomains)
+
+
+def _windows(outsubdomain, inputs):
+    # Yield (row, column, codes of the window layer by layer, row-major) for each cell of outsubdomain
+    for i in xrange(outsubdomain.nrows):
+        for j in xrange(outsubdomain.ncols):
+            yield i, j, np.concatenate([codes[r0[i]:r1[i], c0[j]:c1[j]].ravel() for codes, (r0, r1), (c0, c1) in inputs])
+
+
+def _firstoccurrence(inputs, code, outsubdomain, insubdomains, buffersize):
+    # Position of the first cell holding code in the window of each output cell (layer by layer, row-major)
+    result = None
+    for layer, ((codes, rows, cols), insubdomain) in enumerate(zip(inputs, insubdomains)):
+        # Positions are absolute, so the minimum over a window is its first cell holding code
+        keys = np.arange(codes.size, dtype=np.int64).reshape(codes.shape) + (layer << 40)
+        keys[codes != code] = np.iinfo(np.int64).max
+        r = outsubdomain.r - insubdomain.r
+        c = outsubdomain.c - insubdomain.c
+        columns = slidingextremes(keys, buffersize, 0, np.minimum)[r:r + outsubdomain.nrows]
+        first = slidingextremes(columns, buffersize, 1, np.minimum)[:, c:c + outsubdomain.ncols]
+        result = first if result is None else np.minimum(result, first)
+    return result
+
+
+def focalmodes(outsubdomain, insubdomains, buffersize, minority=False):
+    """ Most (or least, if minority) frequent value in the windows of all insubdomains around each cell of
+    outsubdomain, values that are absent are not counted. Ties go to the value found first in the windows
+    (layer by layer, row-major). Meant for categorical and small integer layers, with more distinct values
+    than cells in a window each window is read directly instead.
+    """
+    values, inputs, blockrows = _histograminputs(outsubdomain, insubdomains, buffersize)
+    result = np.zeros((outsubdomain.nrows, outsubdomain.ncols), dtype=np.intp)
+    if _manyvalues(values, insubdomains, buffersize):
+        for i, j, window in _windows(outsubdomain, inputs):
+            codes, firsts, counts = np.unique(window, return_index=True, return_counts=True)
+            best = counts.min() if minority else counts.max()
+            result[i, j] = window[firsts[counts == best].min()]
+        return values[result]
+    # (row, column, code) of the values tied in the windows of each block
+    tied = []
+    for first in xrange(0, outsubdomain.nrows, blockrows):
+        end = min(outsubdomain.nrows, first + blockrows)
+        for j, counts in windowhistograms(inputs, first, end, len(values)):
+            if minority:
+                counts = np.where(counts > 0, counts, np.iinfo(np.int32).max)
+                best = counts.min(axis=1)
+            else:
+                best = counts.max(axis=1)
+            candidates = counts == best[:, np.newaxis]
+            result[first:end, j] = candidates.argmax(axis=1)
+            rows = np.nonzero(candidates.sum(axis=1) > 1)[0]
+            if len(rows):
+                windows, codes = np.nonzero(candidates[rows])
+                tied.append((rows[windows] + first, np.full(len(codes), j, dtype=np.intp), codes))
+    if tied:
+        # Among tied values the one occurring first wins
+        rows, cols, codes = [np.concatenate(parts) for parts in zip(*tied)]
+        earliest = np.full(result.shape, np.iinfo(np.int64).max, dtype=np.int64)
+        for code in np.unique(codes):
+            which = codes == code
+            r, c = rows[which], cols[which]
+            first = _firstoccurrence(inputs, code, outsubdomain, insubdomains, buffersize)[r, c]
+            better = first < earliest[r, c]
+            earliest[r[better], c[better]] = first[better]
+            result[r[better], c[better]] = code
+    return values[result]
+
+
+def focalpercentiles(outsubdomain, insubdomains, buffersize, q):
+    """ q-th percentile (0 to 100, interpolated linearly like numpy.percentile) of the values in the windows
+    of all insubdomains around each cell of outsubdomain, from sliding histograms (see focalmodes)
+    """
+    values, inputs, blockrows = _histograminputs(outsubdomain, insubdomains, buffersize)
+    values = values.astype(np.float64)
+    result = np.zeros((outsubdomain.nrows, outsubdomain.ncols), dtype=np.float64)
+    if _manyvalues(values, insubdomains, buffersize):
+        for i, j, window in _windows(outsubdomain, inputs):
+            window.sort()
+            position = q / 100.0 * (len(window) - 1)
+            lower = int(np.floor(position))
+            low, high = values[window[lower]], values[window[int(np.ceil(position))]]
+            result[i, j] = low + (high - low) * (position - lower)
+        return result
+    for first in xrange(0, outsubdomain.nrows, blockrows):
+        end = min(outsubdomain.nrows, first + blockrows)
+        for j, counts in windowhistograms(inputs, first, end, len(values)):
+            cumulative = counts.cumsum(axis=1)
+            position = q / 100.0 * (cumulative[:, -1] - 1)
+            lower = np.floor(position)
+            # The value of rank k is the first value whose cumulative count exceeds k
+            low = values[(cumulative > lower[:, np.newaxis]).argmax(axis=1)]
+            high = values[(cumulative > np.ceil(position)[:, np.newaxis]).argmax(axis=1)]
+            result[first:end, j] = low + (high - low) * (position - lower)
+    return result
@@ -7,28 +7,25 @@ Sandeep Vutla (svutla@kent.edu, sandeepvutla@yahoo.in); Gowtham Kukkadapu (gkukk
 from ..core.Operation import *
 from ..core.Scheduler import *
 from ..util.OperationBuilder import *
+from .FocalOperationKernels import *
+import collections
 import numpy as np
 import types
 import math
 
+@executor
 @focaloperation
-def FocalMean(self, locations, subdomains):
-    # Begin with a zero sum and count to calculate the mean
-    # This function assumes one location and one subdomain are passed in
-    sumct=count=0.0
-    arr=subdomains[0].bufferedlocgetarr(locations[0],self.buffersize)
-    for i in arr.flat:
-        sumct+=i
-        count+=1.0
-    return sumct/count
+def FocalMean(self, subdomains):
+    # Window sums and counts come from a summed-area table of the input subdomain (see FocalOperationKernels)
+    # so the cost per cell does not depend on buffersize
+    sums, counts = focalsums(subdomains[0], subdomains[1], self.buffersize)
+    subdomains[0].get_nparray()[:, :] = sums / counts
 
+@executor
 @focaloperation
-def FocalMean_np(self, locations, subdomains):
-    # Begin with a zero sum and count to calculate the mean
-    # This function assumes one location and one subdomain are passed in
-    arr=subdomains[0].bufferedlocgetarr(locations[0],self.buffersize)
-
-    return np.average(arr)
+def FocalMean_np(self, subdomains):
+    sums, counts = focalsums(subdomains[0], subdomains[1], self.buffersize)
+    subdomains[0].get_nparray()[:, :] = sums / counts
 
 @focaloperation
 def FocalContourLines(self, locations, subdomains): # Experimental
@@ -102,130 +99,114 @@ def HillShade(self, locations, subdomains): # Experimental
                     (  math.sin(zenith_rad) * math.sin(slope) * math.cos(azimuth_rad-aspect) ) )
     return shade
 
+@nativedtype
+@executor
 @focaloperation
-def FocalMajority(self, locations, subdomains):
-    #Note: Takes two or more layers as input and returns majority element respective to the location
-    chunk=[]
-    for i in range(0,len(locations)):
-        arr=subdomains[i].bufferedlocgetarr(locations[i],self.buffersize)
-        chunk+=arr.tolist()
-    return majority( np.asarray( chunk).flatten('C'))
-def majority(arr):
-    c_len = 0
-    max_len = 0
-    c_i = 0
-    max_i = 0
-    c_item = None
-    maj_item = None
-    for i, item in sorted(enumerate(arr), key=lambda x: x[1]):
-        if c_item is None or c_item != item:
-            if c_len > max_len or (c_len == max_len and c_i < max_i):
-                max_len = c_len
-                max_i = c_i
-                maj_item = c_item
-            c_len = 1
-            c_i = i
-            c_item = item
-        else:
-            c_len += 1
-    if c_len > max_len or (c_len == max_len and c_i < max_i):
-        return c_item
-    return maj_item
+def FocalMajority(self, subdomains):
+    # Most frequent value in the windows of two or more layers, from histograms sliding along the rows
+    # (see FocalOperationKernels), ties go to the value found first (layer by layer, row-major)
+    subdomains[0].get_nparray()[:, :] = focalmodes(subdomains[0], subdomains[1:], self.buffersize)
 
+@nativedtype
+@executor
 @focaloperation
-def FocalMinority(self, locations, subdomains):
-    #takes two or more layers as input and returns minority element in respective locaitons
-    chunk=[]
-    for i in range(0,len(locations)):
-        arr=subdomains[i].bufferedlocgetarr(locations[i],self.buffersize)
-        chunk+=arr.tolist()
-    #print np.asarray( chunk).flatten('C')
-    return minority(np.asarray( chunk).flatten('C'))
-                    
-def minority(temp):
-    ctr = Counter(temp)
-    keys = ctr.keys()
-    vals = ctr.values()
-    least = []
-    m = min(vals)
-    for i in range(0,len(vals)):
-        if vals[i] == m:
-            least.append(keys[i])
-    if len(least)==1:
-        return least
-    else:
-        return least[:1] 
-        
+def FocalMinority(self, subdomains):
+    # Least frequent value in the windows of two or more layers
+    subdomains[0].get_nparray()[:, :] = focalmodes(subdomains[0], subdomains[1:], self.buffersize, minority=True)
+
+@executor
 @focaloperation
-def FocalMaximum(self,locations,subdomains):
-    #can take multiple layers and returns maximum number 
-    chunk=[]
-    for i in range(0,len(locations)):
-        arr=subdomains[i].bufferedlocgetarr(locations[i],self.buffersize)
-        chunk+=arr.tolist()
-    return maximum( np.asarray( chunk).flatten('C'))
-def maximum(arr):
-    iterator = iter(arr)
-    m = next(iterator)
-    for item in iterator:
-        if item > m:
-            m = item
-    return m
-    
+def FocalMedian(self, subdomains):
+    # Median of the windows of one or more layers from sliding histograms
+    subdomains[0].get_nparray()[:, :] = focalpercentiles(subdomains[0], subdomains[1:], self.buffersize, 50)
+
+@executor
 @focaloperation
-def FocalMinimum(self,locations,subdomains):
-    #can take multiple layers and returns minimum number 
-    chunk=[]
-    for i in range(0,len(locations)):
-        arr=subdomains[i].bufferedlocgetarr(locations[i],self.buffersize)
-        chunk+=arr.tolist()
-    return minimum( np.asarray( chunk).flatten('C'))
-def minimum(arr):
-    iterator = iter(arr)
-    m = next(iterator)
-    for item in iterator:
-        if item < m:
-            m = item
-    return m
-    
+def FocalPercentile_exec(self, subdomains):
+    subdomains[0].get_nparray()[:, :] = focalpercentiles(subdomains[0], subdomains[1:], self.buffersize, self.kwargs['q'])
+
+def FocalPercentile(*layers, **kwargs):
+    """ q-th percentile (0 to 100, interpolated like numpy.percentile) of the windows of one or more layers
+    from sliding histograms, e.g. FocalPercentile(elevation, buffersize=2, q=90)
+    """
+    q = kwargs.setdefault('q', 50)
+    if not 0 <= q <= 100:
+        raise PCMLInvalidInput("FocalPercentile needs q between 0 and 100", q)
+    return FocalPercentile_exec(*layers, **kwargs)
+
+@executor
 @focaloperation
-def FocalMaximum_np(self, locations, subdomains):
-    #returns maximum number in focal proximity of multiple layers
-    chunk=[]
-    for i in range(0,len(locations)):
-        arr=subdomains[i].bufferedlocgetarr(locations[i],self.buffersize)
-        chunk+=arr.tolist()
-    return np.max( np.asarray( chunk).flatten('C'))
+def FocalMaximum(self, subdomains):
+    # Maximum in the window around each cell of one or more layers (van Herk/Gil-Werman, see FocalOperationKernels)
+    subdomains[0].get_nparray()[:, :] = focalextremes(subdomains[0], subdomains[1:], self.buffersize, np.maximum)
 
-@focaloperation 
-def FocalMinimum_np(self, locations, subdomains):
-    #returns minimum number in focal proximity of multiple layers
-    chunk=[]
-    for i in range(0,len(locations)):
-        arr=subdomains[i].bufferedlocgetarr(locations[i],self.buffersize)
-        chunk+=arr.tolist()
-    return np.min( np.asarray( chunk).flatten('C'))
+@executor
+@focaloperation
+def FocalMinimum(self, subdomains):
+    # Minimum in the window around each cell of one or more layers
+    subdomains[0].get_nparray()[:, :] = focalextremes(subdomains[0], subdomains[1:], self.buffersize, np.minimum)
 
+@executor
 @focaloperation
-def FocalSum(self, locations, subdomains):
-    arr=subdomains[0].bufferedlocgetarr(locations[0],self.buffersize) 
-    sum=0.0
-    for i in arr.flatten('F'):
-        sum+=i
-    sum=sum
-    return sum
+def FocalMaximum_np(self, subdomains):
+    subdomains[0].get_nparray()[:, :] = focalextremes(subdomains[0], subdomains[1:], self.buffersize, np.maximum)
 
+@executor
 @focaloperation
-def FocalPercentage(self, locations, subdomains):
-    #Begin with zero numerator and denominator
-    #Increment deominator by one for each loop and numerator by one if the neighborhood value matches the location value
-    num=denom=0.0
-    arr=subdomains[0].bufferedlocgetarr(locations[0],self.buffersize)
-    for i in arr.flat:
-        if locations[0]['v']==i:
-                num+=1.0
-        denom+=1.0
-    return (num/denom)*100
+def FocalMinimum_np(self, subdomains):
+    subdomains[0].get_nparray()[:, :] = focalextremes(subdomains[0], subdomains[1:], self.buffersize, np.minimum)
+
+@executor
+@focaloperation
+def FocalSum(self, subdomains):
+    # Window sums from a summed-area table of the input subdomain (see FocalOperationKernels)
+    sums, counts = focalsums(subdomains[0], subdomains[1], self.buffersize)
+    subdomains[0].get_nparray()[:, :] = sums
+
+@executor
+@focaloperation
+def FocalPercentage(self, subdomains):
+    # Percentage of the cells in the window holding the class of the centre cell, from one box sum per class
+    # of the input subdomain (see FocalOperationKernels.classcounts), or each window when there are many classes
+    outarr = subdomains[0].get_nparray()
+    if manyclasses(subdomains[1], self.buffersize):
+        for rows, cols, centres, windows in windowcodes(subdomains[0], subdomains[1], self.buffersize):
+            outarr[rows, cols] = 100.0 * (windows == centres).sum(axis=0) / (windows >= 0).sum(axis=0)
+        return
+    for value, cells, counts, sizes in classcounts(subdomains[0], subdomains[1], self.buffersize):
+        outarr[cells] = 100.0 * counts[cells] / sizes[cells]
+
+@executor
+@focaloperation
+def FocalVariety(self, subdomains):
+    # Number of distinct classes in the window around each cell
+    outarr = subdomains[0].get_nparray()
+    if manyclasses(subdomains[1], self.buffersize):
+        for rows, cols, centres, windows in windowcodes(subdomains[0], subdomains[1], self.buffersize):
+            # Sorted window codes change once per class, -1 (outside the layer) sorts first
+            windows.sort(axis=0)
+            outarr[rows, cols] = (windows[0] >= 0) + ((windows[1:] != windows[:-1]) & (windows[1:] >= 0)).sum(axis=0)
+        return
+    outarr[:, :] = 0
+    for value, cells, counts, sizes in classcounts(subdomains[0], subdomains[1], self.buffersize):
+        outarr += counts > 0
+
+@executor
+@focaloperation
+def FocalProportion(self, subdomains):
+    # Fraction of the cells in the window holding classtype
+    classifyval = self.kwargs.get('classtype', 0)
+    rows, cols = windowbounds(subdomains[0], subdomains[1], self.buffersize)
+    counts, sizes = windowsums((subdomains[1].get_nparray() == classifyval).view(np.uint8), rows, cols)
+    subdomains[0].get_nparray()[:, :] = counts / sizes
+
+def FocalProportions(layer, classes=None, **kwargs):
+    """ Fraction of the cells in the window around each cell holding each class, as an ordered dictionary of
+    layers by class (all the values of layer unless classes are given), e.g. FocalProportions(landcover, buffersize=3)
+    """
+    if classes is None:
+        classes = np.unique(layer.get_nparray())
+    return collections.OrderedDict((value, FocalProportion(layer, classtype=value, **kwargs)) for value in classes)
 
 @focaloperation
 def KernelDensityEstimation(self,locations,subdomains):
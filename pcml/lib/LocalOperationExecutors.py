@@ -7,6 +7,7 @@ Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfan
 from ..core.Operation import *
 from ..core.Scheduler import *
 from ..util.OperationBuilder import *
+from ..util.Expression import parseexpression, compileexpression, evaluateexpression
 import numpy as np
 import types
 import math
@@ -76,6 +77,7 @@ def LocalMult_np(self, subdomains):
     # Copy values to outarr (outsubdomain)
     outarr[:,:]=arr
 
+@nativedtype
 @executor
 @localoperation
 def LocalMaximum_np(self, subdomains):
@@ -85,6 +87,7 @@ def LocalMaximum_np(self, subdomains):
 	arr= np.maximum(subdomains[1].get_nparray(),subdomains[2].get_nparray())
 	outarr[:,:]=arr
 
+@nativedtype
 @executor
 @localoperation
 #finding Local Minimum among the given locations
@@ -208,9 +211,10 @@ def LocalClassify20_np(self, subdomains):
     arr=np.floor(subdomains[1].get_nparray()/20)
     outarr[:,:]=arr
 
+@nativedtype
 @executor
 @localoperation
-#finding Local Product among the given locations
+#Cells holding classtype become 1 and other cells 0, values are only compared so inputs keep their data type
 def LocalClassify(self, subdomains):
     outsubdomain = subdomains[0]
     outarr = outsubdomain.get_nparray()
@@ -223,3 +227,29 @@ def LocalClassify(self, subdomains):
 
 
 
+
+@executor
+@localoperation
+# Evaluates a map algebra expression on blocks of rows (see LocalExpression)
+def LocalExpression_exec(self, subdomains):
+    outsubdomain = subdomains[0]
+    outarr = outsubdomain.get_nparray()
+    names = self.kwargs['names']
+    code = compileexpression(self.kwargs['expression'], names)
+    arrays = [subdomain.get_nparray() for subdomain in subdomains[1:]]
+    # Temporaries of the expression hold one block of rows at a time so they stay in cache
+    blockrows = max(1, PCMLConfig.expression_block_cells // max(1, outarr.shape[1]))
+    for r in xrange(0, outarr.shape[0], blockrows):
+        block = dict((name, arr[r:r + blockrows]) for name, arr in zip(names, arrays))
+        outarr[r:r + blockrows] = evaluateexpression(code, block)
+
+def LocalExpression(expression, **layers):
+    """ Evaluate a map algebra expression in a single pass, e.g. LocalExpression("(a+b)*c - d", a=l1, b=l2, c=l3, d=l4)
+    Expressions support arithmetic, comparisons, and/or/not, 'x if c else y', and the functions in pcml.util.Expression
+    (e.g., where(slope > 10, 0, landcover), sqrt(a), maximum(a, b)).
+    """
+    if not layers:
+        raise PCMLInvalidInput("LocalExpression requires at least one layer", expression)
+    names = sorted(layers)
+    parseexpression(expression, names)  # Report invalid expressions before scheduling
+    return LocalExpression_exec(*[layers[name] for name in names], expression=expression, names=names)
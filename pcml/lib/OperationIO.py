@@ -7,8 +7,11 @@ from ..core.Layer import *
 import pcml.core.PCMLConfig as PCMLConfig
 
 import numpy as np
+import math
+import multiprocessing as mp
+import os
+import tempfile
 #from linecache import getline
-import fileinput
 
 
 try: 
@@ -16,6 +19,7 @@ try:
    from osgeo import gdal
    from osgeo import ogr
    from osgeo import osr
+   from osgeo import gdal_array
 except ImportError as e:
    PCMLConfig.osgeoenabled=0
    if e.message != 'No module named osgeo':
@@ -32,13 +36,15 @@ NODATA_value  -9999
 '''
 
 
-def ReadASCIIGrid(filename):
-
+def _readasciiheader(filename):
+    """ Return nrows, ncols, x, y, cellsize, nodata_value from the header of an ASCII grid """
     nrows=ncols=None
     x=y=None
     cellsize=None
     nodata_value=None
-    for line in fileinput.input([filename]):
+    # Read the header with a private file object (fileinput keeps global state and is not thread safe)
+    asciigridfile = open(filename)
+    for lineno, line in enumerate(asciigridfile, 1):
         arg, val = str.split(line)
         if arg == "nrows":
             nrows = int(val)
@@ -52,9 +58,9 @@ def ReadASCIIGrid(filename):
             cellsize=float(val)
         if arg == "NODATA_value":
             nodata_value=float(val)
-        if fileinput.filelineno()>=6:
+        if lineno>=6:
             break
-    fileinput.close()
+    asciigridfile.close()
 
     assert(nrows!=None)
     assert(ncols!=None)
@@ -62,36 +68,73 @@ def ReadASCIIGrid(filename):
     assert(x!=None)
     assert(cellsize!=None)
     assert(nodata_value!=None)
+    return nrows, ncols, x, y, cellsize, nodata_value
 
-    arg=None
-    val=None
+
+def ReadASCIIGrid(filename):
+
+    nrows, ncols, x, y, cellsize, nodata_value = _readasciiheader(filename)
 
     # TODO: Here we should check to see if all 6 values are set
     h=float(nrows)*cellsize
     w=float(ncols)*cellsize
     layer=Layer(y,x,h,w,filename)
-    nparr=np.loadtxt(filename, skiprows=6)
-    layer.set_nparray(nparr,cellsize,nodata_value)
+    nparr=np.loadtxt(filename, skiprows=6, ndmin=2)
+    # Grids of whole numbers (e.g., land cover classes) are stored in the smallest integer type that holds them
+    layer.set_nparray(nparr.astype(_asciidtype(nparr, nodata_value)),cellsize,nodata_value)
 
     del nparr
 
     return layer
 
 
-# Ugly but functional
-def WriteASCIIGrid(filename, layer):
-    assert(layer.data_structure==Datastructure.array)
+def _asciidtype(nparr, nodata_value):
+    """ Smallest integer layer type holding the values of an ASCII grid and its nodata value, otherwise float64 """
+    if nparr.size == 0 or not np.all(np.isfinite(nparr)) or np.any(nparr != np.floor(nparr)) or nodata_value != math.floor(nodata_value):
+        return np.dtype(np.float64)
+    low = min(nparr.min(), nodata_value)
+    high = max(nparr.max(), nodata_value)
+    for dtype in (np.uint8, np.int16, np.int32):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.float64)
+
+
+def _asciirow(row):
+    # Integer layers are written without decimals
+    if row.dtype.kind in 'biu':
+        return ''.join('%d ' % value for value in row)
+    return ''.join((PCMLConfig.value_precision + ' ') % value for value in row)
+
+
+def _gdaldtype(band):
+    # Data type a layer uses for the values of a GDAL band
+    return layerdtype(gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType))
+
+
+def _gdaltype(dtype):
+    # GDAL data type of a band holding values of dtype
+    return gdal_array.NumericTypeCodeToGDALTypeCode(np.dtype(dtype).type)
+
+
+def _asciiheader(layer):
     string = "ncols        %i\n" % layer.ncols
     string += "nrows        %i\n" % layer.nrows
     string += "xllcorner    %f\n" % layer.x
     string += "yllcorner    %f\n" % layer.y
     string += "cellsize     %.15f\n" % layer.cellsize
     string += "NODATA_value %f\n" % layer.nodata_value
+    return string
+
+# Ugly but functional
+def WriteASCIIGrid(filename, layer):
+    layer = materialize(layer)
+    assert(layer.data_structure==Datastructure.array)
+    string = _asciiheader(layer)
     arr = layer.get_nparray()
     assert(layer.data_structure==Datastructure.array)
     for i in xrange(layer.nrows):
-        for j in xrange(layer.ncols):
-            string += (PCMLConfig.value_precision + ' ') % arr[i][j]
+        string += _asciirow(arr[i])
         string += "\n"
     asciigridfile = open(filename, "w")
     asciigridfile.write(string)
@@ -129,20 +172,54 @@ def ReadGeoTIFF(filename,bandnumber=1):
     h=float(nrows)*cellsize
     w=float(ncols)*cellsize
     layer=Layer(y,x,h,w,filename)
-    nparr=band.ReadAsArray(0,0,ncols,nrows) 
-    layer.set_nparray(nparr,cellsize,nodata_value)
+    # GDAL decodes the band directly into the shared memory of the layer, the raster is never held twice
+    layer.allocate_nparray((nrows,ncols),cellsize,nodata_value,dtype=_gdaldtype(band))
+    blocks=readblocks(nrows,band.GetBlockSize()[1],ncols*layer.get_nparray().itemsize)
 
     del transform
-    del nparr
     del band
     del ds
-    nparr=None
     ds=None # Close gdal dataset
     band=None
 
+    procs=min(PCMLConfig.read_procs,len(blocks))
+    if procs>1:
+        # Workers open the file themselves and map the layer by the name of its segment
+        pool=mp.Pool(procs)
+        try:
+            pool.map(_readgeotiffblock,[(filename,bandnumber,layer,r,n) for r,n in blocks])
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        _readgeotiffblocks(filename,bandnumber,layer,blocks)
+
     return layer
 
+def readblocks(nrows, blockrows, rowbytes):
+    """ Split nrows into (r, nrows) reads of about PCMLConfig.read_block_bytes that start on a block of blockrows """
+    blockrows = max(1, blockrows)
+    perread = max(1, PCMLConfig.read_block_bytes // max(1, rowbytes * blockrows)) * blockrows
+    return [(r, min(perread, nrows - r)) for r in xrange(0, nrows, perread)]
+
+def _readgeotiffblocks(filename, bandnumber, layer, blocks):
+    # Decode rows of a band into the array of layer, each row range is contiguous so GDAL writes into it in place
+    ds = gdal.Open(filename)
+    if ds is None:
+        raise PCMLException("Cannot open "+filename+" in ReadGeoTIFF")
+    band = ds.GetRasterBand(bandnumber)
+    arr = layer.get_nparray()
+    for r, nrows in blocks:
+        band.ReadAsArray(0, r, arr.shape[1], nrows, buf_obj=arr[r:r + nrows])
+    band = None
+    ds = None
+
+def _readgeotiffblock(args):
+    filename, bandnumber, layer, r, nrows = args
+    _readgeotiffblocks(filename, bandnumber, layer, [(r, nrows)])
+
 def WriteGeoTIFF(filename, layer):
+    layer = materialize(layer)
     if PCMLConfig.osgeoenabled==0:
        PCMLUserInformation("WriteGeoTIFF is disabled, because PCML could not find osgeo or gdal library")
        return None 
@@ -151,7 +228,8 @@ def WriteGeoTIFF(filename, layer):
 
     driver = gdal.GetDriverByName('GTiff')
     #Instead of GDT_CFloat64, GDT_Float64 is required
-    out = driver.Create(filename, layer.ncols, layer.nrows, 1, gdal.GDT_Float64)
+    # Bands keep the data type of the layer
+    out = driver.Create(filename, layer.ncols, layer.nrows, 1, _gdaltype(layer.get_nparray().dtype))
     if out is None:
         raise PCMLException("Cannot open '"+filename+"' to write")
     out.SetGeoTransform((layer.x, layer.cellsize, 0, layer.y, 0, layer.cellsize))
@@ -162,3 +240,192 @@ def WriteGeoTIFF(filename, layer):
     out.SetProjection(outSRS.ExportToWkt())
     outband.FlushCache()
 
+
+
+# GDAL drivers used to create raster files by extension (other extensions use GTiff)
+_gdaldrivers = {'.tif': 'GTiff', '.tiff': 'GTiff', '.img': 'HFA'}
+
+
+class RasterFile(Layer):
+    """ A layer that is a handle on a raster file (GeoTIFF and other GDAL formats, ASCII grid, or .npy).
+    Operations on raster files are streamed: each subdomain's rows are read from the input files when they
+    are processed and the output rows are written straight to the output file, so at most
+    PCMLConfig.stream_memory bytes of layer data are in memory at once.
+    """
+    streamed = True
+
+    def __init__(self, filename, like=None, bandnumber=1, temporary=False, dtype=None):
+        """ Open filename, or create it with the dimensions (and data type unless dtype is given) of layer like """
+        self.filename = filename
+        self.format = os.path.splitext(filename)[1].lower()
+        self.temporary = temporary
+        self._file = None
+        self._rowoffsets = None
+        self._pending = {}
+        self._nextrow = 0
+        self.data_type = np.dtype(np.float64)
+        if like is None:
+            nrows, ncols, x, y, cellsize, nodata_value = self._open(bandnumber)
+            datatype = self.data_type
+        else:
+            nrows, ncols, x, y, cellsize, nodata_value = like.nrows, like.ncols, like.x, like.y, like.cellsize, like.nodata_value
+            datatype = layerdtype(dtype or like.data_type or np.float64)
+        super(RasterFile, self).__init__(y, x, nrows * cellsize, ncols * cellsize, filename)
+        self.data_type = datatype
+        self.nrows = nrows
+        self.ncols = ncols
+        self.cellsize = cellsize
+        self.nodata_value = nodata_value
+        if like is not None:
+            self._create()
+
+    def __repr__(self):
+        return "<RasterFile: (%f,%f) [%f,%f] : %s>" % (self.y, self.x, self.h, self.w, self.filename)
+
+    def _open(self, bandnumber):
+        if self.format == '.npy':
+            self._file = np.load(self.filename, mmap_mode='r')  # Inputs are only read (the file may be read-only)
+            self.data_type = layerdtype(self._file.dtype)
+            nrows, ncols = self._file.shape
+            return nrows, ncols, 0.0, 0.0, 1.0, -9999
+        if self.format == '.asc':
+            return _readasciiheader(self.filename)
+        if PCMLConfig.osgeoenabled == 0:
+            raise PCMLException("Cannot open " + self.filename + ", because PCML could not find osgeo or gdal library")
+        self._dataset = gdal.Open(self.filename)
+        if self._dataset is None:
+            raise PCMLException("Cannot open " + self.filename + " in RasterFile")
+        self._file = self._dataset.GetRasterBand(bandnumber)
+        if self._file is None:
+            raise PCMLException("Cannot read selected band in " + self.filename + " in RasterFile")
+        self.data_type = _gdaldtype(self._file)
+        nodata_value = self._file.GetNoDataValue()
+        if nodata_value is None:
+            nodata_value = -9999
+        transform = self._dataset.GetGeoTransform()
+        nrows, ncols = self._dataset.RasterYSize, self._dataset.RasterXSize
+        return nrows, ncols, transform[0], transform[3] - nrows * transform[1], transform[1], nodata_value
+
+    def _create(self):
+        if self.format == '.npy':
+            self._file = np.lib.format.open_memmap(self.filename, mode='w+', dtype=self.data_type, shape=(self.nrows, self.ncols))
+            if self.temporary:
+                # The mapping keeps the file until the layer is garbage collected, even if this process is killed
+                os.remove(self.filename)
+        elif self.format == '.asc':
+            self.beginwrite()
+        else:
+            if PCMLConfig.osgeoenabled == 0:
+                raise PCMLException("Cannot create " + self.filename + ", because PCML could not find osgeo or gdal library")
+            driver = gdal.GetDriverByName(_gdaldrivers.get(self.format, 'GTiff'))
+            self._dataset = driver.Create(self.filename, self.ncols, self.nrows, 1, _gdaltype(self.data_type))
+            if self._dataset is None:
+                raise PCMLException("Cannot open '" + self.filename + "' to write")
+            self._dataset.SetGeoTransform((self.x, self.cellsize, 0, self.y, 0, self.cellsize))
+            outSRS = osr.SpatialReference()
+            outSRS.ImportFromEPSG(4326)
+            self._dataset.SetProjection(outSRS.ExportToWkt())
+            self._file = self._dataset.GetRasterBand(1)
+            self._file.SetNoDataValue(self.nodata_value)
+
+    def readrows(self, r, nrows):
+        """ Return rows r to r+nrows as an array of the data type of the layer """
+        if self.format == '.npy':
+            return np.array(self._file[r:r + nrows], dtype=self.data_type)
+        if self.format == '.asc':
+            if self._rowoffsets is None:
+                self._indexrows()
+            with open(self.filename) as f:
+                f.seek(self._rowoffsets[r])
+                lines = [f.readline() for i in xrange(nrows)]
+            return np.loadtxt(lines, ndmin=2).astype(self.data_type)
+        arr = np.empty((nrows, self.ncols), dtype=self.data_type)
+        self._file.ReadAsArray(0, r, self.ncols, nrows, buf_obj=arr)
+        return arr
+
+    def _indexrows(self):
+        # File offset of each row of an ASCII grid (one row per line after the 6 header lines)
+        self.flush()
+        self._rowoffsets = []
+        with open(self.filename) as f:
+            for i in xrange(6):
+                f.readline()
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                if line.strip():
+                    self._rowoffsets.append(offset)
+
+    def beginwrite(self):
+        """ Start writing every row of the layer, ASCII grids are written again from the header """
+        if self.format == '.asc':
+            with open(self.filename, 'w') as f:
+                f.write(_asciiheader(self))
+            self._pending = {}
+            self._nextrow = 0
+            self._rowoffsets = None
+
+    def writerows(self, r, arr):
+        """ Write arr to rows r to r+len(arr) """
+        if self.format == '.npy':
+            if not self._file.flags.writeable:
+                self._file = np.load(self.filename, mmap_mode='r+')  # An opened file used as an output layer
+            self._file[r:r + len(arr)] = arr
+        elif self.format == '.asc':
+            # ASCII grids are written in order, rows that arrive early wait for the rows before them
+            self._pending[r] = np.asarray(arr).astype(self.data_type)
+            self._rowoffsets = None
+            with open(self.filename, 'a') as f:
+                while self._nextrow in self._pending:
+                    rows = self._pending.pop(self._nextrow)
+                    for row in rows:
+                        f.write(_asciirow(row) + "\n")
+                    self._nextrow += len(rows)
+        else:
+            self._file.WriteArray(np.asarray(arr), 0, r)
+
+    def flush(self):
+        if self.format == '.npy':
+            self._file.flush()
+        elif self.format != '.asc' and self._file is not None:
+            self._file.FlushCache()
+
+    def get_nparray(self):
+        # Reads the whole file, operations on raster files only read the rows they need
+        return self.readrows(0, self.nrows)
+
+    def temporarylike(self, dtype=None):
+        """ Create a temporary raster file with the dimensions of this layer, its space is freed with the layer """
+        fd, filename = tempfile.mkstemp(suffix='.npy', dir=scratchdirectory())
+        os.close(fd)
+        return RasterFile(filename, like=self, temporary=True, dtype=dtype)
+
+    def duplicate(self, dtype=None):
+        return self.temporarylike(dtype)
+
+
+def OpenRaster(filename, bandnumber=1):
+    """ Open a raster file as a layer without reading it, operations on it are streamed (see RasterFile) """
+    return RasterFile(filename, bandnumber=bandnumber)
+
+
+def CreateRaster(filename, like):
+    """ Create a raster file with the dimensions of layer like, e.g. to use as outputlayer of an operation """
+    return RasterFile(filename, like=like)
+
+
+def MapRaster(filename, like=None):
+    """ Return a layer whose data is the array in a .npy file, mapped without reading it.
+    If like is given the file is created with the dimensions of layer like, e.g. to use it as the outputlayer
+    of an operation so the workers write the output directly into the file.
+    """
+    if like is None:
+        layer = Layer(0.0, 0.0, 1.0, 1.0, filename)
+        layer.map_nparray(filename, 1.0, -9999)
+    else:
+        layer = Layer(like.y, like.x, like.h, like.w, filename)
+        layer.map_nparray(filename, like.cellsize, like.nodata_value, shape=(like.nrows, like.ncols),
+                          dtype=like.data_type or np.float64)
+    return layer
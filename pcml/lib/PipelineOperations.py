@@ -0,0 +1,79 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+"""
+from ..core.Operation import *
+from ..core.Scheduler import *
+from ..core.Pipeline import *
+from ..util.OperationBuilder import *
+
+
+@nativedtype
+@executor
+@focaloperation
+# Runs every stage of a pipeline on one subdomain (see pipeline)
+def Pipeline_exec(self, subdomains):
+    runstages(self.kwargs['stages'], subdomains)
+
+
+class Pipeline(object):
+    """ A chain of local and focal operations applied subdomain by subdomain, created by pipeline() """
+
+    def __init__(self, stages):
+        if not stages:
+            raise PCMLInvalidInput("A pipeline needs at least one stage", stages)
+        for stage in stages:
+            if not isinstance(stage, PipelineStage):
+                raise PCMLInvalidInput("Pipeline stages are operations called without layers (e.g., FocalMean(buffersize=1))", stage)
+        if list(stages[0].layers).count(Ellipsis) != 1:
+            raise PCMLInvalidInput("The first stage of a pipeline reads the pipeline layers through a single Ellipsis", stages[0])
+        self.stages = list(stages)
+
+    def __repr__(self):
+        return "<Pipeline: %s>" % " -> ".join(stage.operation.__name__ for stage in self.stages)
+
+    def buffersize(self):
+        return pipelinehalo(self.stages)
+
+    def __call__(self, *layers):
+        """ Apply the pipeline to layers, they replace the Ellipsis of the first stage """
+        if not layers:
+            raise PCMLInvalidInput("A pipeline must be applied to at least one layer", layers)
+        inputs = []  # Layers read by the stages, in the order they are passed to Pipeline_exec
+
+        def slot(layer):
+            for i, known in enumerate(inputs):
+                if known is layer:
+                    return i
+            inputs.append(layer)
+            return len(inputs) - 1
+
+        stages = []
+        for i, stage in enumerate(self.stages):
+            slots = []
+            for layer in stage.layers:
+                if layer is not Ellipsis:
+                    slots.append(slot(layer))
+                elif i == 0:
+                    slots.extend(slot(l) for l in layers)
+                else:
+                    slots.append(-1)
+            stages.append((stage.operation._PCML_ref, stage.kwargs, tuple(slots)))
+        for layer in inputs:
+            if getattr(layer, 'data_structure', Datastructure.array) != Datastructure.array:
+                raise PCMLInvalidInput("Pipelines only support array layers", layer)
+        # Stages promote their own inputs, the output has the data type of the last stage (the compute data type unless set)
+        dtype = self.stages[-1].kwargs.get('dtype') or PCMLConfig.compute_dtype
+        return Pipeline_exec(*inputs, buffersize=self.buffersize(), stages=tuple(stages), dtype=dtype)
+
+
+def pipeline(*stages):
+    """ Chain local and focal operations so they run one subdomain at a time in a single pass.
+    Each subdomain is read with the halo the whole chain needs, and intermediate results only use
+    scratch arrays the size of a subdomain instead of layers. Stages are operations called without layers,
+    Ellipsis passes the previous result to a stage that reads other layers as well.
+    >>> near_water = pipeline(FocalBuffer(buffersize=600, classtype=11), LocalClassify(classtype=11))(landcover)
+    >>> pipeline(FocalMean(buffersize=1), LocalSum(Ellipsis, elevation))(slope)
+    """
+    return Pipeline(stages)
@@ -0,0 +1,183 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+
+Placement of worker processes: pinning ranks to cores, NUMA local allocation,
+and capping the thread pools of numerical libraries (BLAS, OpenMP, numba) inside workers.
+"""
+from .Messaging import *
+import pcml.core.PCMLConfig as PCMLConfig
+
+import ctypes
+import ctypes.util
+import glob
+import multiprocessing as mp
+import os
+import re
+import sys
+
+# threadpoolctl limits BLAS and OpenMP thread pools that are already loaded
+try:
+    PCMLConfig.threadpoolctlenabled = 1
+    from threadpoolctl import threadpool_limits
+except ImportError as e:
+    PCMLConfig.threadpoolctlenabled = 0
+
+# Environment variables read by thread pools that are started after they are set
+_threadvariables = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                    'NUMEXPR_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMBA_NUM_THREADS']
+
+_libc = None
+_libnuma = None
+
+
+def _loadlibc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    return _libc
+
+
+def _loadlibnuma():
+    # Returns None if libnuma is not installed or NUMA is not available on this machine
+    global _libnuma
+    if _libnuma is None:
+        path = ctypes.util.find_library('numa')
+        _libnuma = False
+        if path is not None:
+            try:
+                lib = ctypes.CDLL(path)
+                if lib.numa_available() >= 0:
+                    _libnuma = lib
+            except (OSError, AttributeError):
+                pass
+    return _libnuma or None
+
+
+def parsecpulist(cpulist):
+    """ Convert a Linux cpulist such as '0-3,8-11' into a list of cpu numbers """
+    cpus = []
+    for part in cpulist.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(xrange(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+# Size of the cpu_set_t mask used by sched_getaffinity and sched_setaffinity (1024 cpus)
+_masklongs = 1024 // (8 * ctypes.sizeof(ctypes.c_ulong))
+_longbits = 8 * ctypes.sizeof(ctypes.c_ulong)
+
+
+def getaffinity():
+    """ Return the cpus this process may run on """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    try:
+        mask = (ctypes.c_ulong * _masklongs)()
+        if _loadlibc().sched_getaffinity(0, ctypes.sizeof(mask), mask) != 0:
+            raise OSError(ctypes.get_errno(), "sched_getaffinity failed")
+        return [i for i in xrange(_masklongs * _longbits) if mask[i // _longbits] >> (i % _longbits) & 1]
+    except (OSError, AttributeError):
+        return range(mp.cpu_count())
+
+
+def setaffinity(cpus):
+    """ Restrict this process to the given cpus, returns False if pinning is not supported """
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+        return True
+    try:
+        mask = (ctypes.c_ulong * _masklongs)()
+        for cpu in cpus:
+            mask[cpu // _longbits] |= 1 << (cpu % _longbits)
+        return _loadlibc().sched_setaffinity(0, ctypes.sizeof(mask), mask) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def numanodes():
+    """ Return the cpus of each NUMA node that this process may run on, a single node if NUMA is not reported """
+    available = set(getaffinity())
+    nodes = []
+    for path in sorted(glob.glob('/sys/devices/system/node/node[0-9]*/cpulist'), key=lambda p: int(re.findall(r'node(\d+)', p)[-1])):
+        with open(path) as f:
+            cpus = [cpu for cpu in parsecpulist(f.read()) if cpu in available]
+        if cpus:
+            nodes.append(cpus)
+    if not nodes:
+        nodes = [sorted(available)]
+    return nodes
+
+
+def _split(cpus, parts, index):
+    # Contiguous blocks of cpus, the first len(cpus) % parts blocks get one extra cpu, parts share cpus if there are too few
+    if parts >= len(cpus):
+        return [cpus[index % len(cpus)]]
+    share, extra = divmod(len(cpus), parts)
+    first = index * share + min(index, extra)
+    return cpus[first:first + share + (1 if index < extra else 0)]
+
+
+def rankcpus(rank, num_procs, policy='compact', nodes=None):
+    """ Return the cpus assigned to rank when num_procs workers are pinned with policy
+    compact fills the cores of one NUMA node before the next, scatter spreads consecutive ranks across nodes.
+    """
+    if nodes is None:
+        nodes = numanodes()
+    if policy == 'compact':
+        return _split([cpu for node in nodes for cpu in node], num_procs, rank)
+    if policy == 'scatter':
+        node = rank % len(nodes)
+        ranksonnode = len(xrange(node, num_procs, len(nodes)))
+        return _split(nodes[node], ranksonnode, rank // len(nodes))
+    raise PCMLInvalidInput("Unknown affinity policy (use 'compact' or 'scatter')", policy)
+
+
+def setlocalallocation():
+    """ Allocate the memory this process touches first on its own NUMA node, returns False without libnuma """
+    libnuma = _loadlibnuma()
+    if libnuma is None:
+        return False
+    libnuma.numa_set_localalloc()
+    return True
+
+
+def threadbudget(num_procs, cpus=None):
+    """ Number of library threads per worker so that processes x threads equals the available cores """
+    if cpus is None:
+        cpus = getaffinity()
+    return max(1, len(cpus) // max(1, num_procs))
+
+
+def limitthreads(numthreads):
+    """ Cap the BLAS, OpenMP, and numba thread pools of this process to numthreads """
+    for variable in _threadvariables:
+        os.environ[variable] = str(numthreads)
+    limits = None
+    if PCMLConfig.threadpoolctlenabled:
+        limits = threadpool_limits(limits=numthreads)
+    numba = sys.modules.get('numba')  # Only adjust numba if it is already in use
+    if numba is not None and hasattr(numba, 'set_num_threads'):
+        numba.set_num_threads(min(numthreads, numba.config.NUMBA_NUM_THREADS))
+    return limits
+
+
+def configureworker(rank, num_procs):
+    """ Place a worker process according to PCMLConfig.affinity, numa_local, and worker_threads """
+    cpus = None
+    if PCMLConfig.affinity is not None:
+        cpus = rankcpus(rank, num_procs, PCMLConfig.affinity)
+        setaffinity(cpus)
+        if PCMLConfig.numa_local:
+            setlocalallocation()
+    if PCMLConfig.worker_threads == 'auto':
+        # A pinned worker uses its own cores, otherwise it gets an equal share of the available cores
+        limitthreads(len(cpus) if cpus is not None else threadbudget(num_procs))
+    elif PCMLConfig.worker_threads is not None:
+        limitthreads(PCMLConfig.worker_threads)
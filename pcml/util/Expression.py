@@ -0,0 +1,118 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+
+Map algebra expressions such as "(a+b)*c - d" or "where(slope > 10, 0, landcover)" evaluated with numpy.
+Expressions are parsed and checked against a whitelist of syntax and functions, then compiled once per process.
+"""
+from .Messaging import *
+
+import ast
+import numpy as np
+
+
+def _mean(*arrays):
+    return sum(arrays) / float(len(arrays))
+
+
+# Functions that may be called in an expression, they work cell by cell on arrays
+functions = {
+    'sin': np.sin, 'cos': np.cos, 'tan': np.tan,
+    'arcsin': np.arcsin, 'arccos': np.arccos, 'arctan': np.arctan,
+    'exp': np.exp, 'log': np.log, 'log2': np.log2, 'log10': np.log10, 'sqrt': np.sqrt,
+    'abs': np.absolute, 'floor': np.floor, 'ceil': np.ceil, 'trunc': np.trunc,
+    'minimum': np.minimum, 'maximum': np.maximum, 'min': np.minimum, 'max': np.maximum, 'mean': _mean,
+    'where': np.where,
+    'logical_and': np.logical_and, 'logical_or': np.logical_or,
+    'logical_xor': np.logical_xor, 'logical_not': np.logical_not,
+}
+
+# Syntax allowed in an expression, anything else (attributes, subscripts, lambdas, ...) is rejected
+_allowed = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Num, ast.Load,
+            ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+            ast.BitAnd, ast.BitOr, ast.BitXor, ast.Invert, ast.USub, ast.UAdd,
+            ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+
+class _ArrayRewriter(ast.NodeTransformer):
+    """ Rewrite Python constructs that do not work on arrays into numpy functions:
+    'a and b' into logical_and, 'not a' into logical_not, 'x if c else y' into where, and '0 < a < 5' into logical_and.
+    """
+
+    def _call(self, name, args, node):
+        return ast.copy_location(ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=args,
+                                          keywords=[], starargs=None, kwargs=None), node)
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        name = 'logical_and' if isinstance(node.op, ast.And) else 'logical_or'
+        result = node.values[0]
+        for value in node.values[1:]:
+            result = self._call(name, [result, value], node)
+        return result
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return self._call('logical_not', [node.operand], node)
+        return node
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        return self._call('where', [node.test, node.body, node.orelse], node)
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if len(node.ops) == 1:
+            return node
+        comparisons = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            comparisons.append(ast.copy_location(ast.Compare(left=left, ops=[op], comparators=[right]), node))
+            left = right
+        result = comparisons[0]
+        for comparison in comparisons[1:]:
+            result = self._call('logical_and', [result, comparison], node)
+        return result
+
+
+def parseexpression(expression, names):
+    """ Parse and check an expression that may use the layer names in names, returns the rewritten syntax tree """
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise PCMLInvalidInput("Invalid map algebra expression (%s)" % e.msg, expression)
+    tree = ast.fix_missing_locations(_ArrayRewriter().visit(tree))
+    for node in ast.walk(tree):
+        if not isinstance(node, _allowed):
+            raise PCMLInvalidInput("Map algebra expressions do not support %s" % type(node).__name__, expression)
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in functions:
+                raise PCMLInvalidInput("Unknown function in map algebra expression (use one of %s)" % ", ".join(sorted(functions)), expression)
+            if node.keywords or node.starargs or node.kwargs:
+                raise PCMLInvalidInput("Map algebra expressions only support positional arguments", expression)
+        elif isinstance(node, ast.Name) and node.id not in names and node.id not in functions:
+            raise PCMLInvalidInput("Map algebra expression uses %s, which is not a layer" % node.id, expression)
+    return tree
+
+
+# Compiled expressions of this process indexed by (expression, names)
+_compiled = {}
+
+
+def compileexpression(expression, names):
+    """ Return the code object of an expression, each expression is parsed and compiled once per process """
+    key = (expression, tuple(names))
+    code = _compiled.get(key)
+    if code is None:
+        code = compile(parseexpression(expression, names), '<map algebra expression>', 'eval')
+        _compiled[key] = code
+    return code
+
+
+def evaluateexpression(code, arrays):
+    """ Evaluate a compiled expression where arrays maps layer names to arrays """
+    namespace = dict(functions)
+    namespace.update(arrays)
+    return eval(code, {'__builtins__': {}}, namespace)
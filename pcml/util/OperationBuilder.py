@@ -5,10 +5,20 @@ Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfan
 """
 from ..core.Operation import *
 from ..core.Scheduler import *
+from ..core.Lazy import LazyLayer, materialize
+from ..core.Pipeline import PipelineStage
+from ..core.Cache import operationkey, resultcache
 from ..util.Messaging import PCMLOperationError
 import types
 
 
+def _promoting(executor):
+    # Executor that converts integer input arrays (see Operation.promote) before calling executor
+    def _executor(self, subdomains):
+        return executor(self, self.promote(subdomains))
+    return _executor
+
+
 class OperationDecorator:
     def __init__(self, opclass=OpClass.localclass, override='function', **kwargs):
         """ When user write "@operation(opclass=OpClass.focalclass, override='exectuor')",
@@ -45,17 +55,60 @@ class OperationDecorator:
             :param layers: Layer objects to process.
             :param kwargs: A list of arguments passed down to Operation.__init__
             """
+            # Called without layers (or with Ellipsis for the previous result) the operation is a pipeline stage
+            if not layers or any(layer is Ellipsis for layer in layers):
+                return PipelineStage(_func, layers, kwargs)
+            if PCMLConfig.lazy:
+                return LazyLayer(_func, layers, kwargs)
+            return _run(layers, kwargs)
+
+        def _run(layers, kwargs):
+            """ Build the operation and run it, inputs that are lazy layers are computed first """
+            layers = [materialize(layer) for layer in layers]
+            key = operationkey(_func._PCML_ref, layers, kwargs) if PCMLConfig.cache else None
+            if key is not None:
+                result = resultcache().lookup(key)
+                if result is not None:
+                    return result
+            result = scheduler(_build(layers, kwargs))
+            if key is not None:
+                resultcache().store(key, result)
+            return result
+
+        def _build(layers, kwargs):
+            """ Build the operation object for layers without running it """
             opclass = getattr(_func, 'opclass', None) or self.opclass
-            override = getattr(_func, 'override', None) or self.override
             op = Operation(func.__name__, opclass=opclass, layers=layers, **kwargs)
-            # Replace the override function
-            setattr(op, override, types.MethodType(func, op, Operation))
+            _bind(op)
+            return op
+
+        def _bind(op):
+            """ Bind the user defined function (and method mapping) to an operation object.
+            This is also used to rebuild operations that are sent to worker processes.
+            """
+            override = getattr(_func, 'override', None) or self.override
+            # Replace the override function, executors receive integer inputs converted to the compute data type
+            if override == 'executor':
+                setattr(op, override, types.MethodType(_promoting(func), op, Operation))
+            else:
+                setattr(op, override, types.MethodType(func, op, Operation))
+            op.native = getattr(_func, 'native', False)
             # Traverse the method mapping dictionary and replace them.
             for t, m in self.mapping.iteritems():
                 setattr(op, t, type(m)((m, op, Operation)))
-            return scheduler(op)
+            # Remember where the operation is defined so worker processes can find it by reference
+            op._PCML_ref = _func._PCML_ref
+        def explain(*layers, **kwargs):
+            """ Print and return the execution plan of the operation applied to layers without running it """
+            return _build([materialize(layer) for layer in layers], kwargs).explain()
+
         # Mark _func as the function created by OperationDecorator
+        _func.explain = explain
         _func._PCML_exported = True
+        _func._PCML_bind = _bind
+        _func._PCML_run = _run
+        _func._PCML_build = _build
+        _func._PCML_ref = (func.__module__, func.__name__)
         # Rename _func and add it to the current global name space
         _func.__name__ = func.__name__
         globals()[_func.__name__] = _func
@@ -109,3 +162,13 @@ def executor(fn):
         raise PCMLOperationError("Function %s should not be decorated directed by @executor" % fn.__name__)
     fn.override = 'executor'
     return fn
+
+
+def nativedtype(fn):
+    """ Mark an operation that works on layers in their own data type (e.g., comparisons or selections),
+    its inputs are not converted to PCMLConfig.compute_dtype.
+    """
+    if not getattr(fn, '_PCML_exported', False):
+        raise PCMLOperationError("Function %s should not be decorated directed by @nativedtype" % fn.__name__)
+    fn.native = True
+    return fn
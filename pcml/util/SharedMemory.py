@@ -3,9 +3,22 @@ Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All r
 Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
 Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
 """
+import pcml.core.PCMLConfig as PCMLConfig
 import multiprocessing as mp
 import numpy as np
+import collections
 import ctypes
+import ctypes.util
+import atexit
+import errno
+import mmap
+import os
+import re
+import sys
+import tempfile
+import threading
+import uuid
+import weakref
 
 
 # FROM : https://bitbucket.org/cleemesser/numpy-sharedmem/src/3d6dca4ffd926598c68faa3505df8ff0708989dd/doc/horesh_ctypes_sharedmem.py?at=default
@@ -59,3 +72,298 @@ def shmem_as_ndarray(raw_array, shape=None):
 def shmem_slice_nparray(arr, r, c, h, w):
     sliced_array = arr[r:r + h, c:c + w]
     return sliced_array
+
+
+# Directory holding named shared memory segments, /dev/shm is memory backed (tmpfs) on Linux
+if os.path.isdir('/dev/shm'):
+    _segmentdir = '/dev/shm'
+else:
+    _segmentdir = tempfile.gettempdir()
+
+# Segments created or attached by this process indexed by path
+_segments = weakref.WeakValueDictionary()
+
+# Names of the segments created by a process, "pcml-<pid>-<random hex>"
+_segmentname = re.compile(r'^pcml-(\d+)-[0-9a-f]+$')
+
+# Directories already searched for segments left by processes that were killed
+_swept = set()
+
+# madvise() advice asking Linux to back a mapping with transparent huge pages
+_MADV_HUGEPAGE = 14
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _libc.madvise.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int]
+except (OSError, AttributeError, TypeError):
+    _libc = None
+
+
+def sizeclass(nbytes):
+    """ Bytes reserved for a segment of nbytes, whole pages rounded up to a quarter of a power of two
+    so segments of similar sizes can reuse each other's memory (at most 25% is unused)
+    """
+    pages = -(-max(int(nbytes), 1) // mmap.PAGESIZE)
+    step = max(1, 2 ** (pages.bit_length() - 1) // 4)
+    return -(-pages // step) * step * mmap.PAGESIZE
+
+
+def _advisehugepages(mapping, nbytes):
+    # Ask for huge pages (fewer page faults and TLB misses), ignored where they are not supported
+    if _libc is not None:
+        _libc.madvise(np.frombuffer(mapping, np.uint8, 1).ctypes.data, nbytes, _MADV_HUGEPAGE)
+
+
+def _isrunning(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH  # EPERM: running as another user
+    return True
+
+
+def removestalesegments(directory=None):
+    """ Remove the segments in directory (/dev/shm by default) created by processes that are no longer running.
+    Segments are removed when they are garbage collected and at exit, a process that is killed (e.g., SIGKILL
+    or the out of memory killer) leaves its segments behind, holding memory until they are removed.
+    Return the paths removed.
+    """
+    directory = directory or _segmentdir
+    removed = []
+    for name in os.listdir(directory):
+        match = _segmentname.match(name)
+        if match is None or _isrunning(int(match.group(1))):
+            continue
+        try:
+            os.unlink(os.path.join(directory, name))
+            removed.append(os.path.join(directory, name))
+        except OSError:
+            pass  # Removed by another process or owned by another user
+    return removed
+
+
+class SegmentPool(object):
+    """
+    Memory of released shared segments of this process, reused for new segments of the same size class.
+    Reused memory is already paged in, so new layers avoid the page faults of a fresh segment.
+    A segment is only given to the pool when no array refers to its memory any more (the last reference
+    to the segment is gone, e.g. after layer.release() or when its layer is garbage collected) and it was never
+    sent to another process. Reference counts only cover this process, and another process may still map the
+    memory (e.g., a persistent pool worker keeps the segments of its last operation attached).
+    At most PCMLConfig.segment_pool_bytes are kept, the least recently released segments are freed first.
+    The pool is used by every thread of the process (e.g., pcml.aio and ExecutorType.threadpool threads,
+    and segments garbage collected in any thread), its idle segments are only changed holding a lock.
+    """
+
+    def __init__(self):
+        self.idle = collections.OrderedDict()  # path: (size class, mapping), most recently released last
+        self.nbytes = 0
+        self.reused = 0
+        self._pid = os.getpid()
+        # Reentrant because a segment may be garbage collected (and given back) while its thread holds the lock
+        self._lock = threading.RLock()
+
+    def _checkprocess(self):
+        # A forked process inherits the pool of its parent, which still owns those segments,
+        # and its lock, which another thread of the parent may have held
+        if self._pid != os.getpid():
+            self._lock = threading.RLock()
+            self.idle = collections.OrderedDict()
+            self.nbytes = 0
+            self._pid = os.getpid()
+
+    def take(self, reserved, path):
+        """ Return the zero filled mapping of an idle segment of reserved bytes renamed to path, or None """
+        self._checkprocess()
+        with self._lock:
+            for oldpath in reversed(list(self.idle)):
+                if self.idle[oldpath][0] == reserved:
+                    mapping = self.idle.pop(oldpath)[1]
+                    self.nbytes -= reserved
+                    # Renaming keeps the memory, only the name changes
+                    os.rename(oldpath, path)
+                    break
+            else:
+                return None
+            self.reused += 1
+        np.ndarray((reserved,), np.uint8, buffer=mapping).fill(0)
+        return mapping
+
+    def give(self, segment):
+        """ Keep the memory of segment for reuse, return False if it cannot be reused """
+        self._checkprocess()
+        # References from the segment and from getrefcount itself, any other reference is an array using the memory
+        if PCMLConfig.segment_pool_bytes <= 0 or segment.sent or sys.getrefcount(segment._mmap) > 2:
+            return False
+        with self._lock:
+            self.idle[segment.path] = (segment.reserved, segment._mmap)
+            self.nbytes += segment.reserved
+            while self.nbytes > PCMLConfig.segment_pool_bytes:
+                self._free(self.idle.keys()[0])
+        return True
+
+    def _free(self, path):
+        # Called holding the lock
+        reserved, mapping = self.idle.pop(path)
+        self.nbytes -= reserved
+        mapping.close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        """ Free the memory of every idle segment """
+        self._checkprocess()
+        with self._lock:
+            for path in self.idle.keys():
+                self._free(path)
+
+
+_pool = SegmentPool()
+
+
+def segmentpool():
+    """ Return the pool of released shared segments of this process """
+    return _pool
+
+# Segments attached by a worker are kept mapped until releaseattachedsegments() is called
+_attachedsegments = {}
+
+
+class SharedSegment(object):
+    """
+    SharedSegment is a named block of shared memory backed by a file in a memory filesystem.
+    Unlike multiprocessing.RawArray, any process can map a segment using only its name,
+    so arrays in a segment can be shared without relying on fork inheritance.
+    Pickling a segment only sends its name and size.
+    Segments in another directory (e.g., a scratch directory on a local SSD) are memory mapped files
+    that the operating system pages in and out under memory pressure. A segment can also map part of
+    an existing file starting at offset (e.g., the data of a .npy file), which is kept when the segment is closed.
+    Segments created in memory reserve a size class of whole pages and their memory returns to the
+    SegmentPool when the segment is garbage collected, unless the segment was sent to another process.
+    Segment files are named after the process creating them and removed when the segment is garbage collected
+    or the process exits. Files left by processes that were killed are removed by the first segment created in
+    their directory by a later process (see removestalesegments).
+    """
+
+    def __init__(self, nbytes, name=None, directory=None, offset=0, keep=False):
+        """Create a new segment of nbytes, or attach to an existing segment if name is given.
+            :param nbytes (int): Size of the segment in bytes.
+            :param name (str): Name of an existing segment (or file) to attach to.
+            :param directory (str): Directory of the file backing the segment, /dev/shm by default.
+            :param offset (int): Position of the segment in the file.
+            :param keep (bool): Keep the file when the segment is closed (the file must exist).
+        """
+        self.nbytes = max(int(nbytes), 1)  # mmap does not support empty mappings
+        self.directory = directory or _segmentdir
+        self.offset = int(offset)
+        self.keep = keep
+        self.owner = name is None or keep
+        self.reserved = self.offset + self.nbytes
+        self.sent = False  # Pickled for another process, which may map the memory as long as it likes
+        self._mmap = None
+        access = mmap.ACCESS_WRITE
+        if name is None:
+            if self.directory not in _swept:
+                _swept.add(self.directory)
+                removestalesegments(self.directory)
+            name = "pcml-%i-%s" % (os.getpid(), uuid.uuid4().hex[:16])
+            if self.directory == _segmentdir and self.offset == 0:
+                self.reserved = sizeclass(self.nbytes)
+                self._mmap = _pool.take(self.reserved, os.path.join(self.directory, name))
+            if self._mmap is None:
+                fd = os.open(os.path.join(self.directory, name), os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+                os.ftruncate(fd, self.reserved)
+        else:
+            try:
+                fd = os.open(os.path.join(self.directory, name), os.O_RDWR)
+            except OSError as e:
+                if e.errno not in (errno.EACCES, errno.EROFS, errno.EPERM):
+                    raise
+                # A file that cannot be written (e.g., on a read-only mount) is mapped read-only
+                fd = os.open(os.path.join(self.directory, name), os.O_RDONLY)
+                access = mmap.ACCESS_READ
+            if keep and access != mmap.ACCESS_READ and os.fstat(fd).st_size < self.reserved:
+                os.ftruncate(fd, self.reserved)
+        if self._mmap is None:
+            try:
+                self._mmap = mmap.mmap(fd, self.reserved, access=access)
+            finally:
+                os.close(fd)
+            if PCMLConfig.hugepages and self.owner and not keep:
+                _advisehugepages(self._mmap, self.reserved)
+        # Arrays of a read-only segment cannot be written, in every process the segment is sent to
+        self.readonly = access == mmap.ACCESS_READ
+        self.name = name
+        self.path = os.path.join(self.directory, name)
+        self._pid = os.getpid()
+        self.address = np.frombuffer(self._mmap, np.uint8, 1).ctypes.data + self.offset
+        _segments[self.path] = self
+
+    def __repr__(self):
+        return "<SharedSegment: %s [%i bytes]>" % (self.path, self.nbytes)
+
+    def __reduce__(self):
+        self.sent = True
+        return (attachsegment, (self.name, self.nbytes, self.directory, self.offset, self.readonly))
+
+    def __del__(self):
+        # Memory segments owned by this process are reused by new segments instead of being freed
+        try:
+            if self.owner and not self.keep and self._pid == os.getpid() and self.reserved == sizeclass(self.nbytes) \
+                    and self.directory == _segmentdir and _pool.give(self):
+                self.owner = False
+                return
+        except (TypeError, AttributeError):
+            pass  # The interpreter is shutting down
+        self.close()
+
+    def asarray(self, dtype, shape):
+        """ Return a numpy array of dtype and shape that uses the memory of this segment (no copy),
+        the array is read-only if the segment is read-only
+        """
+        arr = np.ndarray(shape, dtype, buffer=self._mmap, offset=self.offset)
+        if self.readonly:
+            arr.flags.writeable = False
+        return arr
+
+    def flush(self):
+        """ Write changes to the backing file (only needed for files that are kept) """
+        self._mmap.flush()
+
+    def close(self):
+        """ Remove the segment name, the memory is released when the last mapping is gone """
+        if self.owner and self._pid == os.getpid():
+            self.owner = False
+            if self.keep:
+                return
+            try:
+                os.unlink(self.path)
+            except (OSError, TypeError, AttributeError):
+                pass  # Already removed or the interpreter is shutting down
+
+
+def attachsegment(name, nbytes, directory=None, offset=0, readonly=False):
+    """ Return the segment called name, mapping it into this process if necessary """
+    segment = _segments.get(os.path.join(directory or _segmentdir, name))
+    if segment is None:
+        segment = SharedSegment(nbytes, name=name, directory=directory, offset=offset)
+    if readonly:
+        segment.readonly = True  # Made read-only by the process that sent it, even if this process mapped it before
+    if not segment.owner:
+        _attachedsegments[segment.path] = segment
+    return segment
+
+
+def releaseattachedsegments():
+    """ Forget segments attached by this process, they are unmapped once no array uses them """
+    _attachedsegments.clear()
+
+
+def _closesegments():
+    for segment in list(_segments.values()):
+        segment.close()
+    _pool.clear()
+
+atexit.register(_closesegments)
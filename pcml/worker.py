@@ -0,0 +1,95 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+
+Worker daemon for ExecutorType.distributed. Start one on each node:
+
+    PCML_AUTHKEY=secret python -m pcml.worker --listen host:port
+
+The daemon runs whatever authenticated schedulers send it, so it refuses to start without a key
+(--authkey or the PCML_AUTHKEY environment variable, which other users cannot read from the process list).
+
+Each connection receives an operation followed by tasks, a task is a group of subdomains
+(the output subdomain first) holding only their core plus halo. The output data is sent back.
+"""
+from .core.Distributed import parseaddress, attachoutputsubdomain
+from .core.WorkerPool import _subdomainresult
+import pcml.core.PCMLConfig as PCMLConfig
+
+from multiprocessing.connection import Listener
+import argparse
+import os
+import sys
+import threading
+import time
+import traceback
+
+
+def serveconnection(connection):
+    """ Execute the tasks received on one connection until the scheduler disconnects """
+    operation = None
+    try:
+        while True:
+            message = connection.recv()
+            if message is None:
+                break
+            if message[0] == 'op':
+                operation = message[1]
+            elif message[0] == 'task':
+                _, taskid, subdomains, dtype = message
+                try:
+                    outsubdomain = attachoutputsubdomain(subdomains[0], dtype)
+                    operation.executor(subdomains)
+                    connection.send(('done', taskid, _subdomainresult(outsubdomain)))
+                except Exception:
+                    connection.send(('error', taskid, traceback.format_exc()))
+    except (EOFError, IOError):
+        pass  # The scheduler went away
+    finally:
+        connection.close()
+
+
+def watchparent(pid):
+    """ Exit once the process pid has exited, so daemons started by LocalWorkers never outlive it """
+    while os.getppid() == pid:
+        time.sleep(1.0)
+    os._exit(0)
+
+
+def serve(address, authkey):
+    """ Listen on address and serve each scheduler connection in its own thread """
+    listener = Listener(address, authkey=authkey)
+    # The first line announces the bound address (useful with port 0)
+    print("pcml.worker listening on %s:%i" % listener.address)
+    sys.stdout.flush()
+    while True:
+        try:
+            connection = listener.accept()
+        except Exception as e:  # For example a client with the wrong authkey
+            print("pcml.worker rejected a connection: %s" % e)
+            sys.stdout.flush()
+            continue
+        thread = threading.Thread(target=serveconnection, args=(connection,))
+        thread.daemon = True
+        thread.start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCML worker daemon for ExecutorType.distributed")
+    parser.add_argument("--listen", required=True, help="host:port to listen on (port 0 picks a free port)")
+    parser.add_argument("--authkey", default=PCMLConfig.distributed_authkey,
+                        help="shared secret used to authenticate schedulers (default: the PCML_AUTHKEY environment variable)")
+    parser.add_argument("--parent", type=int, help="exit when the process with this pid exits")
+    args = parser.parse_args(argv)
+    if not args.authkey:
+        parser.error("a shared secret is required, set PCML_AUTHKEY or pass --authkey")
+    if args.parent is not None:
+        watcher = threading.Thread(target=watchparent, args=(args.parent,))
+        watcher.daemon = True
+        watcher.start()
+    serve(parseaddress(args.listen), args.authkey)
+
+
+if __name__ == '__main__':
+    main()
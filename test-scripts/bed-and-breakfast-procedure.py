@@ -46,9 +46,8 @@ if __name__ == '__main__':
     # Classification type 11 is open water in NLCD
     #near_water=BufferedClassify(landcover,buffersize=thebuffersize,classtype=11)
 
-    # Buffer+Classify
-    water_buf=FocalBuffer(landcover,buffersize=thebuffersize,classtype=11)
-    near_water=LocalClassify(water_buf,classtype=11)
+    # Buffer+Classify, pipelined so the buffered layer is never written out
+    near_water=pipeline(FocalBuffer(buffersize=thebuffersize,classtype=11),LocalClassify(classtype=11))(landcover)
 
     in_forest=LocalClassify(landcover,classtype=41)
 
@@ -57,8 +56,7 @@ if __name__ == '__main__':
     #near_road=BufferedClassify(transportation,buffersize=thebuffersize,classtype=1400)
 
     # Buffer+Classify
-    road_buf=FocalBuffer(transportation,buffersize=thebuffersize,classtype=1400)
-    near_road=LocalClassify(road_buf,classtype=1400)
+    near_road=pipeline(FocalBuffer(buffersize=thebuffersize,classtype=1400),LocalClassify(classtype=1400))(transportation)
     
 
     suitable = LocalAnd(near_water, in_forest, near_road)
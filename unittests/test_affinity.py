@@ -0,0 +1,71 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+"""
+from pcml import *
+from pcml.util.Affinity import *
+from pcml.util.LayerBuilder import *
+from numpy.ma import allequal
+import os
+import unittest
+
+class TestAffinity(unittest.TestCase):
+    def setUp(self):
+        # Two sockets with four cores each
+        self.nodes = [[0, 1, 2, 3], [4, 5, 6, 7]]
+
+    def tearDown(self):
+        PCMLConfig.affinity = None
+        PCMLConfig.worker_threads = 'auto'
+        PCMLConfig.exectype = ExecutorType.parallelpythonqueue
+
+    def test_parsecpulist(self):
+        self.assertEqual(parsecpulist("0-3,8-9,12\n"), [0, 1, 2, 3, 8, 9, 12])
+        self.assertEqual(parsecpulist("5"), [5])
+
+    def test_compact_fills_nodes_in_order(self):
+        self.assertEqual([rankcpus(rank, 2, 'compact', self.nodes) for rank in xrange(2)], self.nodes)
+        self.assertEqual([rankcpus(rank, 4, 'compact', self.nodes) for rank in xrange(4)], [[0, 1], [2, 3], [4, 5], [6, 7]])
+        self.assertEqual([rankcpus(rank, 3, 'compact', self.nodes) for rank in xrange(3)], [[0, 1, 2], [3, 4, 5], [6, 7]])
+
+    def test_scatter_alternates_nodes(self):
+        self.assertEqual([rankcpus(rank, 4, 'scatter', self.nodes) for rank in xrange(4)], [[0, 1], [4, 5], [2, 3], [6, 7]])
+        self.assertEqual([rankcpus(rank, 3, 'scatter', self.nodes) for rank in xrange(3)], [[0, 1], [4, 5, 6, 7], [2, 3]])
+
+    def test_more_ranks_than_cores_share_cores(self):
+        cpus = [rankcpus(rank, 10, 'compact', self.nodes) for rank in xrange(10)]
+        self.assertEqual(cpus[8], [0])
+        self.assertTrue(all(len(c) == 1 for c in cpus))
+
+    def test_threadbudget(self):
+        self.assertEqual(threadbudget(2, range(8)), 4)
+        self.assertEqual(threadbudget(3, range(8)), 2)
+        self.assertEqual(threadbudget(16, range(8)), 1)
+
+    def test_limitthreads_sets_environment(self):
+        environ = dict(os.environ)
+        try:
+            limitthreads(2)
+            self.assertEqual(os.environ['OMP_NUM_THREADS'], '2')
+            self.assertEqual(os.environ['OPENBLAS_NUM_THREADS'], '2')
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+    def test_setaffinity_current_cpus(self):
+        cpus = getaffinity()
+        self.assertTrue(len(cpus) >= 1)
+        self.assertTrue(setaffinity(cpus))
+        self.assertEqual(getaffinity(), cpus)
+
+    def test_pinned_workers(self):
+        PCMLConfig.affinity = 'compact'
+        PCMLConfig.exectype = ExecutorType.parallelpythonqueue
+        PCMLConfig.num_procs = 2
+        l1 = lst_to_layer([[1]*4]*6)
+        lo = FocalSum(l1, buffersize=1)
+        self.assertTrue(allequal(lo._data[2], [6, 9, 9, 6]))
+
+if __name__ == '__main__':
+    unittest.main()
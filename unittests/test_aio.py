@@ -0,0 +1,44 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+"""
+from pcml import *
+from pcml.util.LayerBuilder import *
+from numpy.ma import allequal
+from os import path, remove
+import numpy as np
+import unittest
+
+@unittest.skipIf(PCMLConfig.asyncioenabled == 0 or PCMLConfig.futuresenabled == 0, "asyncio and concurrent.futures are required")
+class TestAsyncIO(unittest.TestCase):
+    def setUp(self):
+        PCMLConfig.num_procs = 1
+        PCMLConfig.exectype = ExecutorType.serialpython
+        self.datadir = './data'
+        self.loop = aio.asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        aio.shutdown()
+
+    def test_read_run_write(self):
+        test_file = path.join(self.datadir, 'test_aio.asc')
+        l1, l2 = self.loop.run_until_complete(aio.asyncio.gather(
+            aio.read_asciigrid(path.join(self.datadir, 'data_c.asc'), loop=self.loop),
+            aio.read_asciigrid(path.join(self.datadir, 'data_c.asc'), loop=self.loop),
+            loop=self.loop))
+        lo = self.loop.run_until_complete(aio.run(LocalSum_np, l1, l2, loop=self.loop))
+        self.assertTrue(allequal(lo._data, l1._data * 2))
+        self.loop.run_until_complete(aio.write_asciigrid(test_file, lo, loop=self.loop))
+        l3 = ReadASCIIGrid(test_file)
+        self.assertTrue(np.allclose(l3._data, lo._data))
+        remove(test_file)
+
+    def test_run_passes_kwargs(self):
+        l1 = lst_to_layer([[1]*4]*4)
+        lo = self.loop.run_until_complete(aio.run(FocalSum, l1, buffersize=1, loop=self.loop))
+        self.assertTrue(allequal(lo._data, [[4,6,6,4],[6,9,9,6],[6,9,9,6],[4,6,6,4]]))
+
+if __name__ == '__main__':
+    unittest.main()
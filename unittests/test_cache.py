@@ -0,0 +1,129 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+"""
+from pcml import *
+from pcml.core.Cache import layerdigest
+from pcml.util.LayerBuilder import *
+from numpy.ma import allequal
+import numpy as np
+import cPickle as pickle
+import shutil
+import tempfile
+import unittest
+
+# Rows processed by LocalCountedClassify (serial execution runs in this process)
+runs = []
+
+@executor
+@localoperation
+def LocalCountedClassify(self, subdomains):
+    runs.append(subdomains[0].r)
+    subdomains[0].get_nparray()[:, :] = subdomains[1].get_nparray() == self.kwargs.get('classtype', 0)
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        PCMLConfig.exectype = ExecutorType.serialpython
+        PCMLConfig.decomposition_granularity = 2
+        PCMLConfig.cache = True
+        PCMLConfig.cache_tile_rows = 2
+        clearcache()
+        del runs[:]
+        self.landcover = lst_to_layer([[41, 11, 41, 21]] * 4)
+
+    def tearDown(self):
+        PCMLConfig.cache = False
+        PCMLConfig.cache_dir = None
+        PCMLConfig.cache_bytes = 256 * 1024 * 1024
+        PCMLConfig.cache_tile_rows = 256
+        PCMLConfig.compute_dtype = 'float64'
+        PCMLConfig.exectype = ExecutorType.parallelpythonqueue
+        clearcache()
+
+    def test_hit_returns_stored_layer(self):
+        lo = LocalCountedClassify(self.landcover, classtype=41)
+        self.assertEqual(len(runs), 2)
+        self.assertTrue(LocalCountedClassify(self.landcover, classtype=41) is lo)
+        self.assertEqual(len(runs), 2)
+        self.assertEqual(resultcache().hits, 1)
+        # Other arguments or inputs with the same contents
+        LocalCountedClassify(self.landcover, classtype=11)
+        self.assertEqual(len(runs), 4)
+        self.assertTrue(LocalCountedClassify(lst_to_layer([[41, 11, 41, 21]] * 4), classtype=41) is lo)
+        self.assertFalse(lo._data.flags.writeable)
+
+    def test_modified_rows_hashed_again(self):
+        lo = LocalCountedClassify(self.landcover, classtype=41)
+        digest = layerdigest(self.landcover)
+        self.assertEqual(len(self.landcover._tilehashes), 2)
+        self.landcover._data[3][0] = 11
+        self.landcover.modified(3, 1)
+        self.assertEqual(len(self.landcover._tilehashes), 1)
+        self.assertNotEqual(layerdigest(self.landcover), digest)
+        lo2 = LocalCountedClassify(self.landcover, classtype=41)
+        self.assertFalse(lo2 is lo)
+        self.assertEqual(lo2._data[3][0], 0)
+
+    def test_eviction_by_bytes(self):
+        PCMLConfig.cache_bytes = 4 * 4 * 8  # One 4x4 layer
+        LocalCountedClassify(self.landcover, classtype=41)
+        LocalCountedClassify(self.landcover, classtype=11)
+        self.assertEqual(len(resultcache().layers), 1)
+        LocalCountedClassify(self.landcover, classtype=41)
+        self.assertEqual(len(runs), 6)
+
+    def test_disk_tier(self):
+        PCMLConfig.cache_dir = tempfile.mkdtemp()
+        try:
+            lo = LocalCountedClassify(self.landcover, classtype=41)
+            clearcache()
+            lo2 = LocalCountedClassify(self.landcover, classtype=41)
+            self.assertEqual(len(runs), 2)
+            self.assertTrue(allequal(lo2._data, lo._data))
+            self.assertEqual(lo2.cellsize, lo.cellsize)
+            clearcache(disk=True)
+            LocalCountedClassify(self.landcover, classtype=41)
+            self.assertEqual(len(runs), 4)
+        finally:
+            shutil.rmtree(PCMLConfig.cache_dir)
+
+    def test_compute_dtype_in_key(self):
+        lo = LocalCountedClassify(self.landcover, classtype=41)
+        PCMLConfig.compute_dtype = 'float32'
+        lo2 = LocalCountedClassify(self.landcover, classtype=41)
+        self.assertEqual(len(runs), 4)
+        self.assertEqual(lo2._data.dtype, np.float32)
+        PCMLConfig.compute_dtype = 'float64'
+        self.assertTrue(LocalCountedClassify(self.landcover, classtype=41) is lo)
+
+    def test_output_layer_not_cached(self):
+        out = self.landcover.duplicate()
+        LocalCountedClassify(self.landcover, classtype=41, outputlayer=out)
+        LocalCountedClassify(self.landcover, classtype=41, outputlayer=out)
+        self.assertEqual(len(runs), 4)
+
+    def test_cached_layer_refused_as_output(self):
+        lo = LocalCountedClassify(self.landcover, classtype=41)
+        for exectype in [ExecutorType.serialpython, ExecutorType.persistentpool, ExecutorType.parallelpythonqueue]:
+            PCMLConfig.exectype = exectype
+            self.assertRaises(PCMLOperationError, LocalSum, self.landcover, self.landcover, outputlayer=lo)
+        self.assertTrue(LocalCountedClassify(self.landcover, classtype=41) is lo)
+        self.assertTrue(allequal(lo._data, [[1, 0, 1, 0]] * 4))
+        # Workers mapping the segment of a cached layer cannot write to it either
+        sent = pickle.loads(pickle.dumps(lo, pickle.HIGHEST_PROTOCOL))
+        self.assertFalse(sent._data.flags.writeable)
+
+    def test_overwritten_output_layer_hashed_again(self):
+        lo = LocalCountedClassify(self.landcover, classtype=41)
+        # The input is overwritten in place as the output layer of another operation
+        LocalCountedClassify(lst_to_layer([[11] * 4] * 4), classtype=11, outputlayer=self.landcover)
+        lo2 = LocalCountedClassify(self.landcover, classtype=41)
+        self.assertFalse(lo2 is lo)
+        self.assertTrue(allequal(lo2._data, [[0] * 4] * 4))
+        # Data replaced by reference is hashed again as well
+        self.landcover.set_data_ref(np.array([[41.0] * 4] * 4))
+        self.assertTrue(allequal(LocalCountedClassify(self.landcover, classtype=41)._data, [[1] * 4] * 4))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+"""
+from pcml import *
+from pcml.util.LayerBuilder import *
+from numpy.ma import allequal
+import numpy as np
+import pcml.core.Distributed as Distributed
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+# Fails on every subdomain to check errors are reported by the worker daemons
+@executor
+@localoperation
+def LocalDistributedFailure(self, subdomains):
+    raise ValueError("LocalDistributedFailure always fails")
+
+# Fails on the first attempt at each subdomain, a marker file records the first attempt
+@executor
+@localoperation
+def LocalDistributedFlaky(self, subdomains):
+    marker = os.path.join(self.kwargs['markerdir'], "%i" % subdomains[0].r)
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        raise ValueError("First attempt at subdomain %i fails" % subdomains[0].r)
+    subdomains[0].get_nparray()[:, :] = subdomains[1].get_nparray() + 1
+
+class TestDistributed(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.workers = LocalWorkers(2)
+        cls.workers.__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.workers.__exit__(None, None, None)
+
+    def setUp(self):
+        PCMLConfig.exectype = ExecutorType.distributed
+        PCMLConfig.decomposition_granularity = 2
+        self.l1 = lst_to_layer([[1]*5]*7)
+        self.l2 = lst_to_layer([[2]*5]*7)
+        self.l3 = Layer(0, 0, 60, 40, 'distributed')
+        self.l3.set_nparray(np.arange(60 * 40.0).reshape((60, 40)), 1, -9999)
+
+    def tearDown(self):
+        PCMLConfig.exectype = ExecutorType.parallelpythonqueue
+        PCMLConfig.decomposition_granularity = 16
+
+    def test_local_operations(self):
+        lo = LocalSum_np(self.l1, self.l2)
+        self.assertTrue(allequal(lo._data, [[3]*5]*7))
+        lo = LocalMult(self.l1, self.l2)
+        self.assertTrue(allequal(lo._data, self.l2._data))
+
+    def test_focal_operation_matches_serial(self):
+        lo = FocalMean(self.l3, buffersize=2)
+        PCMLConfig.exectype = ExecutorType.serialpython
+        expected = FocalMean(self.l3, buffersize=2)
+        self.assertTrue(np.allclose(lo._data, expected._data))
+        PCMLConfig.exectype = ExecutorType.distributed
+        lo = FocalSum(self.l3, buffersize=1, decomposition=columndecomposition)
+        PCMLConfig.exectype = ExecutorType.serialpython
+        expected = FocalSum(self.l3, buffersize=1, decomposition=columndecomposition)
+        self.assertTrue(np.allclose(lo._data, expected._data))
+
+    def test_connections_reused_across_operations(self):
+        LocalSum(self.l1, self.l2)
+        connections = dict(Distributed._connections)
+        self.assertEqual(len(connections), 2)
+        LocalSum(self.l1, self.l2)
+        for address, connection in connections.items():
+            self.assertTrue(Distributed._connections[address] is connection)
+
+    def test_worker_failures_reported(self):
+        with self.assertRaises(PCMLOperationError):
+            LocalDistributedFailure(self.l1)
+        # The daemons keep serving after a failed task
+        lo = LocalSum(self.l1, self.l2)
+        self.assertTrue(allequal(lo._data, [[3]*5]*7))
+
+    def test_failed_subdomains_retried(self):
+        markerdir = tempfile.mkdtemp()
+        try:
+            lo = LocalDistributedFlaky(self.l1, markerdir=markerdir)
+        finally:
+            shutil.rmtree(markerdir)
+        self.assertTrue(allequal(lo._data, [[2]*5]*7))
+
+    def test_native_output_dtype(self):
+        layer = Layer(0, 0, 7, 5, 'uint8')
+        layer.set_nparray(np.arange(35, dtype=np.uint8).reshape((7, 5)), 1, -9999)
+        lo = LocalMaximum_np(layer, layer)
+        self.assertEqual(lo.get_nparray().dtype, np.uint8)
+        self.assertTrue(allequal(lo._data, layer._data))
+        outsubdomain = detachsubdomain(rowdecomposition(layer, 0)[0], copydata=False)
+        self.assertEqual(attachoutputsubdomain(outsubdomain, np.uint8).get_nparray().dtype, np.uint8)
+
+    def test_subdomain_detached_with_halo(self):
+        subdomains = rowdecomposition(self.l3, 2)
+        detached = detachsubdomain(subdomains[1])
+        self.assertTrue(detached._segment is None)
+        self.assertEqual(detached.get_nparray().shape, (6, 40))
+        self.assertTrue(allequal(detached.get_nparray(), subdomains[1].get_nparray()))
+        self.assertTrue(detachsubdomain(subdomains[1], copydata=False)._data is None)
+
+class TestDistributedWorkerLost(unittest.TestCase):
+    def setUp(self):
+        PCMLConfig.exectype = ExecutorType.distributed
+        PCMLConfig.decomposition_granularity = 2
+
+    def tearDown(self):
+        PCMLConfig.exectype = ExecutorType.parallelpythonqueue
+        PCMLConfig.decomposition_granularity = 16
+
+    def test_remaining_workers_take_over(self):
+        l1 = lst_to_layer([[1]*5]*7)
+        with LocalWorkers(2) as workers:
+            workers._processes[0].terminate()
+            workers._processes[0].wait()
+            lo = LocalSum(l1, l1)
+            self.assertTrue(allequal(lo._data, [[2]*5]*7))
+
+    def test_random_keys(self):
+        with LocalWorkers(1) as workers:
+            self.assertEqual(PCMLConfig.distributed_authkey, workers.authkey)
+            self.assertNotEqual(workers.authkey, LocalWorkers(1).authkey)
+        self.assertNotEqual(PCMLConfig.distributed_authkey, workers.authkey)
+
+    def test_worker_requires_key(self):
+        env = dict((key, val) for key, val in os.environ.items() if key != 'PCML_AUTHKEY')
+        env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        with open(os.devnull, 'w') as devnull:
+            code = subprocess.call([sys.executable, '-m', 'pcml.worker', '--listen', 'localhost:0'], env=env, stderr=devnull)
+        self.assertEqual(code, 2)
+
+    def test_no_workers(self):
+        PCMLConfig.distributed_workers = []
+        with self.assertRaises(PCMLOperationError):
+            LocalSum(lst_to_layer([[1]*5]*7), lst_to_layer([[1]*5]*7))
+
+if __name__ == '__main__':
+    unittest.main()
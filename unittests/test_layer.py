@@ -8,6 +8,14 @@ from pcml.util.Messaging import PCMLNotImplemented
 from pcml.util.LayerBuilder import lst_to_layer
 from numpy.ma import allequal
 import numpy as np
+import multiprocessing as mp
+import errno
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
 import unittest
 
 # TODO: Use the data*.asc files as test cases for unit + integration testing.
@@ -127,6 +135,186 @@ class TestLayer(unittest.TestCase):
         self.assertEqual(newlayer.nodata_value,self.layer7.nodata_value)
         self.assertEqual(np.all(array==0),True)
         
+    def test_memmap_backing_store(self):
+        directory = tempfile.mkdtemp()
+        num_procs = PCMLConfig.num_procs
+        try:
+            PCMLConfig.scratch_dir = directory
+            layer = Layer(0, 0, 3, 3, "Mapped")
+            layer.set_nparray(np.asarray([[2.0] * 3] * 3), 1, -9999, store='memmap')
+            self.assertTrue(layer._segment.path.startswith(directory))
+            self.assertTrue(allequal(layer._data, [[2] * 3] * 3))
+            # Output layers of operations use the same store, workers map them without copying
+            PCMLConfig.num_procs = 2
+            lo = LocalSum(layer, layer)
+            self.assertTrue(lo._segment.path.startswith(directory))
+            self.assertTrue(allequal(lo._data, [[4] * 3] * 3))
+        finally:
+            PCMLConfig.scratch_dir = None
+            PCMLConfig.num_procs = num_procs
+            shutil.rmtree(directory)
+
+    def test_map_raster_output_written_to_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'out.npy')
+            out = MapRaster(filename, like=self.layer7)
+            FocalSum(self.layer7, buffersize=1, outputlayer=out)
+            saved = np.load(filename)
+            self.assertEqual(saved[1][1], 45)
+            self.assertEqual(saved[0][0], 20)
+            self.assertTrue(allequal(MapRaster(filename)._data, saved))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_native_output_holds_mixed_inputs(self):
+        small = Layer(0, 0, 2, 2, "uint8")
+        small.set_nparray(np.array([[1, 2], [3, 4]], dtype=np.uint8), 1, 0)
+        large = Layer(0, 0, 2, 2, "float64")
+        large.set_nparray(np.array([[300.5, 0], [0, 0]]), 1, 0)
+        lo = LocalMaximum_np(small, large)
+        self.assertEqual(lo._data.dtype, np.float64)
+        self.assertTrue(allequal(lo._data, [[300.5, 2], [3, 4]]))
+        self.assertEqual(LocalMinimum_np(large, small)._data[0][0], 1)
+        self.assertEqual(FocalMajority(small, large, buffersize=0)._data[0][0], 1)
+        self.assertEqual(FocalMajority(large, small, buffersize=0)._data[0][0], 300.5)
+        self.assertEqual(LocalMaximum_np(small, small)._data.dtype, np.uint8)
+
+    def test_map_raster_read_only_file(self):
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'in.npy')
+        np.save(filename, np.arange(12.0).reshape((3, 4)))
+        osopen = os.open
+
+        def readonlyopen(path, flags, *args):
+            # Behaves like a file on a read-only mount
+            if path == filename and flags & os.O_RDWR:
+                raise OSError(errno.EROFS, "Read-only file system", path)
+            return osopen(path, flags, *args)
+        os.open = readonlyopen
+        try:
+            layer = MapRaster(filename)
+            self.assertFalse(layer._data.flags.writeable)
+            self.assertTrue(allequal(LocalSum(layer, layer)._data, np.arange(0, 24.0, 2).reshape((3, 4))))
+        finally:
+            os.open = osopen
+            shutil.rmtree(directory)
+
+    def test_layers_keep_source_dtype(self):
+        layer = Layer(0, 0, 4, 4, "Landcover")
+        layer.set_nparray(np.full((4, 4), 200, dtype=np.uint8), 1, 0)
+        self.assertEqual(layer._data.dtype, np.uint8)
+        self.assertEqual(layer._segment.nbytes, 16)
+        self.assertEqual(layer.duplicate()._data.dtype, np.uint8)
+        # Integer inputs are promoted to the compute data type, so sums do not overflow
+        lo = LocalSum(layer, layer)
+        self.assertEqual(lo._data.dtype, np.float64)
+        self.assertTrue(allequal(lo._data, [[400] * 4] * 4))
+        # Operations that only compare or copy values keep the data type
+        self.assertEqual(LocalClassify(layer, classtype=200)._data.dtype, np.uint8)
+        self.assertEqual(LocalSum(layer, layer, dtype=np.int16)._data.dtype, np.int16)
+
+    def test_float32_compute_dtype(self):
+        try:
+            PCMLConfig.compute_dtype = 'float32'
+            lo = FocalMean(self.layer7, buffersize=1)
+            self.assertEqual(lo._data.dtype, np.float32)
+            self.assertTrue(allequal(lo._data, [[5] * 3] * 3))
+        finally:
+            PCMLConfig.compute_dtype = 'float64'
+
+    def test_release_reuses_memory(self):
+        pool = segmentpool()
+        pool.clear()
+        layer = Layer(0, 0, 100, 100, "Released")
+        layer.set_nparray(np.ones((100, 100)), 1, -9999)
+        path = layer._segment.path
+        layer.release()
+        self.assertTrue(layer._data is None)
+        self.assertTrue(path in pool.idle)
+        # A layer of the same size class reuses the memory, zero filled under a new name
+        reused = pool.reused
+        newlayer = Layer(0, 0, 99, 100, "New")
+        newlayer.allocate_nparray((99, 100), 1, -9999)
+        self.assertEqual(pool.reused, reused + 1)
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(np.all(newlayer._data == 0))
+        # Memory that an array still refers to is not reused
+        data = newlayer._data
+        newlayer.release()
+        self.assertEqual(len(pool.idle), 0)
+        del data
+        # Memory sent to another process (e.g., a persistent pool worker) may still be mapped there
+        PCMLConfig.exectype = ExecutorType.persistentpool
+        try:
+            sent = Layer(0, 0, 100, 100, "Sent")
+            sent.set_nparray(np.ones((100, 100)), 1, -9999)
+            LocalSum(sent, sent).release()
+        finally:
+            PCMLConfig.exectype = ExecutorType.parallelpythonqueue
+            shutdownpool()
+        path = sent._segment.path
+        sent.release()
+        self.assertEqual(len(pool.idle), 0)
+        self.assertFalse(os.path.exists(path))
+        pool.clear()
+
+    def test_stale_segments_removed(self):
+        # A process killed before exiting leaves its segments, they are removed once it is no longer running
+        reader, writer = mp.Pipe(duplex=False)
+
+        def killed():
+            layer = Layer(0, 0, 10, 10, "Killed")
+            layer.set_nparray(np.ones((10, 10)), 1, -9999)
+            writer.send(layer._segment.path)
+            os.kill(os.getpid(), signal.SIGKILL)
+
+        process = mp.Process(target=killed)
+        process.start()
+        self.assertTrue(reader.poll(10))
+        path = reader.recv()
+        process.join()
+        self.assertTrue(os.path.exists(path))
+        layer = Layer(0, 0, 10, 10, "Running")
+        layer.set_nparray(np.ones((10, 10)), 1, -9999)
+        self.assertEqual(removestalesegments(os.path.dirname(path)), [path])
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(layer._segment.path))
+
+    def test_segment_pool_threads(self):
+        # Threads allocating and releasing layers at the same time share the pool of the process
+        pool = segmentpool()
+        pool.clear()
+        errors = []
+
+        def allocate(seed):
+            try:
+                state = np.random.RandomState(seed)
+                for i in xrange(200):
+                    layer = Layer(0, 0, 10, 10, "Thread")
+                    layer.allocate_nparray((state.randint(1, 4) * 64, 64), 1, -9999)
+                    layer.get_nparray()[:, :] = seed
+                    if not np.all(layer.get_nparray() == seed):
+                        errors.append("Layer of thread %i overwritten" % seed)
+                    layer.release()
+            except Exception as e:
+                errors.append(repr(e))
+
+        threads = [threading.Thread(target=allocate, args=(seed,)) for seed in xrange(1, 5)]
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)  # Switch threads as often as possible
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(interval)
+        self.assertEqual(errors, [])
+        self.assertEqual(pool.nbytes, sum(reserved for reserved, mapping in pool.idle.values()))
+        self.assertTrue(all(os.path.exists(path) for path in pool.idle))
+        pool.clear()
+
     # FIXME: Tests to be written
     '''
     decomposition
@@ -5,6 +5,7 @@ Authors and contributors: Eric Shook (eshook@kent.edu); Suman Jindam (sjindam@ke
 """
 from pcml import *
 from pcml.util.LayerBuilder import *
+from pcml.core.Streaming import rowsubdomain
 from numpy.ma import allequal
 from os import path
 import numpy as np
@@ -62,6 +63,193 @@ class TestLayerOperationsSerial(cml_test.PCMLSerialTestCase):
         lo = FocalMean(self.l6, buffersize=2,decomposition=columndecomposition)
         self.assertTrue(np.allclose(lo._data, self.l7._data))
 
+        # To ensure tile decomposition gives the same output as row decomposition with halos on four sides
+    def test_focal_tiledecomp(self):
+        layer = lst_to_layer(np.random.RandomState(0).randint(0, 9, (11, 13)).tolist())
+        for shape in [None, (3, 4), (20, 20)]:
+            PCMLConfig.tile_shape = shape
+            try:
+                tiles = tiledecomposition(layer, 2)
+                for tile in tiles:
+                    self.assertTrue(tile.r >= 0 and tile.c >= 0)
+                    self.assertTrue(tile.r + tile.nrows <= layer.nrows and tile.c + tile.ncols <= layer.ncols)
+                self.assertEqual(sum(t.nrows * t.ncols for t in tiledecomposition(layer, 0)), 11 * 13)
+                for op in [FocalMean, FocalSum, FocalMean_np_exec]:
+                    lo = op(layer, buffersize=2, decomposition=tiledecomposition)
+                    self.assertTrue(np.allclose(lo._data, op(layer, buffersize=2)._data))
+            finally:
+                PCMLConfig.tile_shape = None
+
+        # To ensure the summed-area table executors match the window of every cell clipped at the layer edges
+    def test_focal_summed_area_table(self):
+        arr = np.random.RandomState(1).randint(0, 50, (9, 7)).astype(float)
+        layer = lst_to_layer(arr.tolist())
+        for buffersize in [0, 1, 3, 12]:
+            expected = np.zeros(arr.shape)
+            for r in xrange(arr.shape[0]):
+                for c in xrange(arr.shape[1]):
+                    expected[r][c] = arr[max(0, r - buffersize):r + buffersize + 1, max(0, c - buffersize):c + buffersize + 1].sum()
+            for decomposition in [rowdecomposition, columndecomposition, tiledecomposition]:
+                self.assertTrue(allequal(FocalSum(layer, buffersize=buffersize, decomposition=decomposition)._data, expected))
+                mean = FocalMean(layer, buffersize=buffersize, decomposition=decomposition)._data
+                self.assertTrue(np.allclose(mean, FocalMean_np_exec(layer, buffersize=buffersize)._data))
+        # Only windows around a NaN are NaN
+        arr[4][3] = np.nan
+        lo = FocalMean(lst_to_layer(arr.tolist()), buffersize=1)
+        self.assertTrue(np.isnan(lo._data[3][2]) and np.isnan(lo._data[5][4]))
+        self.assertEqual(np.isnan(lo._data).sum(), 9)
+        # Only windows around an infinity are infinite, around both infinities they are NaN
+        arr[4][3] = np.inf
+        lo = FocalSum(lst_to_layer(arr.tolist()), buffersize=1)
+        self.assertEqual(np.isinf(lo._data).sum(), 9)
+        self.assertFalse(np.isnan(lo._data).any())
+        self.assertEqual(lo._data[0][0], arr[:2, :2].sum())
+        arr[6][3] = -np.inf
+        lo = FocalSum(lst_to_layer(arr.tolist()), buffersize=1)
+        self.assertTrue(lo._data[3][3] == np.inf and lo._data[7][3] == -np.inf)
+        self.assertEqual(np.isnan(lo._data).sum(), 3)
+        self.assertEqual(np.isfinite(lo._data).sum(), arr.size - 15)
+
+        # To ensure the van Herk/Gil-Werman executors match the maximum and minimum of clipped windows of all layers
+    def test_focal_extremes(self):
+        state = np.random.RandomState(2)
+        a = state.randint(0, 100, (8, 11)).astype(float)
+        b = state.randint(0, 100, (8, 11)).astype(float)
+        la, lb = lst_to_layer(a.tolist()), lst_to_layer(b.tolist())
+        for buffersize in [0, 1, 2, 4, 20]:
+            expectedmax = np.zeros(a.shape)
+            expectedmin = np.zeros(a.shape)
+            for r in xrange(a.shape[0]):
+                for c in xrange(a.shape[1]):
+                    window = (slice(max(0, r - buffersize), r + buffersize + 1), slice(max(0, c - buffersize), c + buffersize + 1))
+                    expectedmax[r][c] = max(a[window].max(), b[window].max())
+                    expectedmin[r][c] = min(a[window].min(), b[window].min())
+            for decomposition in [rowdecomposition, columndecomposition, tiledecomposition]:
+                self.assertTrue(allequal(FocalMaximum(la, lb, buffersize=buffersize, decomposition=decomposition)._data, expectedmax))
+                self.assertTrue(allequal(FocalMinimum_np(la, lb, buffersize=buffersize, decomposition=decomposition)._data, expectedmin))
+        self.assertTrue(allequal(FocalMinimum(la, buffersize=1)._data, FocalMinimum_np(la, buffersize=1)._data))
+
+        # To ensure buffers built on the distance transform include cells within the buffer distance of the class
+    def test_focal_buffer_distance(self):
+        arr = np.random.RandomState(4).randint(0, 8, (12, 9)) * (np.random.RandomState(5).rand(12, 9) < 0.1)
+        layer = Layer(0, 0, 12 * 30, 9 * 30, "Buffer")
+        layer.set_nparray(arr.astype(float), 30, -9999)
+        for buffersize in [0, 1, 2, 3]:
+            dist = buffersize * 30
+            expected = np.zeros(arr.shape)
+            for r in xrange(arr.shape[0]):
+                for c in xrange(arr.shape[1]):
+                    rr, cc = np.nonzero(arr == 5)
+                    expected[r][c] = np.any(np.sqrt(((rr - r) * 30.0) ** 2 + ((cc - c) * 30.0) ** 2) <= dist)
+            self.assertTrue(allequal(BufferedClassify(layer, buffersize=dist, classtype=5)._data, expected))
+            self.assertTrue(allequal(FocalBuffer(layer, buffersize=dist, classtype=5)._data, np.where(expected, 5, arr)))
+
+        # To ensure the sliding histogram executors match the statistics of each window computed directly
+    def test_focal_histograms(self):
+        state = np.random.RandomState(6)
+        a = state.randint(0, 5, (9, 10))
+        b = state.randint(2, 8, (9, 10))
+        la, lb = lst_to_layer(a.tolist()), lst_to_layer(b.tolist())
+        for buffersize in [0, 1, 2, 3]:
+            majority = np.zeros(a.shape)
+            minority = np.zeros(a.shape)
+            median = np.zeros(a.shape)
+            percentile = np.zeros(a.shape)
+            for r in xrange(a.shape[0]):
+                for c in xrange(a.shape[1]):
+                    window = (slice(max(0, r - buffersize), r + buffersize + 1), slice(max(0, c - buffersize), c + buffersize + 1))
+                    values = np.concatenate([a[window].ravel(), b[window].ravel()])
+                    counts = dict((v, list(values).count(v)) for v in values)
+                    # Ties go to the value found first
+                    majority[r][c] = [v for v in values if counts[v] == max(counts.values())][0]
+                    minority[r][c] = [v for v in values if counts[v] == min(counts.values())][0]
+                    median[r][c] = np.median(a[window])
+                    percentile[r][c] = np.percentile(values, 30)
+            for decomposition in [rowdecomposition, columndecomposition, tiledecomposition]:
+                self.assertTrue(allequal(FocalMajority(la, lb, buffersize=buffersize, decomposition=decomposition)._data, majority))
+                self.assertTrue(allequal(FocalMinority(la, lb, buffersize=buffersize, decomposition=decomposition)._data, minority))
+                self.assertTrue(np.allclose(FocalMedian(la, buffersize=buffersize, decomposition=decomposition)._data, median))
+                self.assertTrue(np.allclose(FocalPercentile(la, lb, buffersize=buffersize, q=30, decomposition=decomposition)._data, percentile))
+        self.assertRaises(PCMLInvalidInput, FocalPercentile, la, buffersize=1, q=101)
+
+        # To ensure layers with more distinct values than cells in a window give the statistics of each window
+    def test_focal_histograms_many_values(self):
+        state = np.random.RandomState(8)
+        a = state.randint(0, 60, (9, 10)) * 0.5
+        b = state.rand(9, 10)
+        la, lb = lst_to_layer(a.tolist()), lst_to_layer(b.tolist())
+        for buffersize in [1, 2, 3]:
+            majority = np.zeros(a.shape)
+            minority = np.zeros(a.shape)
+            percentile = np.zeros(a.shape)
+            for r in xrange(a.shape[0]):
+                for c in xrange(a.shape[1]):
+                    window = (slice(max(0, r - buffersize), r + buffersize + 1), slice(max(0, c - buffersize), c + buffersize + 1))
+                    values = a[window].ravel()
+                    counts = dict((v, list(values).count(v)) for v in values)
+                    majority[r][c] = [v for v in values if counts[v] == max(counts.values())][0]
+                    minority[r][c] = [v for v in values if counts[v] == min(counts.values())][0]
+                    percentile[r][c] = np.percentile(np.concatenate([values, b[window].ravel()]), 30)
+            self.assertTrue(allequal(FocalMajority(la, buffersize=buffersize)._data, majority))
+            self.assertTrue(allequal(FocalMinority(la, buffersize=buffersize)._data, minority))
+            self.assertTrue(np.allclose(FocalPercentile(la, lb, buffersize=buffersize, q=30)._data, percentile))
+
+        # To ensure the categorical executors match the class counts of each window computed directly
+    def test_focal_categories(self):
+        a = np.random.RandomState(7).choice([11, 21, 41, 82, 90], (10, 8))
+        la = lst_to_layer(a.tolist())
+        for buffersize in [0, 1, 3]:
+            percentage = np.zeros(a.shape)
+            variety = np.zeros(a.shape)
+            proportion = np.zeros(a.shape)
+            for r in xrange(a.shape[0]):
+                for c in xrange(a.shape[1]):
+                    window = a[max(0, r - buffersize):r + buffersize + 1, max(0, c - buffersize):c + buffersize + 1]
+                    percentage[r][c] = 100.0 * (window == a[r][c]).sum() / window.size
+                    variety[r][c] = len(set(window.flat))
+                    proportion[r][c] = (window == 41).sum() / float(window.size)
+            for decomposition in [rowdecomposition, columndecomposition, tiledecomposition]:
+                self.assertTrue(np.allclose(FocalPercentage(la, buffersize=buffersize, decomposition=decomposition)._data, percentage))
+                self.assertTrue(allequal(FocalVariety(la, buffersize=buffersize, decomposition=decomposition)._data, variety))
+                self.assertTrue(np.allclose(FocalProportion(la, buffersize=buffersize, classtype=41, decomposition=decomposition)._data, proportion))
+        proportions = FocalProportions(la, buffersize=1)
+        self.assertEqual(list(proportions), [11, 21, 41, 82, 90])
+        self.assertTrue(np.allclose(sum(lo._data for lo in proportions.values()), 1))
+
+        # To ensure layers with more classes than cells in a window give the class counts of each window
+    def test_focal_categories_many_values(self):
+        a = np.random.RandomState(9).randint(0, 40, (10, 8)) * 0.25
+        la = lst_to_layer(a.tolist())
+        for buffersize in [0, 1, 2]:
+            percentage = np.zeros(a.shape)
+            variety = np.zeros(a.shape)
+            for r in xrange(a.shape[0]):
+                for c in xrange(a.shape[1]):
+                    window = a[max(0, r - buffersize):r + buffersize + 1, max(0, c - buffersize):c + buffersize + 1]
+                    percentage[r][c] = 100.0 * (window == a[r][c]).sum() / window.size
+                    variety[r][c] = len(set(window.flat))
+            budget = PCMLConfig.focal_histogram_bytes
+            try:
+                # Windows of a few cells at a time, blocks of part of a row
+                for PCMLConfig.focal_histogram_bytes in [budget, 3 * 9 * 8]:
+                    for decomposition in [rowdecomposition, columndecomposition, tiledecomposition]:
+                        self.assertTrue(np.allclose(FocalPercentage(la, buffersize=buffersize, decomposition=decomposition)._data, percentage))
+                        self.assertTrue(allequal(FocalVariety(la, buffersize=buffersize, decomposition=decomposition)._data, variety))
+            finally:
+                PCMLConfig.focal_histogram_bytes = budget
+        # Large windows stay within the configured bytes
+        budget = PCMLConfig.focal_histogram_bytes
+        try:
+            PCMLConfig.focal_histogram_bytes = 3 * 41 * 41 * 8
+            cells = 0
+            subdomain = rowsubdomain(la, 0, la.get_nparray())
+            for rows, cols, centres, windows in windowcodes(subdomain, subdomain, 20):
+                self.assertTrue(windows.nbytes <= PCMLConfig.focal_histogram_bytes)
+                cells += centres.size
+            self.assertEqual(cells, a.size)
+        finally:
+            PCMLConfig.focal_histogram_bytes = budget
+
         # To ensure FocalMean Operation with numpy implementation gives the correct output with different buffer sizes
     def test_focalmean_np(self):
         lo = FocalMean_np(self.l1, buffersize=1)
@@ -166,6 +354,18 @@ class TestLayerOperationsParallel(TestLayerOperationsSerial):
         PCMLConfig.num_procs = 4
         PCMLConfig.exectype = ExecutorType.parallelpythonqueue
 
+class TestLayerOperationsWorkStealing(TestLayerOperationsSerial):
+    def setUp(self):
+        super(TestLayerOperationsWorkStealing, self).setUp()
+        PCMLConfig.num_procs = 4
+        PCMLConfig.exectype = ExecutorType.workstealing
+
+class TestLayerOperationsThreadPool(TestLayerOperationsSerial):
+    def setUp(self):
+        super(TestLayerOperationsThreadPool, self).setUp()
+        PCMLConfig.num_procs = 4
+        PCMLConfig.exectype = ExecutorType.threadpool
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -174,6 +174,12 @@ class TestLayerOperationsParallel(TestLayerOperationsSerial):
         PCMLConfig.num_procs = 4
         PCMLConfig.exectype = ExecutorType.parallelpythonqueue
 
+class TestLayerOperationsThreadPool(TestLayerOperationsSerial):
+    def setUp(self):
+        super(TestLayerOperationsThreadPool, self).setUp()
+        PCMLConfig.num_procs = 4
+        PCMLConfig.exectype = ExecutorType.threadpool
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -9,6 +9,9 @@ import numpy as np
 from numpy.ma import allequal
 import unittest
 from os import path, remove, devnull
+from pcml.core.Streaming import blockrows
+import shutil
+import tempfile
 
 class TestLayerIO(unittest.TestCase):
     def setUp(self):
@@ -38,6 +41,28 @@ class TestLayerIO(unittest.TestCase):
         self.assertTrue(allequal(l3._data, l4._data))
         remove(test_file)
 
+    def test_asciigrid_dtype(self):
+        test_file = path.join(self.datadir, 'test_layerio_dtype.asc')
+        for values, nodata, dtype in [([[1, 4], [250, 0]], -9999, np.int16), ([[1, 4], [250, 0]], 255, np.uint8),
+                                      ([[1, 4], [70000, 0]], 0, np.int32), ([[1.5, 4], [2, 0]], 0, np.float64)]:
+            layer = lst_to_layer(values)
+            layer.nodata_value = nodata
+            WriteASCIIGrid(test_file, layer)
+            l2 = ReadASCIIGrid(test_file)
+            self.assertEqual(l2._data.dtype, dtype)
+            self.assertTrue(allequal(l2._data, layer._data))
+        remove(test_file)
+
+    def test_geotiff_read_blocks(self):
+        # Reads cover every row once and start on a block of the file
+        PCMLConfig.read_block_bytes = 1000
+        try:
+            self.assertEqual(readblocks(100, 16, 40), [(0, 16), (16, 16), (32, 16), (48, 16), (64, 16), (80, 16), (96, 4)])
+            self.assertEqual(readblocks(100, 1, 100), [(r, 10) for r in range(0, 100, 10)])
+            self.assertEqual(readblocks(5, 1, 10), [(0, 5)])
+        finally:
+            PCMLConfig.read_block_bytes = 16 * 1024 * 1024
+
     def test_tiff_read_write(self):
         print "Testing tiff IO 1..."
         test_file = path.join(self.datadir, 'test_layer_tiff.tif')
@@ -88,3 +113,70 @@ class TestLayerIO(unittest.TestCase):
             l2 = ReadGeoTIFF(test_file, bandnumber = 10)
         remove(test_file)
 
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.arr = np.random.RandomState(0).randint(0, 5, (23, 6)).astype(float)
+        self.layer = lst_to_layer(self.arr.tolist())
+        self.filename = path.join(self.directory, 'input.asc')
+        WriteASCIIGrid(self.filename, self.layer)
+        # Room for blocks of 4 rows with a halo of 1 row, so each operation streams several blocks
+        PCMLConfig.stream_memory = 2 * (4 * 2 + 2) * 6 * 8
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        PCMLConfig.stream_memory = 1024 * 1024 * 1024
+        PCMLConfig.exectype = ExecutorType.parallelpythonqueue
+
+    def test_open_reads_rows_on_demand(self):
+        layer = OpenRaster(self.filename)
+        self.assertTrue(layer._data is None)
+        self.assertEqual((layer.nrows, layer.ncols), (23, 6))
+        self.assertTrue(allequal(layer.readrows(5, 3), self.arr[5:8]))
+        self.assertEqual(blockrows(23, 6, 1, 1, 1), 4)
+
+    def test_focal_file_to_file(self):
+        expected = FocalSum(self.layer, buffersize=1)._data
+        for exectype in [ExecutorType.serialpython, ExecutorType.parallelpythonqueue]:
+            PCMLConfig.exectype = exectype
+            PCMLConfig.num_procs = 2
+            PCMLConfig.stream_memory = 2 * 2 * (4 * 2 + 2) * 6 * 8
+            outfile = path.join(self.directory, 'output%i.asc' % exectype)
+            lo = FocalSum(OpenRaster(self.filename), buffersize=1, outputlayer=CreateRaster(outfile, self.layer))
+            self.assertTrue(isinstance(lo, RasterFile))
+            self.assertTrue(allequal(ReadASCIIGrid(outfile)._data, expected))
+
+    def test_ascii_output_written_again(self):
+        PCMLConfig.exectype = ExecutorType.serialpython
+        outfile = path.join(self.directory, 'output.asc')
+        output = CreateRaster(outfile, self.layer)
+        FocalSum(OpenRaster(self.filename), buffersize=1, outputlayer=output)
+        LocalClassify(OpenRaster(self.filename), classtype=3, outputlayer=output)
+        self.assertTrue(allequal(ReadASCIIGrid(outfile)._data, self.arr == 3))
+        self.assertTrue(allequal(output.get_nparray(), self.arr == 3))
+        # An ASCII grid opened as the input cannot be overwritten while it is read
+        layer = OpenRaster(self.filename)
+        self.assertRaises(PCMLOperationError, LocalClassify, layer, classtype=3, outputlayer=layer)
+        self.assertTrue(allequal(ReadASCIIGrid(self.filename)._data, self.arr))
+
+    def test_chained_operations_use_temporary_files(self):
+        PCMLConfig.exectype = ExecutorType.serialpython
+        lo = LocalClassify(FocalSum(OpenRaster(self.filename), buffersize=1), classtype=6)
+        self.assertTrue(lo.temporary)
+        self.assertFalse(path.exists(lo.filename))
+        self.assertTrue(allequal(lo.get_nparray(), LocalClassify(FocalSum(self.layer, buffersize=1), classtype=6)._data))
+
+    def test_npy_inputs_opened_read_only(self):
+        PCMLConfig.exectype = ExecutorType.serialpython
+        filename = path.join(self.directory, 'input.npy')
+        np.save(filename, self.arr)
+        layer = OpenRaster(filename)
+        self.assertFalse(layer._file.flags.writeable)
+        self.assertTrue(allequal(FocalSum(layer, buffersize=1).get_nparray(), FocalSum(self.layer, buffersize=1)._data))
+        # An opened file can still be used as an output layer
+        LocalClassify(self.layer, classtype=3, outputlayer=layer)
+        self.assertTrue(allequal(np.load(filename), self.arr == 3))
+
+    def test_memory_ceiling_too_small(self):
+        PCMLConfig.stream_memory = 100
+        self.assertRaises(PCMLOperationError, FocalSum, OpenRaster(self.filename), buffersize=1)
@@ -210,6 +210,35 @@ class TestLayerOperationsSerial(cml_test.PCMLSerialTestCase):
         res = np.asarray([[3]*4]*4)
         self.assertTrue(allequal(lo._data,res))
 
+    def test_LocalExpression(self):
+        lo = LocalExpression("(a+b)*c - d", a=self.l1, b=self.l2, c=self.l3, d=self.l6)
+        res = np.asarray([[14, 13, 12, 11]]*4)
+        self.assertTrue(allequal(lo._data, res))
+        # l5 = l1+(l2+l3)*l4
+        lo = LocalExpression("l1 + (l2 + l3) * l4", l1=self.l1, l2=self.l2, l3=self.l3, l4=lst_to_layer([[normolized_value(1.53)] * 4] * 4))
+        self.assertTrue(np.allclose(lo._data, self.l5._data))
+
+    def test_LocalExpression_conditions(self):
+        lo = LocalExpression("where(a > 2, a, 0) + (1 < a <= 3) + (10 if a == 4 else b)", a=self.l6, b=self.l2)
+        res = np.asarray([[2, 3, 6, 14]]*4)
+        self.assertTrue(allequal(lo._data, res))
+        lo = LocalExpression("sqrt(maximum(a, b)) * floor(1.5) + (a > 1 and not b > 2)", a=self.l6, b=self.l2)
+        self.assertTrue(np.allclose(lo._data, np.sqrt(np.maximum(self.l6._data, 2)) + (self.l6._data > 1)))
+
+    def test_LocalExpression_blocks(self):
+        cells = PCMLConfig.expression_block_cells
+        PCMLConfig.expression_block_cells = 4  # One row per block
+        try:
+            lo = LocalExpression("a * 2 + b", a=self.l8, b=self.l8)
+            self.assertTrue(np.allclose(lo._data, self.l8._data * 3))
+        finally:
+            PCMLConfig.expression_block_cells = cells
+
+    def test_LocalExpression_invalid(self):
+        for expression in ("a +", "a.__class__", "__import__('os')", "c + 1", "open('x')", "a[0]", "where(a, x=1)"):
+            with self.assertRaises(PCMLInvalidInput):
+                LocalExpression(expression, a=self.l1, b=self.l2)
+
  
 class TestLayerOperationsParallel(TestLayerOperationsSerial):
     def setUp(self):
@@ -217,6 +246,18 @@ class TestLayerOperationsParallel(TestLayerOperationsSerial):
         PCMLConfig.num_procs = 4
         PCMLConfig.exectype = ExecutorType.parallelpythonqueue
 
+class TestLayerOperationsPersistentPool(TestLayerOperationsSerial):
+    def setUp(self):
+        super(TestLayerOperationsPersistentPool, self).setUp()
+        PCMLConfig.num_procs = 4
+        PCMLConfig.exectype = ExecutorType.persistentpool
+
+class TestLayerOperationsThreadPool(TestLayerOperationsSerial):
+    def setUp(self):
+        super(TestLayerOperationsThreadPool, self).setUp()
+        PCMLConfig.num_procs = 4
+        PCMLConfig.exectype = ExecutorType.threadpool
+
 if __name__ == '__main__':
     unittest.main()
 
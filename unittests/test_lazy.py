@@ -0,0 +1,102 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+"""
+from pcml import *
+from pcml.util.LayerBuilder import *
+from numpy.ma import allequal
+import numpy as np
+import pcml
+import os
+import shutil
+import tempfile
+import unittest
+
+# Number of times LocalCountedSum ran (serial execution runs in this process)
+runs = []
+
+@executor
+@localoperation
+def LocalCountedSum(self, subdomains):
+    runs.append(subdomains[0].r)
+    outsubdomain = subdomains[0]
+    outsubdomain.get_nparray()[:, :] = sum(subdomain.get_nparray() for subdomain in subdomains[1:])
+
+class TestLazy(unittest.TestCase):
+    def setUp(self):
+        PCMLConfig.exectype = ExecutorType.serialpython
+        PCMLConfig.decomposition_granularity = 16
+        del runs[:]
+        self.l1 = lst_to_layer([[1]*4]*4)
+        self.l2 = lst_to_layer([[2]*4]*4)
+
+    def tearDown(self):
+        PCMLConfig.lazy = False
+        PCMLConfig.exectype = ExecutorType.parallelpythonqueue
+
+    def test_operations_deferred_until_compute(self):
+        with pcml.lazy():
+            lo = LocalCountedSum(self.l1, self.l2)
+            self.assertTrue(isinstance(lo, LazyLayer))
+            self.assertEqual(runs, [])
+        self.assertFalse(PCMLConfig.lazy)
+        self.assertTrue(allequal(lo.compute()._data, [[3]*4]*4))
+        self.assertEqual(len(runs), 1)
+        # Attributes of the computed layer can be used directly
+        self.assertEqual(lo.nrows, 4)
+        self.assertEqual(len(runs), 1)
+
+    def test_common_subexpressions_computed_once(self):
+        PCMLConfig.lazy = True
+        a = LocalCountedSum(self.l1, self.l2)
+        b = LocalCountedSum(self.l1, self.l2)
+        self.assertTrue(a is b)
+        self.assertFalse(LocalCountedSum(self.l2, self.l1) is a)
+        self.assertFalse(FocalSum(self.l1, buffersize=1) is FocalSum(self.l1, buffersize=2))
+        lo = LocalCountedSum(LocalCountedSum(a, self.l1), LocalCountedSum(b, self.l2))
+        self.assertTrue(allequal(lo.compute()._data, [[9]*4]*4))
+        self.assertEqual(len(runs), 4)
+
+    def test_dead_intermediates_freed(self):
+        with pcml.lazy():
+            a = LocalCountedSum(self.l1, self.l2)
+            b = LocalCountedSum(a, a)
+            lo = LocalCountedSum(b, self.l1)
+        lo.compute()
+        self.assertTrue(lo.iscomputed())
+        self.assertFalse(a.iscomputed())
+        self.assertFalse(b.iscomputed())
+        # A freed intermediate is computed again when it is used
+        self.assertTrue(allequal(b._data, [[6]*4]*4))
+        self.assertTrue(allequal(lo._data, [[7]*4]*4))
+
+    def test_shared_intermediate_kept_for_other_roots(self):
+        with pcml.lazy():
+            a = LocalCountedSum(self.l1, self.l2)
+            first = LocalCountedSum(a, self.l1)
+            second = LocalCountedSum(a, self.l2)
+        self.assertTrue(allequal(first.compute()._data, [[4]*4]*4))
+        self.assertTrue(a.iscomputed())  # second still reads it
+        self.assertTrue(allequal(second.compute()._data, [[5]*4]*4))
+        self.assertEqual(len(runs), 3)
+        self.assertFalse(a.iscomputed())
+
+    def test_eager_operation_computes_lazy_inputs(self):
+        with pcml.lazy():
+            a = FocalSum(self.l1, buffersize=1)
+        lo = LocalSum(a, self.l2)
+        self.assertTrue(allequal(lo._data[1], [8, 11, 11, 8]))
+
+    def test_write_computes(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with pcml.lazy():
+                lo = LocalSum(self.l1, self.l2)
+            WriteASCIIGrid(os.path.join(directory, 'lazy.asc'), lo)
+            self.assertTrue(allequal(ReadASCIIGrid(os.path.join(directory, 'lazy.asc'))._data, [[3]*4]*4))
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+"""
+from pcml import *
+from pcml.util.LayerBuilder import *
+from numpy.ma import allequal
+import numpy as np
+import pcml
+import unittest
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        PCMLConfig.exectype = ExecutorType.serialpython
+        PCMLConfig.decomposition_granularity = 3
+        self.landcover = lst_to_layer(np.random.RandomState(0).randint(0, 5, (10, 7)).tolist())
+        self.elevation = lst_to_layer(np.arange(70).reshape(10, 7).tolist())
+
+    def tearDown(self):
+        PCMLConfig.exectype = ExecutorType.parallelpythonqueue
+        PCMLConfig.lazy = False
+
+    def test_operations_without_layers_are_stages(self):
+        stage = FocalMean(buffersize=2)
+        self.assertTrue(isinstance(stage, PipelineStage))
+        self.assertEqual(stage.buffersize, 2)
+        self.assertEqual(stage.layers, (Ellipsis,))
+        self.assertEqual(pipeline(FocalSum(buffersize=2), FocalMean(buffersize=1), LocalClassify()).buffersize(), 3)
+
+    def test_buffer_classify(self):
+        water = FocalBuffer(self.landcover, buffersize=1, classtype=3)
+        eager = LocalClassify(water, classtype=3)
+        lo = pipeline(FocalBuffer(buffersize=1, classtype=3), LocalClassify(classtype=3))(self.landcover)
+        self.assertTrue(allequal(lo._data, eager._data))
+
+    def test_chained_focal_and_local_stages(self):
+        eager = LocalSum(FocalMean_np_exec(FocalSum(self.landcover, buffersize=2), buffersize=1), self.elevation)
+        stages = pipeline(FocalSum(buffersize=2), FocalMean_np_exec(buffersize=1), LocalSum(Ellipsis, self.elevation))
+        for exectype in [ExecutorType.serialpython, ExecutorType.parallelpythonqueue]:
+            PCMLConfig.exectype = exectype
+            lo = stages(self.landcover)
+            self.assertTrue(np.allclose(lo._data, eager._data))
+
+    def test_expression_stage(self):
+        eager = LocalExpression("a*2 + b", a=FocalMean(self.landcover, buffersize=1), b=self.elevation)
+        lo = pipeline(FocalMean(buffersize=1), LocalExpression("a*2 + b", a=Ellipsis, b=self.elevation))(self.landcover)
+        self.assertTrue(np.allclose(lo._data, eager._data))
+
+    def test_lazy_pipeline(self):
+        with pcml.lazy():
+            lo = pipeline(FocalSum(buffersize=1), LocalClassify(classtype=9))(self.landcover)
+            self.assertTrue(isinstance(lo, LazyLayer))
+        self.assertTrue(allequal(lo._data, LocalClassify(FocalSum(self.landcover, buffersize=1), classtype=9)._data))
+
+    def test_invalid_stages(self):
+        self.assertRaises(PCMLInvalidInput, pipeline)
+        self.assertRaises(PCMLInvalidInput, pipeline, self.landcover)
+        self.assertRaises(PCMLInvalidInput, pipeline, LocalSum(Ellipsis, Ellipsis))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+"""
+from pcml import *
+from pcml.util.LayerBuilder import *
+import numpy as np
+import unittest
+
+class TestPlanner(unittest.TestCase):
+    def setUp(self):
+        self.previous = dict((name, getattr(PCMLConfig, name)) for name in
+                             ['exectype', 'num_procs', 'decomposition_granularity', 'planner_process_seconds',
+                              'planner_task_seconds', 'planner_steal_seconds', 'planner_thread_seconds',
+                              'planner_gil_fraction'])
+        PCMLConfig.num_procs = 4
+        PCMLConfig.decomposition_granularity = 2
+        self.small = lst_to_layer([[1, 2, 3, 4]] * 4)
+        self.large = lst_to_layer(np.random.RandomState(0).rand(400, 30).tolist())
+
+    def tearDown(self):
+        for name, value in self.previous.items():
+            setattr(PCMLConfig, name, value)
+
+    def test_small_layers_run_serially(self):
+        plan = FocalSum.explain(self.small, buffersize=1)
+        self.assertEqual(plan.exectype, ExecutorType.serialpython)
+        self.assertEqual(plan.subdomains, 1)
+        self.assertTrue(plan.seconds > 0 and plan.nbytes >= 16 * 8)
+
+    def test_parallel_when_startup_is_free(self):
+        PCMLConfig.planner_process_seconds = 0
+        PCMLConfig.planner_task_seconds = 0
+        plan = FocalSum.explain(self.large, buffersize=1)
+        self.assertEqual(plan.exectype, ExecutorType.parallelpythonqueue)
+        self.assertEqual(plan.num_procs, 4)
+        # Smaller subdomains carry relatively more halo, so one subdomain per process is predicted fastest
+        self.assertEqual(plan.granularity, 100)
+        # Planning does not change the configuration
+        self.assertEqual(PCMLConfig.decomposition_granularity, 2)
+
+    def test_work_stealing_when_queue_is_slow(self):
+        PCMLConfig.planner_process_seconds = 0
+        PCMLConfig.planner_task_seconds = 1
+        plan = FocalSum.explain(self.large, buffersize=1)
+        self.assertEqual(plan.exectype, ExecutorType.workstealing)
+
+    def test_warm_persistent_pool_is_not_started_again(self):
+        PCMLConfig.planner_process_seconds = 1
+        PCMLConfig.planner_task_seconds = 0
+        with PersistentPool(3):
+            plan = FocalSum.explain(self.large, buffersize=1)
+        self.assertEqual(plan.exectype, ExecutorType.persistentpool)
+        self.assertEqual(plan.num_procs, 3)
+        # Without a running pool the processes must be started, which is slower than running serially
+        shutdownpool()
+        self.assertEqual(FocalSum.explain(self.large, buffersize=1).exectype, ExecutorType.serialpython)
+
+    def test_threads_when_executor_releases_gil(self):
+        if not PCMLConfig.futuresenabled:
+            self.skipTest("concurrent.futures is not installed")
+        PCMLConfig.planner_process_seconds = 1
+        plan = FocalSum.explain(self.large, buffersize=1)
+        self.assertEqual(plan.exectype, ExecutorType.serialpython)  # Threads holding the GIL run one at a time
+        PCMLConfig.planner_gil_fraction = 0
+        PCMLConfig.planner_thread_seconds = 0
+        plan = FocalSum.explain(self.large, buffersize=1)
+        self.assertEqual(plan.exectype, ExecutorType.threadpool)
+        self.assertEqual(plan.num_procs, 4)
+
+    def test_auto_executor(self):
+        expected = FocalSum(self.large, buffersize=2)._data
+        PCMLConfig.exectype = ExecutorType.auto
+        for planner_process_seconds in [0.01, 0]:
+            PCMLConfig.planner_process_seconds = planner_process_seconds
+            self.assertTrue(np.allclose(FocalSum(self.large, buffersize=2)._data, expected))
+            self.assertEqual(PCMLConfig.exectype, ExecutorType.auto)
+            self.assertEqual(PCMLConfig.num_procs, 4)
+
+    def test_zonal_operations_keep_granularity(self):
+        zones = lst_to_layer([[1, 1, 2, 2]] * 4)
+        plan = ZonalSum_exec.explain(zones, self.small)
+        self.assertEqual(plan.granularity, 2)
+
+if __name__ == '__main__':
+    unittest.main()
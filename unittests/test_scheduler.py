@@ -0,0 +1,201 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+"""
+from pcml import *
+from pcml.core.Scheduler import costbalancedranges
+from pcml.core.TaskMonitor import TaskMonitor
+from pcml.util.LayerBuilder import *
+from numpy.ma import allequal
+import numpy as np
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+# Fails (or sleeps) on the first attempt at each subdomain, a marker file records the first attempt
+@executor
+@localoperation
+def LocalFlakyIncrement(self, subdomains):
+    outsubdomain, insubdomain = subdomains
+    marker = os.path.join(self.kwargs['markerdir'], "%i" % outsubdomain.r)
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        if self.kwargs.get('sleep'):
+            if outsubdomain.r == 0:
+                time.sleep(self.kwargs['sleep'])
+        else:
+            raise ValueError("First attempt at subdomain %i fails" % outsubdomain.r)
+    outsubdomain.get_nparray()[:, :] = insubdomain.get_nparray() + 1
+
+@executor
+@localoperation
+def LocalAlwaysFails(self, subdomains):
+    raise ValueError("LocalAlwaysFails always fails")
+
+class TestSchedulerCost(unittest.TestCase):
+    def setUp(self):
+        PCMLConfig.decomposition_granularity = 3
+        self.layer = lst_to_layer([[1]*6]*10)
+
+    def tearDown(self):
+        PCMLConfig.decomposition_granularity = 16
+
+    def subdomainlists(self, buffersize):
+        out = rowdecomposition(self.layer, 0)
+        inp = rowdecomposition(self.layer, buffersize)
+        return map(list, zip(out, inp))
+
+    def test_subdomaincost_counts_halo(self):
+        subdomainlists = self.subdomainlists(2)
+        # First subdomain: 3 output rows and 5 input rows (halo only below), 6 columns
+        self.assertEqual(subdomaincost(subdomainlists[0]), 3 * 6 + 5 * 6)
+        # Second subdomain has a halo above and below
+        self.assertEqual(subdomaincost(subdomainlists[1]), 3 * 6 + 7 * 6)
+
+    def test_costorder_longest_first(self):
+        subdomainlists = self.subdomainlists(2)
+        order = costorder(subdomainlists)
+        costs = [subdomaincost(subdomainlists[i]) for i in order]
+        self.assertEqual(costs, sorted(costs, reverse=True))
+        self.assertEqual(order[-1], 3)  # The last subdomain has a single row
+
+    def test_costbalancedranges_cover_all_tasks(self):
+        subdomainlists = self.subdomainlists(1)
+        order = costorder(subdomainlists)
+        for num_procs in (1, 2, 3, 6):
+            bounds = costbalancedranges(subdomainlists, order, num_procs)
+            self.assertEqual(len(bounds), 2 * num_procs)
+            self.assertEqual(bounds[0], 0)
+            self.assertEqual(bounds[-1], len(order))
+            for rank in xrange(num_procs - 1):
+                self.assertEqual(bounds[2 * rank + 1], bounds[2 * rank + 2])
+
+class TestWorkStealing(unittest.TestCase):
+    def setUp(self):
+        PCMLConfig.exectype = ExecutorType.workstealing
+        PCMLConfig.decomposition_granularity = 1
+
+    def tearDown(self):
+        PCMLConfig.decomposition_granularity = 16
+
+    def test_more_processes_than_subdomains(self):
+        PCMLConfig.num_procs = 8
+        l1 = lst_to_layer([[1]*3]*3)
+        lo = FocalSum(l1, buffersize=1)
+        self.assertTrue(allequal(lo._data, [[4,6,4],[6,9,6],[4,6,4]]))
+
+    def test_many_subdomains(self):
+        PCMLConfig.num_procs = 3
+        l1 = lst_to_layer([[1]*4]*40)
+        l2 = lst_to_layer([[2]*4]*40)
+        lo = LocalSum_np(l1, l2)
+        self.assertTrue(allequal(lo._data, [[3]*4]*40))
+
+class TestThreadPool(unittest.TestCase):
+    def setUp(self):
+        PCMLConfig.num_procs = 3
+        PCMLConfig.exectype = ExecutorType.threadpool
+        PCMLConfig.decomposition_granularity = 2
+
+    def tearDown(self):
+        PCMLConfig.decomposition_granularity = 16
+
+    def test_layer_without_shared_memory(self):
+        # Threads share the process memory, so layers do not need a shared segment
+        l1 = Layer(0, 0, 5, 4, 'private layer')
+        l1.cellsize = 1
+        l1.set_data_ref(np.ones((5, 4)))
+        lo = FocalSum(l1, buffersize=1)
+        self.assertTrue(allequal(lo._data[2], [6, 9, 9, 6]))
+        lo = LocalSum_np(l1, lo)
+        self.assertTrue(allequal(lo._data[0], [5, 7, 7, 5]))
+
+class TestTaskMonitor(unittest.TestCase):
+    def setUp(self):
+        self.factor, self.mintime = PCMLConfig.speculation_factor, PCMLConfig.speculation_min_time
+        PCMLConfig.speculation_min_time = 0.0
+
+    def tearDown(self):
+        PCMLConfig.speculation_factor, PCMLConfig.speculation_min_time = self.factor, self.mintime
+
+    def test_straggler_detected_and_first_result_kept(self):
+        monitor = TaskMonitor(xrange(3))
+        for taskid in xrange(3):
+            monitor.start(taskid, taskid)
+        monitor.finish(1, 1)
+        monitor.finish(2, 2)
+        monitor.starts[0][0] = (0, time.time() - 10.0)
+        self.assertEqual(monitor.stragglers(), [0])
+        monitor.speculate(0)
+        monitor.start(0, 1)
+        self.assertEqual(monitor.stragglers(), [])
+        self.assertTrue(monitor.finish(0, 1))
+        self.assertFalse(monitor.finish(0, 0))
+        self.assertTrue(monitor.complete())
+
+    def test_retries_then_fails(self):
+        monitor = TaskMonitor([0])
+        for attempt in xrange(PCMLConfig.task_retries):
+            monitor.start(0, 0)
+            self.assertTrue(monitor.fail(0, 0, "failed"))
+        monitor.start(0, 0)
+        self.assertFalse(monitor.fail(0, 0, "failed"))
+        self.assertEqual(monitor.failed, {0: "failed"})
+        self.assertTrue(monitor.complete())
+
+class TestRetryAndSpeculation(unittest.TestCase):
+    def setUp(self):
+        PCMLConfig.num_procs = 2
+        PCMLConfig.decomposition_granularity = 2
+        self.mintime = PCMLConfig.speculation_min_time
+        PCMLConfig.speculation_min_time = 0.2
+        self.markerdir = tempfile.mkdtemp()
+        self.l1 = lst_to_layer([[1]*4]*8)
+
+    def tearDown(self):
+        shutil.rmtree(self.markerdir)
+        shutdownpool()
+        PCMLConfig.speculation_min_time = self.mintime
+        PCMLConfig.decomposition_granularity = 16
+        PCMLConfig.exectype = ExecutorType.parallelpythonqueue
+
+    def test_failed_subdomains_retried(self):
+        for exectype in (ExecutorType.parallelpythonqueue, ExecutorType.persistentpool, ExecutorType.workstealing,
+                         ExecutorType.threadpool):
+            PCMLConfig.exectype = exectype
+            for marker in os.listdir(self.markerdir):
+                os.remove(os.path.join(self.markerdir, marker))
+            lo = LocalFlakyIncrement(self.l1, markerdir=self.markerdir)
+            self.assertTrue(allequal(lo._data, [[2]*4]*8))
+
+    def test_failures_reported(self):
+        for exectype in (ExecutorType.parallelpythonqueue, ExecutorType.persistentpool, ExecutorType.workstealing,
+                         ExecutorType.threadpool):
+            PCMLConfig.exectype = exectype
+            with self.assertRaises(PCMLOperationError):
+                LocalAlwaysFails(self.l1)
+
+    def test_straggler_duplicated(self):
+        for exectype in (ExecutorType.parallelpythonqueue, ExecutorType.persistentpool):
+            PCMLConfig.exectype = exectype
+            for marker in os.listdir(self.markerdir):
+                os.remove(os.path.join(self.markerdir, marker))
+            started = time.time()
+            lo = LocalFlakyIncrement(self.l1, markerdir=self.markerdir, sleep=30)
+            self.assertTrue(time.time() - started < 20)
+            self.assertTrue(allequal(lo._data, [[2]*4]*8))
+
+    def test_straggler_stops_writing_after_run(self):
+        PCMLConfig.exectype = ExecutorType.persistentpool
+        lo = LocalFlakyIncrement(self.l1, markerdir=self.markerdir, sleep=2)
+        self.assertTrue(allequal(lo._data, [[2]*4]*8))
+        # The original copy of the straggler would write to the output once its sleep is over
+        lo._data[:, :] = 0
+        time.sleep(3)
+        self.assertTrue(allequal(lo._data, [[0]*4]*8))
+
+if __name__ == '__main__':
+    unittest.main()
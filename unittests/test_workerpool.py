@@ -0,0 +1,136 @@
+"""
+Copyright (c) 2014 High-Performance Computing and GIS (HPCGIS) Laboratory. All rights reserved.
+Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+Authors and contributors: Eric Shook (eshook@kent.edu); Zhengliang Feng (odayfans@gmail.com, zfeng2@kent.edu)
+"""
+from pcml import *
+from pcml.util.LayerBuilder import *
+from numpy.ma import allequal
+import numpy as np
+import pickle
+import unittest
+
+# Fails on every subdomain to check errors are reported by the workers
+@executor
+@localoperation
+def LocalFailure(self, subdomains):
+    raise ValueError("LocalFailure always fails")
+
+class TestPersistentPool(unittest.TestCase):
+    def setUp(self):
+        PCMLConfig.num_procs = 2
+        PCMLConfig.exectype = ExecutorType.persistentpool
+        PCMLConfig.decomposition_granularity = 2
+        self.l1 = lst_to_layer([[1]*5]*7)
+        self.l2 = lst_to_layer([[2]*5]*7)
+
+    def tearDown(self):
+        shutdownpool()
+        PCMLConfig.decomposition_granularity = 16
+
+    def test_pool_reused_across_operations(self):
+        pool = getpool()
+        pids = [worker.pid for worker in pool._workers]
+        lo = LocalSum_np(self.l1, self.l2)
+        lo = FocalSum(lo, buffersize=1)
+        self.assertTrue(getpool() is pool)
+        self.assertEqual(pids, [worker.pid for worker in pool._workers])
+        self.assertEqual(lo._data[0][0], 12)
+        self.assertEqual(lo._data[3][2], 27)
+
+    def test_pool_context_manager(self):
+        with PersistentPool(3) as pool:
+            self.assertTrue(getpool() is pool)
+            self.assertTrue(pool.isrunning())
+            lo = LocalMult_np(self.l1, self.l2)
+            self.assertTrue(allequal(lo._data, self.l2._data))
+        self.assertFalse(pool.isrunning())
+        self.assertFalse(getpool() is pool)
+
+    def test_pool_shutdown_and_restart(self):
+        pool = PersistentPool(2)
+        pool.start()
+        pool.shutdown()
+        self.assertFalse(pool.isrunning())
+        with pool:
+            lo = LocalSum(self.l1, self.l2)
+        self.assertTrue(allequal(lo._data, [[3]*5]*7))
+
+    def test_pool_reports_failures(self):
+        with self.assertRaises(PCMLOperationError):
+            LocalFailure(self.l1)
+
+    def test_local_operation_falls_back(self):
+        @localoperation
+        def LocalAddOne(self, locations, subdomains):
+            return locations[0]['v'] + 1
+        lo = LocalAddOne(self.l1)
+        self.assertTrue(allequal(lo._data, self.l2._data))
+
+class TestSubdomainDescriptor(unittest.TestCase):
+    def setUp(self):
+        PCMLConfig.decomposition_granularity = 50
+        self.layer = Layer(0, 0, 400, 300, 'large layer')
+        self.layer.set_nparray(np.arange(400 * 300.0).reshape((400, 300)), 1, -9999)
+
+    def tearDown(self):
+        PCMLConfig.decomposition_granularity = 16
+
+    def test_subdomain_pickles_as_descriptor(self):
+        subdomains = columndecomposition(self.layer, 2)
+        message = pickle.dumps(subdomains[2], 2)
+        self.assertTrue(len(message) < 1000)
+        subdomain = pickle.loads(message)
+        self.assertEqual((subdomain.r, subdomain.c, subdomain.nrows, subdomain.ncols), (0, 98, 400, 54))
+        self.assertTrue(allequal(subdomain.get_nparray(), subdomains[2].get_nparray()))
+        # The unpickled subdomain maps the same memory as the layer
+        subdomain.get_nparray()[1][1] = -1
+        self.assertEqual(self.layer.get_nparray()[1][99], -1)
+
+    def test_private_arrays_are_copied(self):
+        subdomain = Subdomain(0, 0, 2, 2, 'private subdomain')
+        subdomain.cellsize = 1
+        subdomain.set_data_ref(np.ones((2, 2)))
+        copy = pickle.loads(pickle.dumps(subdomain, 2))
+        self.assertTrue(allequal(copy.get_nparray(), subdomain.get_nparray()))
+
+class TestLocality(unittest.TestCase):
+    def setUp(self):
+        PCMLConfig.num_procs = 2
+        PCMLConfig.exectype = ExecutorType.persistentpool
+        PCMLConfig.decomposition_granularity = 2
+        self.l1 = lst_to_layer([[1]*5]*8)
+
+    def tearDown(self):
+        shutdownpool()
+        PCMLConfig.decomposition_granularity = 16
+
+    def test_localityqueue_prefers_then_steals(self):
+        pending = LocalityQueue([0, 1])
+        for taskid in (0, 1, 2):
+            pending.put(taskid, 1)
+        pending.put(3)
+        self.assertEqual(len(pending), 4)
+        self.assertEqual(pending.get(1), 0)
+        self.assertEqual(pending.get(0), 3)  # Shared tasks before stealing
+        self.assertEqual(pending.get(0, steal=False), None)
+        self.assertEqual(pending.get(0), 2)  # Steals from the back
+        self.assertEqual(pending.get(1), 1)
+        self.assertEqual(pending.get(0), None)
+
+    def test_next_operation_prefers_producer(self):
+        pool = getpool()
+        lo = LocalSum_np(self.l1, self.l1)
+        self.assertEqual(len(pool.assignments), 4)
+        subdomainlists = zip(rowdecomposition(lo, 0), rowdecomposition(lo, 1))
+        for taskid, rank in pool.assignments.items():
+            self.assertEqual(pool.preferredrank(subdomainlists[taskid]), rank)
+        # A zonal read of a layer produced half by each worker has no preferred worker
+        pool._produced[lo._segment.path] = [(0, 0, 4, 5, 0), (4, 0, 4, 5, 1)]
+        self.assertEqual(pool.preferredrank([None, rowdecomposition(lo, -1)[0]]), None)
+        self.assertEqual(pool.preferredrank(subdomainlists[1]), 0)
+        lo = FocalSum(lo, buffersize=1)
+        self.assertTrue(allequal(lo._data[3], [12, 18, 18, 18, 12]))
+
+if __name__ == '__main__':
+    unittest.main()